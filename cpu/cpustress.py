@@ -18,12 +18,21 @@
 Stress test for CPU
 """
 
+import os
+import json
+import time
+import sys
+import threading
 import multiprocessing
 from random import randint
 from avocado import Test
-from avocado.utils import process, cpu, distro
+from avocado.utils import process, cpu, distro, genio
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.kmsg import KmsgReader  # noqa: E402
+
 
 pids = []
 totalcpus = int(multiprocessing.cpu_count()) - 1
@@ -35,8 +44,26 @@ errorlog = ['WARNING: CPU:', 'Oops',
             'Call Trace:']
 
 
-def collect_dmesg(object):
-    object.whiteboard = process.system_output("dmesg").decode('utf-8')
+def latency_stats(samples):
+    """
+    Percentiles in milliseconds and a power of two histogram of samples
+    """
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    histogram = {}
+    for sample in samples:
+        bucket = 1
+        while bucket < sample * 1000:
+            bucket *= 2
+        histogram['<=%sms' % bucket] = histogram.get('<=%sms' % bucket, 0) + 1
+
+    def percentile(pct):
+        return round(samples[min(len(samples) - 1,
+                                 len(samples) * pct // 100)] * 1000, 3)
+    return {'count': len(samples), 'p50_ms': percentile(50),
+            'p90_ms': percentile(90), 'p99_ms': percentile(99),
+            'max_ms': round(samples[-1] * 1000, 3), 'histogram': histogram}
 
 
 class cpustresstest(Test):
@@ -73,16 +100,29 @@ class cpustresstest(Test):
                 self.cancel("%s is required to continue..." % pkg)
         self.iteration = int(self.params.get('iteration', default='10'))
         self.tests = self.params.get('test', default='all')
+        self.parallel = int(self.params.get('hotplug_parallel', default=1))
+        self.latency = {}
+        self.scenario = 'setup'
+        self.lock = threading.Lock()
+        try:
+            self.kmsg = KmsgReader()
+        except OSError:
+            self.log.info("/dev/kmsg not readable, checking dmesg instead")
+            self.kmsg = None
+
+    def __clear_dmesg(self):
+        if self.kmsg:
+            self.kmsg.read()
+        else:
+            process.run("dmesg -C", sudo=True)
 
-    @staticmethod
-    def __clear_dmesg():
-        process.run("dmesg -C", sudo=True)
-
-    @staticmethod
-    def __error_check():
+    def __error_check(self):
         ERROR = []
-        logs = process.system_output("dmesg -Txl 1,2,3,4"
-                                     "").decode("utf-8").splitlines()
+        if self.kmsg:
+            logs = [log for level, _, log in self.kmsg.read() if level <= 4]
+        else:
+            logs = process.system_output("dmesg -Txl 1,2,3,4"
+                                         "").decode("utf-8").splitlines()
         for error in errorlog:
             for log in logs:
                 if error in log:
@@ -96,22 +136,67 @@ class cpustresstest(Test):
             return False
         return True
 
-    @staticmethod
-    def __online_cpus(cores):
-        for cpus in range(cores):
-            cpu.online(cpus)
+    def set_cpu(self, core, online):
+        """
+        Onlines or offlines a cpu, timing the sysfs write until the cpuhp
+        state of the cpu reached its target
 
-    @staticmethod
-    def __offline_cpus(cores):
-        for cpus in range(cores):
-            cpu.offline(cpus)
+        :return: True if the cpu ended up in the requested state
+        """
+        base = '/sys/devices/system/cpu/cpu%s' % core
+        if not os.path.exists('%s/online' % base):
+            return online
+        if cpu._get_status(core) == online:
+            return True
+        operation = 'online' if online else 'offline'
+        start = time.time()
+        try:
+            with open('%s/online' % base, 'wb') as online_file:
+                online_file.write(b'1' if online else b'0')
+        except (IOError, OSError) as details:
+            self.log.info("%s of cpu%s failed: %s", operation, core, details)
+            return False
+        if os.path.exists('%s/hotplug/state' % base):
+            target = genio.read_file('%s/hotplug/target' % base)
+            deadline = start + 5
+            while genio.read_file('%s/hotplug/state' % base) != target and \
+                    time.time() < deadline:
+                time.sleep(0.001)
+        elapsed = time.time() - start
+        with self.lock:
+            self.latency.setdefault(self.scenario, {}).setdefault(
+                operation, []).append(elapsed)
+        return cpu._get_status(core) == online
+
+    def set_cpus(self, cores, action):
+        """
+        Runs action on every core, hotplug_parallel threads at a time
+        """
+        cores = list(cores)
 
-    @staticmethod
-    def __cpu_toggle(core):
-        if cpu._get_cpu_status(core):
-            cpu.offline(core)
-        else:
-            cpu.online(core)
+        def worker():
+            while True:
+                try:
+                    core = cores.pop(0)
+                except IndexError:
+                    return
+                action(core)
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(min(self.parallel, len(cores)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def __online_cpus(self, cores):
+        self.set_cpus(range(cores), lambda core: self.set_cpu(core, True))
+
+    def __offline_cpus(self, cores):
+        self.set_cpus(range(cores), lambda core: self.set_cpu(core, False))
+
+    def __cpu_toggle(self, core):
+        self.set_cpu(core, not cpu._get_status(core))
 
     @staticmethod
     def __kill_process(pids):
@@ -133,17 +218,34 @@ class cpustresstest(Test):
         else:
             tests = self.tests.split()
 
+        errors = []
         for method in tests:
             self.log.info("\nTEST: %s\n", method)
             self.__clear_dmesg()
+            self.scenario = method
             run_test = 'self.%s()' % method
             eval(run_test)
             msg = self.__error_check()
             if msg:
-                collect_dmesg()
+                errors.append(msg)
                 self.log.info('Test: %s. ERROR Message: %s', run_test, msg)
             self.log.info("\nEND: %s\n", method)
 
+        latency = {}
+        for scenario, operations in self.latency.items():
+            latency[scenario] = {}
+            for operation, samples in operations.items():
+                latency[scenario][operation] = latency_stats(samples)
+                self.log.info("%s: cpu %s latency %s", scenario, operation,
+                              latency[scenario][operation])
+        with open(os.path.join(self.outputdir, 'cpu_hotplug_latency.json'),
+                  'w') as latency_file:
+            json.dump(latency, latency_file, indent=2)
+        if errors:
+            self.whiteboard = "\n".join(errors)
+        else:
+            self.whiteboard = json.dumps(latency, sort_keys=True)
+
     def cpu_serial_off_on(self):
         """
         Offline all the cpus serially and online again
@@ -157,20 +259,20 @@ class cpustresstest(Test):
             if totalcpus != 0:
                 for cpus in range(1, totalcpus):
                     self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
+                    self.set_cpu(cpus, False)
             self.log.info("Online CPU's in reverse order %s", totalcpus)
             for cpus in range(totalcpus, -1, -1):
                 self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+                self.set_cpu(cpus, True)
             self.log.info("Offline CPU's in reverse order %s", totalcpus)
             if totalcpus != 0:
                 for cpus in range(totalcpus, -1, -2):
                     self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
+                    self.set_cpu(cpus, False)
             self.log.info("Online CPU's in serial")
             for cpus in range(0, totalcpus):
                 self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+                self.set_cpu(cpus, True)
 
     def single_cpu_toggle(self):
         """
@@ -182,22 +284,25 @@ class cpustresstest(Test):
             for _ in range(self.iteration):
                 if totalcpus != 0:
                     self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
+                    self.set_cpu(cpus, False)
                 self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+                self.set_cpu(cpus, True)
+
+    def toggle_off_on(self, core):
+        if totalcpus != 0:
+            self.log.info("Offlining cpu%s", core)
+            self.set_cpu(core, False)
+        self.log.info("Onlining cpu%s", core)
+        self.set_cpu(core, True)
 
     def cpu_toggle_one_by_one(self):
         """
         Wait for the given timeout between Off/On single cpu.
-        loop over all cpus for given iteration.
+        loop over all cpus for given iteration, hotplug_parallel cpus
+        toggled at once.
         """
         for _ in range(self.iteration):
-            for cpus in range(totalcpus):
-                if totalcpus != 0:
-                    self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
-                self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+            self.set_cpus(range(totalcpus), self.toggle_off_on)
 
     def multiple_cpus_toggle(self):
         """
@@ -230,7 +335,7 @@ class cpustresstest(Test):
         self.log.info("\noffline cpus and see the affinity change")
         count = 0
         for pid in pids:
-            cpu.offline(count)
+            self.set_cpu(count, False)
             process.run("taskset -pc %s" % pid, ignore_status=True, shell=True)
             count = count + 1
 
@@ -240,7 +345,7 @@ class cpustresstest(Test):
         for proc in range(totalcpus):
             process.run("taskset -pc $((%s<<1)) $$" %
                         proc, ignore_status=True, shell=True)
-            cpu.offline(proc)
+            self.set_cpu(proc, False)
 
         self.__online_cpus(totalcpus)
 
@@ -302,3 +407,5 @@ class cpustresstest(Test):
             "ppc64_cpu --smt=off && ppc64_cpu --smt=on && ppc64_cpu --smt=%s"
             % self.curr_smt, shell=True)
         self.__online_cpus(totalcpus)
+        if getattr(self, 'kmsg', None):
+            self.kmsg.close()
@@ -21,6 +21,7 @@
 import os
 import json
 import re
+import sys
 import platform
 
 from avocado import Test
@@ -30,6 +31,10 @@ from avocado.utils import process
 from avocado.utils import build
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.stream import stream_run  # noqa: E402
+
 
 class Ebizzy(Test):
 
@@ -98,21 +103,36 @@ class Ebizzy(Test):
         args = args + ' ' + args2
 
         os.makedirs(os.path.join(self.logdir, "ebizzy_run"))
+        patterns = {'records': re.compile(r"(.*?) records/s"),
+                    'real_time': re.compile(r"real (.*?) s"),
+                    'user': re.compile(r"user (.*?) s"),
+                    'sys': re.compile(r"sys (.*?) s")}
         for ite in range(iterations):
-            results = process.system_output('%s %s %s/ebizzy %s'
-                                            % (perfstat, taskset, self.sourcedir, args)).decode("utf-8")
-            pattern = re.compile(r"(.*?) records/s")
-            records = pattern.findall(results)[0]
-            pattern = re.compile(r"real (.*?) s")
-            real = pattern.findall(results)[0].strip()
-            pattern = re.compile(r"user (.*?) s")
-            usr_time = pattern.findall(results)[0].strip()
-            pattern = re.compile(r"sys (.*?) s")
-            sys_time = pattern.findall(results)[0].strip()
-            json_object = json.dumps({'records': records,
-                                      'real_time': real,
-                                      'user': usr_time,
-                                      'sys': sys_time})
+            values = {}
+
+            def parse_line(line):
+                # the first match of each value is the one reported
+                for key, pattern in patterns.items():
+                    match = pattern.search(line)
+                    if match and key not in values:
+                        values[key] = match.group(1)
+
+            outfile = os.path.join(self.logdir, "ebizzy_run",
+                                   "run_%s.log" % (ite + 1))
+            result = stream_run('%s %s %s/ebizzy %s'
+                                % (perfstat, taskset, self.sourcedir, args),
+                                outfile, parse_line)
+            if result.exit_status:
+                self.fail("ebizzy exited with %s, see %s"
+                          % (result.exit_status, outfile))
+            missing = set(patterns) - set(values)
+            if missing:
+                self.fail("No %s in ebizzy output, see %s"
+                          % (", ".join(sorted(missing)), outfile))
+            json_object = json.dumps({'records': values['records'],
+                                      'real_time': values['real_time'].strip(),
+                                      'user': values['user'].strip(),
+                                      'sys': values['sys'].strip()})
 
             logfile = os.path.join(
                 self.logdir, "ebizzy_run", "run_%s.json" % (ite + 1))
@@ -23,16 +23,85 @@
 
 import os
 import glob
+import json
 import re
 import shutil
+import sqlite3
+import sys
+import time
+from threading import Thread
 
 import avocado
 from avocado import Test
+from avocado.core import data_dir
 from avocado.utils import process, build, git, distro, partition
 from avocado.utils import disk, data_structures, pmem
 from avocado.utils import genio
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.stream import stream_run  # noqa: E402
+from testlib.pmemcache import CachedPMem  # noqa: E402
+
+
+class CheckOutputParser(object):
+
+    """
+    Incremental parser of the output of an xfstests ./check run
+    """
+
+    TIME_RE = re.compile(r'^(\w+/\d{3})\s+(?:.*\s)?(\d+)s\s*$')
+    TEST_RE = re.compile(r'^(\w+/\d{3})\s')
+    SUMMARY = {'Ran:': 'ran', 'Not run:': 'notrun', 'Failures:': 'failures'}
+
+    def __init__(self):
+        self.summary = {'ran': [], 'notrun': [], 'failures': []}
+        self.durations = {}
+        self.seen = {'passed': 0, 'failed': [], 'notrun': 0}
+
+    def feed(self, line):
+        """
+        Parses one line of ./check output
+        """
+        line = line.rstrip('\n')
+        for prefix, key in self.SUMMARY.items():
+            if line.startswith(prefix):
+                self.summary[key].extend(line[len(prefix):].split())
+                return
+        match = self.TIME_RE.match(line)
+        if match:
+            self.durations[match.group(1)] = int(match.group(2))
+        match = self.TEST_RE.match(line)
+        if not match:
+            return
+        if '[not run]' in line:
+            self.seen['notrun'] += 1
+        elif 'mismatch' in line or '[failed' in line:
+            self.seen['failed'].append(match.group(1))
+        elif self.TIME_RE.match(line):
+            self.seen['passed'] += 1
+
+    def progress(self):
+        """
+        Returns the outcome of the tests finished so far
+        """
+        return dict(self.seen, durations=self.durations)
+
+    def results(self):
+        """
+        Returns (test, status, duration) for every test of the run
+        """
+        results = []
+        for test in self.summary['ran']:
+            if test in self.summary['failures']:
+                results.append((test, 'fail', self.durations.get(test)))
+            else:
+                results.append((test, 'pass', self.durations.get(test)))
+        for test in self.summary['notrun']:
+            results.append((test, 'notrun', None))
+        return results
+
 
 class Xfstests(Test):
 
@@ -65,7 +134,7 @@ class Xfstests(Test):
     def setup_nvdimm(self):
         self.logflag = self.params.get('logdev', default=False)
 
-        self.plib = pmem.PMem()
+        self.plib = CachedPMem()
         self.plib.enable_region()
         regions = sorted(self.plib.run_ndctl_list('-R'),
                          key=lambda i: i['size'], reverse=True)
@@ -76,6 +145,8 @@ class Xfstests(Test):
         if self.plib.is_region_legacy(self.region):
             if not len(regions) > 1:
                 self.cancel("Not supported with single legacy region")
+            if self.shards > 1:
+                self.cancel("Sharded runs not supported with legacy regions")
             if self.logflag:
                 self.log.info("Using loop devices as log devices")
                 check = 2
@@ -140,16 +211,20 @@ class Xfstests(Test):
             else:
                 self.plib.destroy_namespace(region=self.region, force=True)
                 dev_size = self.get_half_region_size(self.region)
+                # Every shard gets its own TEST/SCRATCH namespace pair
+                size_align = self.get_size_alignval()
+                dev_size = ((dev_size // self.shards) // size_align) * \
+                    size_align
                 self.log_test = None
                 self.log_scratch = None
-            self.plib.create_namespace(region=self.region, size=dev_size)
-            self.plib.create_namespace(region=self.region, size=dev_size)
+            for _ in range(2 * self.shards):
+                self.plib.create_namespace(region=self.region, size=dev_size)
             namespaces = self.plib.run_ndctl_list('-N -r %s -m fsdax' % self.region)
-            pmem_dev = self.plib.run_ndctl_list_val(namespaces[0], 'blockdev')
-            self.test_dev = "/dev/%s" % pmem_dev
-            pmem_dev = self.plib.run_ndctl_list_val(namespaces[1], 'blockdev')
-            self.scratch_dev = "/dev/%s" % pmem_dev
-            self.devices.extend([self.test_dev, self.scratch_dev])
+            for namespace in namespaces[:2 * self.shards]:
+                pmem_dev = self.plib.run_ndctl_list_val(namespace, 'blockdev')
+                self.devices.append("/dev/%s" % pmem_dev)
+            self.test_dev = self.devices[0]
+            self.scratch_dev = self.devices[1]
 
     def setUp(self):
         """
@@ -217,6 +292,12 @@ class Xfstests(Test):
         self.test_mnt = self.params.get('test_mnt', default='/mnt/test')
         self.disk_mnt = self.params.get('disk_mnt', default='/mnt/loop_device')
         self.fs_to_test = self.params.get('fs', default='ext4')
+        self.shards = int(self.params.get('shards', default=1))
+        self.history_dir = self.params.get(
+            'history_dir', default=os.path.join(data_dir.get_data_dir(),
+                                                'xfstests'))
+        self.slow_factor = float(self.params.get('slow_factor', default=2.0))
+        self.slow_tests = {}
 
         if process.system('which mkfs.%s' % self.fs_to_test,
                           ignore_status=True):
@@ -231,67 +312,66 @@ class Xfstests(Test):
 
         self.log_test = self.params.get('log_test', default='')
         self.log_scratch = self.params.get('log_scratch', default='')
+        if self.shards > 1 and (self.log_test or self.log_scratch or
+                                self.params.get('logdev', default=False)):
+            self.cancel('Sharded runs do not support external log devices')
 
         if self.dev_type == 'loop':
             base_disk = self.params.get('disk', default=None)
             loop_size = self.params.get('loop_size', default='7GiB')
             if not base_disk:
                 # Using root for file creation by default
-                check = (int(loop_size.split('GiB')[0]) * 2) + 1
+                check = (int(loop_size.split('GiB')[0]) * 2 *
+                         self.shards) + 1
                 if disk.freespace('/') / 1073741824 > check:
                     self.disk_mnt = ''
                     mount = False
                 else:
                     self.cancel('Need %s GB to create loop devices' % check)
-            self._create_loop_device(base_disk, loop_size, mount)
+            self._create_loop_device(base_disk, loop_size, mount,
+                                     count=2 * self.shards)
         elif self.dev_type == 'nvdimm':
             self.setup_nvdimm()
         else:
-            self.test_dev = self.params.get('disk_test', default=None)
-            self.scratch_dev = self.params.get('disk_scratch', default=None)
-            self.devices.extend([self.test_dev, self.scratch_dev])
+            test_devs = (self.params.get('disk_test', default='') or
+                         '').split()
+            scratch_devs = (self.params.get('disk_scratch', default='') or
+                            '').split()
+            if self.shards > 1 and (len(test_devs) < self.shards or
+                                    len(scratch_devs) < self.shards):
+                self.cancel('Need %s disk_test and disk_scratch devices for '
+                            'a sharded run' % self.shards)
+            self.test_dev = test_devs[0] if test_devs else None
+            self.scratch_dev = scratch_devs[0] if scratch_devs else None
+            for shard in range(self.shards):
+                self.devices.extend([test_devs[shard] if test_devs else None,
+                                     scratch_devs[shard] if scratch_devs
+                                     else None])
         # mkfs for devices
+        self.shard_configs = []
         if self.devices:
             cfg_file = os.path.join(self.teststmpdir, 'local.config')
             self.mkfs_opt = self.params.get('mkfs_opt', default='')
             self.mount_opt = self.params.get('mount_opt', default='')
-            with open(cfg_file, "r") as sources:
-                lines = sources.readlines()
-            with open(cfg_file, "w") as sources:
-                for line in lines:
-                    if line.startswith('export TEST_DEV'):
-                        sources.write(
-                            re.sub(r'export TEST_DEV=.*', 'export TEST_DEV=%s'
-                                   % self.devices[0], line))
-                    elif line.startswith('export TEST_DIR'):
-                        sources.write(
-                            re.sub(r'export TEST_DIR=.*', 'export TEST_DIR=%s'
-                                   % self.test_mnt, line))
-                    elif line.startswith('export SCRATCH_DEV'):
-                        sources.write(re.sub(
-                            r'export SCRATCH_DEV=.*', 'export SCRATCH_DEV=%s'
-                                                      % self.devices[1], line))
-                    elif line.startswith('export SCRATCH_MNT'):
-                        sources.write(
-                            re.sub(
-                                r'export SCRATCH_MNT=.*',
-                                'export SCRATCH_MNT=%s' %
-                                self.scratch_mnt,
-                                line))
-                        break
-            with open(cfg_file, "a") as sources:
-                if self.log_test:
-                    sources.write('export USE_EXTERNAL=yes\n')
-                    sources.write('export TEST_LOGDEV="%s"\n' % self.log_test)
-                    self.log_devices.append(self.log_test)
-                if self.log_scratch:
-                    sources.write('export SCRATCH_LOGDEV="%s"\n' %
-                                  self.log_scratch)
-                    self.log_devices.append(self.log_scratch)
-                if self.mkfs_opt:
-                    sources.write('MKFS_OPTIONS="%s"\n' % self.mkfs_opt)
-                if self.mount_opt:
-                    sources.write('MOUNT_OPTIONS="%s"\n' % self.mount_opt)
+            if self.log_test:
+                self.log_devices.append(self.log_test)
+            if self.log_scratch:
+                self.log_devices.append(self.log_scratch)
+            self._write_local_config(cfg_file, self.devices[0],
+                                     self.devices[1], self.test_mnt,
+                                     self.scratch_mnt)
+            if self.shards > 1:
+                for shard in range(self.shards):
+                    shard_cfg = os.path.join(self.teststmpdir,
+                                             'local.config.shard%s' % shard)
+                    self._write_local_config(
+                        shard_cfg, self.devices[2 * shard],
+                        self.devices[2 * shard + 1],
+                        '%s_shard%s' % (self.test_mnt, shard),
+                        '%s_shard%s' % (self.scratch_mnt, shard),
+                        os.path.join(self.teststmpdir, 'results',
+                                     'shard%s' % shard))
+                    self.shard_configs.append(shard_cfg)
             self.logdev_opt = self.params.get('logdev_opt', default='')
             for dev in self.log_devices:
                 dev_obj = partition.Partition(dev)
@@ -307,9 +387,20 @@ class Xfstests(Test):
         git.get_repo('git://git.kernel.org/pub/scm/fs/xfs/xfstests-dev.git',
                      destination_dir=self.teststmpdir)
 
-        build.make(self.teststmpdir)
+        # Later variants of the job reuse the tree unless the commit or the
+        # compiler changed
+        build_key = '%s %s' % (
+            process.system_output('git -C %s rev-parse HEAD' %
+                                  self.teststmpdir, verbose=False).decode(),
+            process.system_output('gcc --version', verbose=False).decode())
+        stamp = os.path.join(self.teststmpdir, '.avocado-build')
+        if not os.path.exists(stamp) or \
+                genio.read_file(stamp) != build_key:
+            build.make(self.teststmpdir)
+            genio.write_file(stamp, build_key)
         self.available_tests = self._get_available_tests()
 
+        self.history = self._load_history()
         self.test_list = self._create_test_list(self.test_range)
         self.log.info("Tests available in srcdir: %s",
                       ", ".join(self.available_tests))
@@ -338,21 +429,87 @@ class Xfstests(Test):
                 self.log.warn('useradd fsgqa failed')
             if process.system('groupadd sys', sudo=True, ignore_status=True):
                 self.log.warn('groupadd sys failed')
-        if not os.path.exists(self.scratch_mnt):
-            os.makedirs(self.scratch_mnt)
-        if not os.path.exists(self.test_mnt):
-            os.makedirs(self.test_mnt)
+        for mnt in self._get_mount_points():
+            if not os.path.exists(mnt):
+                os.makedirs(mnt)
+
+    def _get_mount_points(self):
+        """
+        Returns the TEST/SCRATCH mount points of every shard
+        """
+        mounts = [self.scratch_mnt, self.test_mnt]
+        if self.shards > 1:
+            for shard in range(self.shards):
+                mounts.extend(['%s_shard%s' % (self.scratch_mnt, shard),
+                               '%s_shard%s' % (self.test_mnt, shard)])
+        return mounts
+
+    def _write_local_config(self, cfg_file, test_dev, scratch_dev, test_mnt,
+                            scratch_mnt, result_base=None):
+        """
+        Writes a local.config pointing xfstests at the given device pair
+        """
+        shutil.copyfile(self.get_data('local.config'), cfg_file)
+        with open(cfg_file, "r") as sources:
+            lines = sources.readlines()
+        with open(cfg_file, "w") as sources:
+            for line in lines:
+                if line.startswith('export TEST_DEV'):
+                    sources.write(
+                        re.sub(r'export TEST_DEV=.*', 'export TEST_DEV=%s'
+                               % test_dev, line))
+                elif line.startswith('export TEST_DIR'):
+                    sources.write(
+                        re.sub(r'export TEST_DIR=.*', 'export TEST_DIR=%s'
+                               % test_mnt, line))
+                elif line.startswith('export SCRATCH_DEV'):
+                    sources.write(re.sub(
+                        r'export SCRATCH_DEV=.*', 'export SCRATCH_DEV=%s'
+                                                  % scratch_dev, line))
+                elif line.startswith('export SCRATCH_MNT'):
+                    sources.write(
+                        re.sub(
+                            r'export SCRATCH_MNT=.*',
+                            'export SCRATCH_MNT=%s' %
+                            scratch_mnt,
+                            line))
+                    break
+        with open(cfg_file, "a") as sources:
+            if self.log_test:
+                sources.write('export USE_EXTERNAL=yes\n')
+                sources.write('export TEST_LOGDEV="%s"\n' % self.log_test)
+            if self.log_scratch:
+                sources.write('export SCRATCH_LOGDEV="%s"\n' %
+                              self.log_scratch)
+            if self.mkfs_opt:
+                sources.write('MKFS_OPTIONS="%s"\n' % self.mkfs_opt)
+            if self.mount_opt:
+                sources.write('MOUNT_OPTIONS="%s"\n' % self.mount_opt)
+            if result_base:
+                sources.write('export RESULT_BASE=%s\n' % result_base)
 
     def test(self):
         failures = False
+        self.summary = {'slow': self.slow_tests}
         os.chdir(self.teststmpdir)
-        if not self.test_list:
+        if self.shard_configs:
+            failures = self._run_sharded()
+        elif not self.test_list:
             self.log.info('Running all tests')
             args = ''
             if self.exclude or self.gen_exclude:
                 args = ' -E %s' % self.exclude_file
-            cmd = './check %s -g auto' % args
-            result = process.run(cmd, ignore_status=True, verbose=True)
+            tests = self._order_by_history(self._list_tests(args))
+            if tests:
+                # check sorts the tests it is given unless told otherwise
+                cmd = './check --exact-order %s' % ' '.join(tests)
+            else:
+                cmd = './check %s -g auto' % args
+            parser = CheckOutputParser()
+            result = stream_run(
+                cmd, os.path.join(self.outputdir, 'check.log'),
+                parse_line=parser.feed, partial=parser.progress, log=self.log)
+            self._record_history(parser.results())
             if result.exit_status == 0:
                 self.log.info('OK: All Tests passed.')
             else:
@@ -365,13 +522,24 @@ class Xfstests(Test):
             for test in self.test_list:
                 test = '%s/%s' % (self.fs_to_test, test)
                 cmd = './check %s' % test
-                result = process.run(cmd, ignore_status=True, verbose=True)
+                parser = CheckOutputParser()
+                result = stream_run(
+                    cmd, os.path.join(self.outputdir, 'check-%s.log' %
+                                      test.replace('/', '-')),
+                    parse_line=parser.feed, partial=parser.progress,
+                    log=self.log)
+                self._record_history(parser.results())
                 if result.exit_status == 0:
                     self.log.info('OK: Test %s passed.', test)
                 else:
                     msg = self._parse_error_message(result.stdout)
                     self.log.info('ERR: %s failed. Message: %s', test, msg)
                     failures = True
+        if self.slow_tests:
+            self.log.warn('Tests slower than their history: %s',
+                          ', '.join(sorted(self.slow_tests)))
+        if self.shard_configs or self.slow_tests:
+            self.whiteboard = json.dumps(self.summary)
         if failures:
             self.fail('One or more tests failed. Please check the logs.')
 
@@ -384,12 +552,12 @@ class Xfstests(Test):
             process.system('groupdel fsgqa', sudo=True)
             process.system('groupdel sys', sudo=True)
         # In case if any test has been interrupted
-        process.system('umount %s %s' % (self.scratch_mnt, self.test_mnt),
+        mounts = self._get_mount_points()
+        process.system('umount %s' % ' '.join(mounts),
                        sudo=True, ignore_status=True)
-        if os.path.exists(self.scratch_mnt):
-            shutil.rmtree(self.scratch_mnt)
-        if os.path.exists(self.test_mnt):
-            shutil.rmtree(self.test_mnt)
+        for mnt in mounts:
+            if os.path.exists(mnt):
+                shutil.rmtree(mnt)
         if self.dev_type == 'loop':
             for dev in self.devices:
                 process.system('losetup -d %s' % dev, shell=True,
@@ -409,13 +577,13 @@ class Xfstests(Test):
                             process.system('losetup -d %s' % dev, shell=True,
                                            sudo=True, ignore_status=True)
 
-    def _create_loop_device(self, base_disk, loop_size, mount=True):
+    def _create_loop_device(self, base_disk, loop_size, mount=True, count=2):
         if mount:
             self.part = partition.Partition(
                 base_disk, mountpoint=self.disk_mnt)
             self.part.mount()
-        # Creating two loop devices
-        for i in range(2):
+        # Creating two loop devices per TEST/SCRATCH pair
+        for i in range(count):
             if self.use_dd:
                 dd_count = int(loop_size.split('GiB')[0])
                 process.run('dd if=/dev/zero of=%s/file-%s.img bs=1G count=%s'
@@ -430,6 +598,191 @@ class Xfstests(Test):
             process.run('losetup %s %s/file-%s.img' %
                         (dev, self.disk_mnt, i), shell=True, sudo=True)
 
+    def _get_sharded_test_list(self):
+        """
+        Returns the full test names to spread across the shards
+        """
+        if self.test_list:
+            return ['%s/%s' % (self.fs_to_test, test)
+                    for test in self.test_list]
+        args = ''
+        if self.exclude or self.gen_exclude or self.share_exclude:
+            args = ' -E %s' % self.exclude_file
+        return self._list_tests(args,
+                                env={'HOST_OPTIONS': self.shard_configs[0]})
+
+    @staticmethod
+    def _list_tests(args, env=None):
+        """
+        Returns the full names of the tests './check -g auto' would run
+        """
+        # check -n only lists what would be run
+        result = process.run('./check -n %s -g auto' % args,
+                             ignore_status=True, verbose=False, env=env)
+        test_re = re.compile(r'^(\w+/\d{3})\s*$')
+        tests = []
+        for line in result.stdout.decode("utf-8").splitlines():
+            match = test_re.match(line)
+            if match:
+                tests.append(match.group(1))
+        return tests
+
+    def _open_history(self):
+        """
+        Opens the result store that keeps every test run across jobs
+        """
+        if not os.path.exists(self.history_dir):
+            os.makedirs(self.history_dir)
+        conn = sqlite3.connect(os.path.join(self.history_dir, 'results.db'))
+        conn.execute('CREATE TABLE IF NOT EXISTS results (test TEXT, fs TEXT, '
+                     'mkfs_opt TEXT, mount_opt TEXT, status TEXT, '
+                     'duration INTEGER, timestamp REAL)')
+        return conn
+
+    def _load_history(self):
+        """
+        Returns the mean duration of the last passes and whether the test
+        failed in one of its last runs, for every test run before with the
+        same fs type and mkfs/mount options
+        """
+        conn = self._open_history()
+        rows = conn.execute('SELECT test, status, duration FROM results '
+                            'WHERE fs=? AND mkfs_opt=? AND mount_opt=? '
+                            'ORDER BY timestamp',
+                            (self.fs_to_test,
+                             self.params.get('mkfs_opt', default=''),
+                             self.params.get('mount_opt', default='')))
+        history = {}
+        for test, status, duration in rows.fetchall():
+            entry = history.setdefault(test, {'durations': [],
+                                              'statuses': []})
+            if status == 'pass' and duration is not None:
+                entry['durations'].append(duration)
+            entry['statuses'].append(status)
+        conn.close()
+        for entry in history.values():
+            durations = entry.pop('durations')[-10:]
+            entry['mean'] = None
+            if durations:
+                entry['mean'] = float(sum(durations)) / len(durations)
+            entry['recent_fail'] = 'fail' in entry.pop('statuses')[-3:]
+        return history
+
+    def _record_history(self, results):
+        """
+        Stores the results of a ./check run and flags the tests that ran
+        much slower than their history
+        """
+        conn = self._open_history()
+        for test, status, duration in results:
+            mean = self.history.get(test, {}).get('mean')
+            if status == 'pass' and duration is not None and mean and \
+                    duration > mean * self.slow_factor and \
+                    duration - mean >= 5:
+                self.slow_tests[test] = {'duration': duration,
+                                         'mean': round(mean, 1)}
+            conn.execute('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (test, self.fs_to_test,
+                          self.params.get('mkfs_opt', default=''),
+                          self.params.get('mount_opt', default=''),
+                          status, duration, time.time()))
+        conn.commit()
+        conn.close()
+
+    def _order_by_history(self, tests):
+        """
+        Puts the tests that failed recently first, then the longest ones.
+        Tests are full names or ids of tests of the fs under test
+        """
+        def history_key(test):
+            if '/' not in test:
+                test = '%s/%s' % (self.fs_to_test, test)
+            entry = self.history.get(test, {})
+            return (not entry.get('recent_fail', False),
+                    -(entry.get('mean') or 0))
+        return sorted(tests, key=history_key)
+
+    def _balance_shards(self, tests):
+        """
+        Spreads the tests across shards, recently failed then longest known
+        tests first, always onto the shard with the least accumulated
+        runtime. Each shard keeps that order.
+        """
+        durations = dict((test, entry['mean'])
+                         for test, entry in self.history.items()
+                         if entry['mean'] is not None)
+        known = sorted(durations[test] for test in tests if test in durations)
+        default = known[len(known) // 2] if known else 1
+        tests = sorted(tests, key=lambda test: (
+            not self.history.get(test, {}).get('recent_fail', False),
+            -durations.get(test, default)))
+        shards = [[] for _ in range(self.shards)]
+        loads = [0] * self.shards
+        for test in tests:
+            shard = loads.index(min(loads))
+            shards[shard].append(test)
+            loads[shard] += durations.get(test, default)
+        for shard, load in enumerate(loads):
+            self.log.info('Shard %s: %s tests, ~%s s expected', shard,
+                          len(shards[shard]), load)
+        return [self._order_by_history(shard) for shard in shards]
+
+    def _run_shard(self, shard, tests, results):
+        """
+        Runs the tests of one shard against its own device pair
+        """
+        summary = {'ran': [], 'notrun': [], 'failures': [], 'status': 0}
+        if tests:
+            parser = CheckOutputParser()
+            result = stream_run(
+                './check --exact-order %s' % ' '.join(tests),
+                os.path.join(self.outputdir, 'check-shard%s.log' % shard),
+                parse_line=parser.feed, partial=parser.progress,
+                env={'HOST_OPTIONS': self.shard_configs[shard]}, log=self.log)
+            summary.update(parser.summary)
+            summary['status'] = result.exit_status
+            summary['results'] = parser.results()
+        summary['tests'] = tests
+        results[shard] = summary
+
+    def _run_sharded(self):
+        """
+        Runs the test list on concurrent ./check workers, one per shard,
+        and merges the shard results into a single report
+        """
+        tests = self._get_sharded_test_list()
+        self.log.info('Running %s tests across %s shards', len(tests),
+                      self.shards)
+        results = [None] * self.shards
+        workers = []
+        for shard, shard_tests in enumerate(self._balance_shards(tests)):
+            worker = Thread(target=self._run_shard,
+                            args=(shard, shard_tests, results))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        report = {'ran': [], 'notrun': [], 'failures': [], 'shards': {}}
+        for shard, summary in enumerate(results):
+            for key in ['ran', 'notrun', 'failures']:
+                report[key].extend(summary[key])
+            self._record_history(summary.pop('results', []))
+            report['shards']['shard%s' % shard] = summary
+        with open(os.path.join(self.outputdir, 'xfstests-shards.json'),
+                  'w') as fp:
+            json.dump(report, fp, indent=4)
+        self.summary.update({'ran': len(report['ran']),
+                             'notrun': len(report['notrun']),
+                             'failures': report['failures']})
+        failed = [summary for summary in results if summary['status']]
+        if report['failures'] or failed:
+            self.log.info('ERR: Test(s) failed: %s',
+                          ' '.join(report['failures']))
+            return True
+        self.log.info('OK: All Tests passed.')
+        return False
+
     def _create_test_list(self, test_range, test_type=None, dangerous=True):
         test_list = []
         dangerous_tests = []
@@ -451,6 +804,8 @@ class Xfstests(Test):
             with open(self.exclude_file, 'a') as fp:
                 for test in test_list:
                     fp.write('%s/%s\n' % (test_type, test))
+        else:
+            test_list = self._order_by_history(test_list)
         return test_list
 
     def _get_tests_for_group(self, group):
@@ -21,6 +21,7 @@
 
 import os
 import re
+import sys
 from avocado import Test
 from avocado.utils import build, distro, genio
 from avocado.utils import process, archive
@@ -28,6 +29,10 @@ from avocado.utils.partition import Partition
 
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.buildcache import BuildCache  # noqa: E402
+
 
 def clear_dmesg():
     process.run("dmesg -c ", sudo=True)
@@ -118,17 +123,25 @@ class LTP(Test):
                 "ltp-master%s" % match, locations=[url], expire='7d')
         else:
             self.cancel("Provided LTP Url is not valid")
+        if not self.ltpbin_dir:
+            self.ltpbin_dir = os.path.join(self.teststmpdir, 'bin')
+        # The LTP install tree is relocatable, so the installed tree is
+        # what gets cached
+        cache = BuildCache.from_params(self.params, 'ltp', tarball)
+        if cache and cache.restore(self.ltpbin_dir):
+            self.log.info("Using cached LTP install %s", cache.path)
+            return
         archive.extract(tarball, self.workdir)
         ltp_dir = os.path.join(self.workdir, "ltp-master")
         os.chdir(ltp_dir)
         build.make(ltp_dir, extra_args='autotools')
-        if not self.ltpbin_dir:
-            self.ltpbin_dir = os.path.join(self.teststmpdir, 'bin')
         if not os.path.exists(self.ltpbin_dir):
             os.mkdir(self.ltpbin_dir)
         process.system('./configure --prefix=%s' % self.ltpbin_dir)
         build.make(ltp_dir)
         build.make(ltp_dir, extra_args='install')
+        if cache:
+            cache.store(self.ltpbin_dir)
 
     def test(self):
         logfile = os.path.join(self.logdir, 'ltp.log')
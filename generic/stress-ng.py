@@ -17,11 +17,24 @@
 #
 
 import os
+import re
+import json
 import multiprocessing
+import sys
 from avocado import Test
 from avocado.utils import process, build, archive, distro, memory
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.buildcache import BuildCache  # noqa: E402
+from testlib.stream import stream_run  # noqa: E402
+
+
+# stress-ng: info:  [pid] <stressor> <bogo ops> <real> <usr> <sys> <bogo ops/s>
+METRICS_RE = re.compile(r'\]\s+([a-z][\w-]*)\s+(\d+)\s+([\d.]+)\s+([\d.]+)'
+                        r'\s+([\d.]+)\s+([\d.]+)')
+
 
 def clear_dmesg():
     process.run("dmesg -C ", sudo=True)
@@ -79,19 +92,54 @@ class Stressng(Test):
                                    locations=['https://github.com/Colin'
                                               'IanKing/stress-ng/archive'
                                               '/master.zip'], expire='7d')
-        archive.extract(tarball, self.workdir)
         sourcedir = os.path.join(self.workdir, 'stress-ng-master')
-        os.chdir(sourcedir)
-        result = build.run_make(sourcedir,
-                                process_kwargs={'ignore_status': True})
-        for line in str(result).splitlines():
-            if 'error:' in line:
-                self.cancel(
-                    "Unsupported OS, Please check the build logs !!")
+        cache = BuildCache.from_params(self.params, 'stress-ng', tarball)
+        if cache and cache.restore(sourcedir):
+            self.log.info("Using cached stress-ng build %s", cache.path)
+            os.chdir(sourcedir)
+        else:
+            archive.extract(tarball, self.workdir)
+            os.chdir(sourcedir)
+            result = build.run_make(sourcedir,
+                                    process_kwargs={'ignore_status': True})
+            for line in str(result).splitlines():
+                if 'error:' in line:
+                    self.cancel(
+                        "Unsupported OS, Please check the build logs !!")
+            if cache:
+                cache.store(sourcedir)
         build.make(sourcedir, extra_args='install')
         clear_dmesg()
 
+    def _parse_metrics(self, line):
+        """
+        Picks the per stressor bogo ops from a --metrics line
+        """
+        match = METRICS_RE.search(line)
+        if match:
+            self.bogo_ops[match.group(1)] = {
+                'bogo_ops': int(match.group(2)),
+                'bogo_ops_per_sec': float(match.group(6))}
+
+    def _run_stress_ng(self, cmd, name):
+        """
+        Runs a stress-ng command, keeping its output in stress-ng-<name>.log
+        as it is printed rather than in memory, and parsing the metrics on
+        the fly. The metrics gathered so far are kept up to date in
+        stress-ng-<name>.log.partial.json while the stressors run.
+        """
+        if os.geteuid() != 0:
+            cmd = 'sudo -n %s' % cmd
+        output_path = os.path.join(self.outputdir, 'stress-ng-%s.log' % name)
+        exit_status = stream_run(cmd, output_path,
+                                 parse_line=self._parse_metrics,
+                                 partial=lambda: self.bogo_ops).exit_status
+        if exit_status:
+            self.log.info("%s exited with %s", cmd, exit_status)
+        return exit_status
+
     def test(self):
+        self.bogo_ops = {}
         args = []
         cmdline = ''
         timeout = ''
@@ -131,7 +179,7 @@ class Stressng(Test):
         if self.parallel:
             if self.ttimeout:
                 cmd += ' --timeout %s ' % self.ttimeout
-            process.run(cmd, ignore_status=True, sudo=True)
+            self._run_stress_ng(cmd, 'parallel')
         else:
             if self.ttimeout:
                 timeout = ' --timeout %s ' % self.ttimeout
@@ -139,8 +187,7 @@ class Stressng(Test):
                 for stressor in self.stressors.split(' '):
                     stress_cmd = ' --%s %s %s' % (stressor,
                                                   self.workers, timeout)
-                    process.run("%s %s" % (cmd, stress_cmd),
-                                ignore_status=True, sudo=True)
+                    self._run_stress_ng("%s %s" % (cmd, stress_cmd), stressor)
             if self.ttimeout and self.v_stressors:
                 timeout = ' --timeout %s ' % str(
                     int(self.ttimeout) + int(memory.meminfo.MemTotal.g))
@@ -148,13 +195,15 @@ class Stressng(Test):
                 for stressor in self.v_stressors.split(' '):
                     stress_cmd = ' --%s %s %s' % (stressor,
                                                   self.workers, timeout)
-                    process.run("%s %s" % (cmd, stress_cmd),
-                                ignore_status=True, sudo=True)
+                    self._run_stress_ng("%s %s" % (cmd, stress_cmd), stressor)
+        if self.bogo_ops:
+            self.whiteboard = json.dumps(self.bogo_ops, indent=1)
         ERROR = []
         pattern = ['WARNING: CPU:', 'Oops', 'Segfault', 'soft lockup',
                    'Unable to handle', 'ard LOCKUP']
+        dmesg = collect_dmesg(self).splitlines()
         for fail_pattern in pattern:
-            for log in collect_dmesg(self).splitlines():
+            for log in dmesg:
                 if fail_pattern in log:
                     ERROR.append(log)
         if ERROR:
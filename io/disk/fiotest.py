@@ -23,7 +23,11 @@ FIO Test
 """
 
 import os
+import re
+import json
+import shutil
 import avocado
+import sys
 
 from avocado import Test
 from avocado.utils import archive
@@ -37,6 +41,11 @@ from avocado.utils.partition import Partition
 from avocado.utils.software_manager import SoftwareManager
 from avocado.utils.partition import PartitionError
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.buildcache import BuildCache  # noqa: E402
+from testlib.pmemcache import CachedPMem  # noqa: E402
+
 
 class FioTest(Test):
 
@@ -48,6 +57,10 @@ class FioTest(Test):
 
     :param fio_tarbal: name of the tarbal of fio suite located in deps path
     :param fio_job: config defining set of executed tests located in deps path
+    :param baseline_dir: directory keeping the results to compare against
+    :param bw_tolerance: allowed bandwidth drop against baseline, in %
+    :param iops_tolerance: allowed IOPS drop against baseline, in %
+    :param lat_tolerance: allowed latency increase against baseline, in %
     """
 
     def setUp(self):
@@ -103,10 +116,18 @@ class FioTest(Test):
                             % pkg)
 
         tarball = self.fetch_asset(url)
-        archive.extract(tarball, self.teststmpdir)
         self.sourcedir = os.path.join(self.teststmpdir, "fio")
         fio_flags = ""
         self.ld_path = ""
+        cache = None
+        if self.disk_type != 'nvdimm':
+            # PMDK enabled builds link against this job's PMDK install
+            cache = BuildCache.from_params(self.params, 'fio', tarball)
+        cached = cache is not None and cache.restore(self.sourcedir)
+        if cached:
+            self.log.info("Using cached fio build %s", cache.path)
+        else:
+            archive.extract(tarball, self.teststmpdir)
 
         if self.disk_type == 'nvdimm':
             self.setup_pmem_disk(mnt_args)
@@ -152,12 +173,15 @@ class FioTest(Test):
                 self.create_fs(self.disk, self.dirs, fstype, fs_args, mnt_args)
                 self.fs_create = True
 
-        build.make(self.sourcedir, extra_args=fio_flags)
+        if not cached:
+            build.make(self.sourcedir, extra_args=fio_flags)
+            if cache:
+                cache.store(self.sourcedir)
 
     @avocado.fail_on(pmem.PMemException)
     def setup_pmem_disk(self, mnt_args):
         if not self.disk:
-            self.plib = pmem.PMem()
+            self.plib = CachedPMem()
             regions = sorted(self.plib.run_ndctl_list(
                 '-R'), key=lambda i: i['size'], reverse=True)
             if not regions:
@@ -216,6 +240,83 @@ class FioTest(Test):
         if process.system(delete_fs, shell=True, ignore_status=True):
             self.fail("Failed to delete filesystem on %s" % l_disk)
 
+    @staticmethod
+    def parse_fio_json(json_file):
+        """
+        Returns bandwidth (KiB/s), IOPS and p50/p99/p99.9 completion latency
+        (usec) per job and direction from fio JSON output. Clones of a job
+        (numjobs) are folded together: bandwidth and IOPS are summed, the
+        worst latency is kept.
+        """
+        with open(json_file, 'r') as fp:
+            output = fp.read()
+        # fio may print notes (e.g. about unsupported options) before the
+        # JSON document
+        output = json.loads(output[output.find('{'):])
+        results = {}
+        for job in output['jobs']:
+            for ddir in ['read', 'write', 'trim']:
+                stats = job.get(ddir)
+                if not stats or not stats.get('total_ios'):
+                    continue
+                if 'clat_ns' in stats:
+                    percentiles = stats['clat_ns'].get('percentile', {})
+                    scale = 1000.0
+                else:
+                    percentiles = stats.get('clat', {}).get('percentile', {})
+                    scale = 1.0
+                name = '%s.%s' % (job['jobname'], ddir)
+                entry = results.setdefault(name, {'bw': 0, 'iops': 0})
+                entry['bw'] += stats['bw']
+                entry['iops'] += stats['iops']
+                for metric, pct in [('lat_p50', '50.000000'),
+                                    ('lat_p99', '99.000000'),
+                                    ('lat_p99.9', '99.900000')]:
+                    if pct in percentiles:
+                        entry[metric] = max(entry.get(metric, 0),
+                                            percentiles[pct] / scale)
+        return results
+
+    def compare_baseline(self, results, baseline):
+        """
+        Returns the metrics that regressed beyond the configured tolerance
+        """
+        tolerance = {'bw': self.params.get('bw_tolerance', default=10),
+                     'iops': self.params.get('iops_tolerance', default=10)}
+        lat_tolerance = self.params.get('lat_tolerance', default=20)
+        regressions = []
+        for name, metrics in baseline.items():
+            for metric, base in metrics.items():
+                value = results.get(name, {}).get(metric)
+                if value is None or not base:
+                    continue
+                change = 100.0 * (value - base) / base
+                if metric in tolerance:
+                    regressed = change < -float(tolerance[metric])
+                else:
+                    regressed = change > float(lat_tolerance)
+                if regressed:
+                    regressions.append('%s %s: %.2f -> %.2f (%+.1f%%)' %
+                                       (name, metric, base, value, change))
+        return regressions
+
+    def baseline_key(self, fio_job):
+        """
+        Baseline file name for this run: the job, the filesystem, the disk
+        type and the model/serial of the disk, so that different disks do
+        not compare against each other
+        """
+        device = self.params.get('disk', default=None) or 'workdir'
+        ident = ''
+        if os.path.exists(device) and not os.path.isdir(device):
+            ident = process.system_output('lsblk -dno MODEL,SERIAL %s' %
+                                          device, ignore_status=True,
+                                          verbose=False).decode().strip()
+        key = [os.path.splitext(os.path.basename(fio_job))[0],
+               self.params.get('fs', default='') or 'raw',
+               self.disk_type or 'disk', ident or os.path.basename(device)]
+        return re.sub(r'[^\w.-]+', '_', '-'.join(key))
+
     def test(self):
         """
         Execute 'fio' with appropriate parameters.
@@ -231,10 +332,10 @@ class FioTest(Test):
             filename = self.devdax_file
         else:
             filename = self.dirs
-        cmd = '%s %s/fio %s --filename=%s' % (self.ld_path,
-                                              self.sourcedir,
-                                              self.get_data(fio_job),
-                                              filename)
+        json_file = os.path.join(self.outputdir, 'fio.json')
+        cmd = '%s %s/fio %s --filename=%s --output-format=json '\
+              '--output=%s' % (self.ld_path, self.sourcedir,
+                               self.get_data(fio_job), filename, json_file)
         status = process.system(cmd, ignore_status=True, shell=True)
         if status:
             # status of 3 is a common warning with iscsi disks but fio
@@ -245,6 +346,35 @@ class FioTest(Test):
             else:
                 self.fail("fio run failed")
 
+        results = self.parse_fio_json(json_file)
+        for name in sorted(results):
+            self.log.info("%s: %s", name, results[name])
+        with open(os.path.join(self.outputdir, 'fio-results.json'),
+                  'w') as fp:
+            json.dump(results, fp, indent=4)
+        self.whiteboard = json.dumps(results)
+
+        baseline_dir = self.params.get('baseline_dir', default=None)
+        if not baseline_dir:
+            return
+        baseline_file = os.path.join(baseline_dir, '%s.json' %
+                                     self.baseline_key(fio_job))
+        if not os.path.exists(baseline_file):
+            self.log.warning("No baseline for this job/fs/device yet, nothing "
+                             "was compared. This run's results are stored "
+                             "as the new baseline %s", baseline_file)
+            if not os.path.isdir(baseline_dir):
+                os.makedirs(baseline_dir)
+            shutil.copyfile(os.path.join(self.outputdir, 'fio-results.json'),
+                            baseline_file)
+            return
+        with open(baseline_file, 'r') as fp:
+            baseline = json.load(fp)
+        regressions = self.compare_baseline(results, baseline)
+        if regressions:
+            self.fail("fio performance regressed against %s: %s" %
+                      (baseline_file, "; ".join(regressions)))
+
     def tearDown(self):
         '''
         Cleanup of disk used to perform this test
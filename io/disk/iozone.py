@@ -23,10 +23,17 @@
 import os
 import re
 import json
+import math
+import array
+import hashlib
 import logging
+import shutil
+import time
+import sys
 
 from avocado import Test
 from avocado.utils import archive
+from avocado.utils import crypto
 from avocado.utils import process
 from avocado.utils import build
 from avocado.utils import distro
@@ -39,6 +46,11 @@ from avocado.utils import astring
 from avocado.utils.partition import PartitionError
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.buildcache import BuildCache  # noqa: E402
+from testlib.stream import stream_run  # noqa: E402
+
 
 _LABELS = ['file_size', 'record_size', 'write', 'rewrite', 'read', 'reread',
            'randread', 'randwrite', 'bkwdread', 'recordrewrite', 'strideread',
@@ -48,87 +60,123 @@ _LABELS = ['file_size', 'record_size', 'write', 'rewrite', 'read', 'reread',
 class IOzoneAnalyzer(object):
 
     """
-    Analyze an unprocessed IOzone file, and generate the following types of
+    Analyze unprocessed IOzone files, and generate the following types of
     report:
 
     * Summary of throughput for all file and record sizes combined
     * Summary of throughput for all file sizes
     * Summary of throughput for all record sizes
 
-    If more than one file is provided to the analyzer object, a comparison
-    between the two runs is made, searching for regressions in performance.
+    The first file is the run under analysis. If more files are provided,
+    they form the baseline set: the run is compared against the geometric
+    mean of the baseline runs, searching for regressions in performance.
     """
 
-    def __init__(self, log, list_files, output_dir):
+    def __init__(self, log, list_files, output_dir, threshold=0.05):
         self.list_files = list_files
         if not os.path.isdir(output_dir):
             os.makedirs(output_dir)
         self.output_dir = output_dir
+        self.threshold = threshold
         self.log = log
         self.log.info("Results will be stored in %s", output_dir)
 
     @staticmethod
-    def average_performance(results, size=None):
-        """
-        Flattens a list containing performance results.
-        :param results: List of n lists containing data from performance runs.
-        :param size: Numerical value of a size (say, file_size) that was used
-                     to filter the original results list.
-        :return: List with 1 list containing average data from the performance
-                 run.
-        """
-        average_line = []
-        if size is not None:
-            average_line.append(size)
-        for i in range(2, 15):
-            average = data_structures.geometric_mean(
-                [line[i] for line in results]) / 1024.0
-            average = int(average)
-            average_line.append(average)
-        return average_line
-
-    def process_results(self, results, label=None):
-        """
-        Process a list of IOzone results according to label.
-
-        :label: IOzone column label that we'll use to filter and compute
-                geometric mean results, in practical term either 'file_size'
-                or 'record_size'.
-        :result: A list of n x m columns with original iozone results.
-        :return: A list of n-? x (m-1) columns with geometric averages for
-                values of each label (ex, average for all file_sizes).
-        """
-        performance = []
-        if label is not None:
-            index = _LABELS.index(label)
-            sizes = data_structures.ordered_list_unique(
-                [line[index] for line in results])
-            for size in sizes:
-                r_results = [line for line in results if line[index] == size]
-                performance.append(self.average_performance(r_results, size))
-        else:
-            performance.append(self.average_performance(results))
-
-        return performance
+    def geometric_mean(values):
+        """
+        Geometric mean of the positive values, 0 if there are none
+        """
+        logs = [math.log(value) for value in values if value > 0]
+        if not logs:
+            return 0
+        return math.exp(math.fsum(logs) / len(logs))
 
     @staticmethod
-    def parse_file(p_file):
+    def load_file(path):
         """
         Parse an IOzone results file.
 
-        :param file: File object that will be parsed.
-        :return: Matrix containing IOzone results extracted from the file.
+        :param path: Path of the raw output of an IOzone run.
+        :return: One array per IOzone label, holding that column of the
+                 results matrix.
         """
-        lines = []
-        for line in p_file.readlines():
-            fields = line.split()
-            if len(fields) != 15:
-                continue
-            try:
-                lines.append([int(i) for i in fields])
-            except ValueError:
-                continue
-        return lines
+        columns = tuple(array.array('q') for _ in _LABELS)
+        with open(path, 'r') as p_file:
+            for line in p_file:
+                fields = line.split()
+                if len(fields) != 15:
+                    continue
+                try:
+                    values = [int(i) for i in fields]
+                except ValueError:
+                    continue
+                for column, value in zip(columns, values):
+                    column.append(value)
+        return columns
+
+    @staticmethod
+    def grouped_means(columns):
+        """
+        Computes, in a single pass over each throughput column, the geometric
+        mean of the results for all sizes combined, for each record size and
+        for each file size.
+
+        :param columns: Results columns, as returned by :meth:`load_file`.
+        :return: Dictionary with the 'overall', 'record_size' and 'file_size'
+                 matrices in MB/sec. Rows of the last two start with the size
+                 they were computed for, in order of first appearance.
+        """
+        groups = {'overall': {None: 0}, 'record_size': {}, 'file_size': {}}
+        # Row -> accumulator slot of each of its groups, so that every
+        # column is then folded into all the means at once
+        slots = []
+        for file_size, record_size in zip(columns[0], columns[1]):
+            row = [0]
+            for label, size in (('record_size', record_size),
+                                ('file_size', file_size)):
+                if size not in groups[label]:
+                    groups[label][size] = (1 + len(groups['record_size']) +
+                                           len(groups['file_size']))
+                row.append(groups[label][size])
+            slots.append(row)
+        n_groups = 1 + len(groups['record_size']) + len(groups['file_size'])
+
+        means = []
+        for column in columns[2:]:
+            log_sums = array.array('d', [0.0] * n_groups)
+            counts = array.array('q', [0] * n_groups)
+            for row, value in zip(slots, column):
+                if value <= 0:
+                    continue
+                log_value = math.log(value)
+                for slot in row:
+                    log_sums[slot] += log_value
+                    counts[slot] += 1
+            means.append([int(math.exp(total / count) / 1024.0)
+                          if count else 0
+                          for total, count in zip(log_sums, counts)])
+
+        results = {}
+        for label, sizes in groups.items():
+            results[label] = [
+                ([] if size is None else [size]) +
+                [column[slot] for column in means]
+                for size, slot in sizes.items()]
+        return results
+
+    @staticmethod
+    def baseline_means(baselines, label, sizes):
+        """
+        Builds the reference matrix of a label, each cell being the geometric
+        mean of that cell across the baseline runs.
+        """
+        matrix = []
+        for size in sizes:
+            rows = [dict((row[0], row[1:]) for row in baseline[label])[size]
+                    for baseline in baselines]
+            matrix.append([size] + [int(IOzoneAnalyzer.geometric_mean(cells))
+                                    for cells in zip(*rows)])
+        return matrix
 
     def report(self, overall_results, record_size_results, file_size_results):
         """
@@ -200,7 +248,7 @@ class IOzoneAnalyzer(object):
 
     def report_comparison(self, record, files):
         """
-        Generates comparison data for 2 IOZone runs.
+        Generates comparison data between an IOZone run and its baseline.
 
         It compares 2 sets of nxm results and outputs a table with differences.
         If a difference higher or smaller than 5% is found, a warning is
@@ -250,32 +298,45 @@ class IOzoneAnalyzer(object):
 
     def analyze(self):
         """
-        Analyzes and eventually compares sets of IOzone data.
+        Analyzes all sets of IOzone data and compares the first one against
+        the others.
+
+        :return: Dictionary with the regression matrix of each label, also
+                 written to regression.json in the output directory, or None
+                 if there was nothing to compare against.
         """
-        overall = []
-        record_size = []
-        file_size = []
+        grouped = []
         for path in self.list_files:
-            c_file = open(path, 'r')
             self.log.info('FILE: %s', path)
-
-            results = self.parse_file(c_file)
-
-            overall_results = self.process_results(results)
-            record_size_results = self.process_results(results, 'record_size')
-            file_size_results = self.process_results(results, 'file_size')
-            self.report(overall_results, record_size_results,
-                        file_size_results)
-
-            if len(self.list_files) == 2:
-                overall.append(overall_results)
-                record_size.append(record_size_results)
-                file_size.append(file_size_results)
-
-        if len(self.list_files) == 2:
-            record_comparison = data_structures.compare_matrices(*record_size)
-            file_comparison = data_structures.compare_matrices(*file_size)
-            self.report_comparison(record_comparison, file_comparison)
+            means = self.grouped_means(self.load_file(path))
+            self.report([list(row) for row in means['overall']],
+                        means['record_size'], means['file_size'])
+            grouped.append(means)
+
+        if len(grouped) < 2:
+            return None
+        current, baselines = grouped[0], grouped[1:]
+        comparisons = {}
+        regression = {}
+        for label in ('record_size', 'file_size'):
+            rows = dict((row[0], row) for row in current[label])
+            sizes = [size for size in rows
+                     if all(size in [row[0] for row in baseline[label]]
+                            for baseline in baselines)]
+            comparisons[label] = data_structures.compare_matrices(
+                self.baseline_means(baselines, label, sizes),
+                [rows[size] for size in sizes], threshold=self.threshold)
+            matrix, improvements, regressions, total = comparisons[label]
+            regression[label] = {'matrix': matrix,
+                                 'improvements': improvements,
+                                 'regressions': regressions,
+                                 'total': total}
+        self.report_comparison(comparisons['record_size'],
+                               comparisons['file_size'])
+        with open(os.path.join(self.output_dir, 'regression.json'),
+                  'w') as r_file:
+            json.dump(regression, r_file, indent=2)
+        return regression
 
 
 class IOzonePlotter(object):
@@ -449,26 +510,34 @@ class IOZone(Test):
 
         tarball = self.fetch_asset(
             'http://www.iozone.org/src/current/iozone3_434.tar')
-        archive.extract(tarball, self.teststmpdir)
         version = os.path.basename(tarball.split('.tar')[0])
         self.sourcedir = os.path.join(self.teststmpdir, version)
-
-        make_dir = os.path.join(self.sourcedir, 'src', 'current')
-        os.chdir(make_dir)
         patch = self.params.get('patch', default='makefile.patch')
         patch = self.get_data(patch)
-        process.run('patch -p3 < %s' % patch, shell=True)
 
         d_distro = distro.detect()
         arch = d_distro.arch
         if arch == 'ppc':
-            build.make(make_dir, extra_args='linux-powerpc')
+            target = 'linux-powerpc'
         elif arch == 'ppc64' or arch == 'ppc64le':
-            build.make(make_dir, extra_args='linux-powerpc64')
+            target = 'linux-powerpc64'
         elif arch == 'x86_64':
-            build.make(make_dir, extra_args='linux-AMD64')
+            target = 'linux-AMD64'
+        else:
+            target = 'linux'
+        cache = BuildCache.from_params(
+            self.params, 'iozone', tarball,
+            '%s %s' % (crypto.hash_file(patch), target))
+        if cache and cache.restore(self.sourcedir):
+            self.log.info("Using cached IOZone build %s", cache.path)
         else:
-            build.make(make_dir, extra_args='linux')
+            archive.extract(tarball, self.teststmpdir)
+            make_dir = os.path.join(self.sourcedir, 'src', 'current')
+            os.chdir(make_dir)
+            process.run('patch -p3 < %s' % patch, shell=True)
+            build.make(make_dir, extra_args=target)
+            if cache:
+                cache.store(self.sourcedir)
         self.dirs = self.disk
         if self.disk is not None:
             if self.disk in disk.get_disks():
@@ -533,6 +602,72 @@ class IOZone(Test):
         """
         return desc.strip().replace(' ', '_')
 
+    @staticmethod
+    def parse_throughput(results):
+        """
+        Parses the output of an IOzone throughput mode (-t) run.
+
+        :param results: IOzone output.
+        :return: Dictionary keyed by '<section>-<workers>-<value>', where value
+                 is 'kids', 'parent', 'Min', 'Max', 'Avg' or 'MinXfer'.
+        """
+        keylist = {}
+        child_regexp = re.compile(r'Children see throughput for\s+'
+                                  r'(\d+)\s+([-\w]+[-\w\s]*)=\s+([\d.]*) '
+                                  r'kB/sec', re.IGNORECASE)
+        parent_regexp = re.compile(r'Parent sees throughput for\s+'
+                                   r'(\d+)\s+([-\w]+[-\w\s]*)=\s+([\d.]*) '
+                                   r'kB/sec', re.IGNORECASE)
+        per_worker_regexp = re.compile(r'^(Min|Max|Avg) throughput per '
+                                       r'(?:process|thread)\s*=\s*([\d.]*) '
+                                       r'kB/sec', re.IGNORECASE)
+        xfer_regexp = re.compile(r'^Min xfer\s*=\s*([\d.]*) kB',
+                                 re.IGNORECASE)
+
+        section = None
+        w_count = 0
+
+        for line in results.splitlines():
+            line = line.strip()
+
+            # Check for the beginning of a new result section
+            match = child_regexp.search(line)
+            if match:
+                # Extract the section name and the worker count
+                w_count = int(match.group(1))
+                section = IOZone.__get_section_name(match.group(2))
+
+                # Output the appropriate keyval pair
+                key_name = '%s-%d-kids' % (section, w_count)
+                keylist[key_name] = match.group(3)
+                continue
+
+            # Check for any other interesting lines
+            if '=' not in line or section is None:
+                continue
+            # Is it something we recognize? First check for parent.
+            match = parent_regexp.search(line)
+            if match:
+                # The section name and the worker count better match
+                p_count = int(match.group(1))
+                p_secnt = IOZone.__get_section_name(match.group(2))
+                if p_secnt != section or p_count != w_count:
+                    continue
+                keylist['%s-%d-parent' % (section, w_count)] = match.group(3)
+                continue
+            # Check for the various 'throughput' values
+            match = per_worker_regexp.search(line)
+            if match:
+                basekey, result = match.groups()
+            else:
+                # The only other thing we expect is 'Min xfer'
+                match = xfer_regexp.search(line)
+                if not match:
+                    continue
+                basekey, result = 'MinXfer', match.group(1)
+            keylist["%s-%d-%s" % (section, w_count, basekey)] = result
+        return keylist
+
     def generate_keyval(self):
         """
         Generating key-value list from results and recording it in JSON file
@@ -543,77 +678,69 @@ class IOZone(Test):
             labels = ('write', 'rewrite', 'read', 'reread', 'randread',
                       'randwrite', 'bkwdread', 'recordrewrite',
                       'strideread', 'fwrite', 'frewrite', 'fread', 'freread')
-            for line in self.results.splitlines():
-                fields = line.split()
-                if len(fields) != 15:
-                    continue
-                try:
-                    fields = tuple([int(i) for i in fields])
-                except ValueError:
-                    continue
-                for lin, val in zip(labels, fields[2:]):
-                    key_name = "%d-%d-%s" % (fields[0], fields[1], lin)
-                    keylist[key_name] = val
+            # read back line by line, the output of a -a run can be large
+            with open(self.results_path, 'r') as r_file:
+                for line in r_file:
+                    fields = line.split()
+                    if len(fields) != 15:
+                        continue
+                    try:
+                        fields = tuple([int(i) for i in fields])
+                    except ValueError:
+                        continue
+                    for lin, val in zip(labels, fields[2:]):
+                        key_name = "%d-%d-%s" % (fields[0], fields[1], lin)
+                        keylist[key_name] = val
         else:
-            child_regexp = re.compile(r'Children see throughput for[s]+'
-                                      r'([d]+)s+([-w]+[-ws]*)=[s]+([d.]*) '
-                                      'KB/sec')
-            parent_regexp = re.compile(r'Parent sees throughput for[s]+'
-                                       r'([d]+)s+([-w]+[-ws]*)=[s]+([d.]*) '
-                                       'KB/sec')
-
-            kbsec_regexp = re.compile(r'=[s]+([d.]*) KB/sec')
-            kbval_regexp = re.compile(r'=[s]+([d.]*) KB')
-
-            section = None
-            w_count = 0
-
-            for line in self.results.splitlines():
-                line = line.strip()
-
-                # Check for the beginning of a new result section
-                match = child_regexp.search(line)
-                if match:
-                    # Extract the section name and the worker count
-                    w_count = int(match.group(1))
-                    section = self.__get_section_name(match.group(2))
-
-                    # Output the appropriate keyval pair
-                    key_name = '%s-%d-kids' % (section, w_count)
-                    keylist[key_name] = match.group(3)
-                    continue
-
-                # Check for any other interesting lines
-                if '=' in line:
-                    # Is it something we recognize? First check for parent.
-                    match = parent_regexp.search(line)
-                    if match:
-                        # The section name and the worker count better match
-                        p_count = int(match.group(1))
-                        p_secnt = self.__get_section_name(match.group(2))
-                        if p_secnt != section or p_count != w_count:
-                            continue
-
-                        # Set the base name for the keyval
-                        basekey = 'parent'
-                    else:
-                        # Check for the various 'throughput' values
-                        if line[3:26] == ' throughput per thread ':
-                            basekey = line[0:3]
-                            match_x = kbsec_regexp
-                        else:
-                            # The only other thing we expect is 'Min xfer'
-                            if not line.startswith('Min xfer '):
-                                continue
-                            basekey = 'MinXfer'
-                            match_x = kbval_regexp
-
-                        match = match_x.search(line)
-                        if match:
-                            result = match.group(1)
-                            key_name = "%s-%d-%s" % (section, w_count, basekey)
-                            keylist[key_name] = result
+            with open(self.results_path, 'r') as r_file:
+                keylist = self.parse_throughput(r_file.read())
         self.whiteboard = json.dumps(keylist, indent=1)
+        return keylist
+
+    def _baseline_files(self, args):
+        """
+        Returns the baseline directory for this configuration and the raw
+        outputs of its most recent runs, oldest first
+        """
+        baseline_dir = self.params.get('baseline_dir', default=None)
+        if not baseline_dir:
+            return None, []
+        key = '%s %s' % (self.params.get('fs', default=''), args)
+        baseline_dir = os.path.join(baseline_dir, 'iozone-%s' %
+                                    hashlib.sha1(key.encode()).hexdigest()[:12])
+        if not os.path.isdir(baseline_dir):
+            return baseline_dir, []
+        runs = int(self.params.get('baseline_runs', default=5))
+        files = sorted(name for name in os.listdir(baseline_dir)
+                       if name.startswith('raw_output-'))
+        return baseline_dir, [os.path.join(baseline_dir, name)
+                              for name in files[-runs:]]
+
+    @staticmethod
+    def compare_throughput(keylist, baselines, threshold):
+        """
+        Compares the aggregate throughput of a -t run against the geometric
+        mean of the same values in the baseline runs.
+
+        :return: Dictionary of the values that changed more than threshold,
+                 with their percent difference, plus the regression count.
+        """
+        matrix = {}
+        regressions = 0
+        for key, value in keylist.items():
+            if not key.endswith(('-kids', '-parent')):
+                continue
+            reference = IOzoneAnalyzer.geometric_mean(
+                [float(baseline[key]) for baseline in baselines
+                 if baseline.get(key)])
+            if not reference or not value:
+                continue
+            ratio = float(value) / reference
+            if ratio < 1 - threshold:
+                regressions += 1
+            if abs(ratio - 1) > threshold:
+                matrix[key] = round(100 * ratio - 100, 2)
+        return {'matrix': matrix, 'regressions': regressions}
 
     def test(self):
         '''
@@ -622,6 +749,9 @@ class IOZone(Test):
         directory = self.params.get('dir', default=None)
         args = self.params.get('args', default=None)
         previous_results = self.params.get('previous_results', default=None)
+        threshold = float(self.params.get('regression_threshold',
+                                          default=5)) / 100
+        max_regressions = self.params.get('max_regressions', default=None)
 
         if not directory:
             directory = self.base_dir
@@ -631,31 +761,56 @@ class IOZone(Test):
             args = '-a'
 
         cmd = os.path.join(self.sourcedir, 'src', 'current', 'iozone')
-        self.results = process.system_output(
-            '%s %s' % (cmd, args)).decode('utf-8')
         self.auto_mode = ("-a" in args)
         results_path = os.path.join(self.outputdir,
                                     'raw_output')
         analysisdir = os.path.join(self.outputdir,
                                    'analysis')
-        with open(results_path, 'w') as r_file:
-            r_file.write(self.results)
-
-        self.generate_keyval()
+        self.results_path = results_path
+        result = stream_run('%s %s' % (cmd, args), results_path, tail=50)
+        if result.exit_status:
+            self.fail("iozone exited with %s, output in %s"
+                      % (result.exit_status, results_path))
+
+        keylist = self.generate_keyval()
+        baseline_dir, baselines = self._baseline_files(args)
+        if previous_results:
+            baselines = previous_results.split() + baselines
+        regression = None
         if self.auto_mode:
-            if previous_results:
-                analysis = IOzoneAnalyzer(self.log,
-                                          list_files=[results_path,
-                                                      previous_results],
-                                          output_dir=analysisdir)
-                analysis.analyze()
-            else:
-                analysis = IOzoneAnalyzer(self.log, list_files=[results_path],
-                                          output_dir=analysisdir)
-                analysis.analyze()
+            analysis = IOzoneAnalyzer(self.log,
+                                      list_files=[results_path] + baselines,
+                                      output_dir=analysisdir,
+                                      threshold=threshold)
+            regression = analysis.analyze()
+            if regression:
+                regressions = sum(matrix['regressions']
+                                  for matrix in regression.values())
             plotter = IOzonePlotter(self.log, results_file=results_path,
                                     output_dir=analysisdir)
             plotter.plot_2d_graphs()
+        elif baselines:
+            previous = []
+            for path in baselines:
+                with open(path, 'r') as b_file:
+                    previous.append(self.parse_throughput(b_file.read()))
+            regression = self.compare_throughput(keylist, previous, threshold)
+            regressions = regression['regressions']
+            self.log.info("Throughput changes against %d baseline runs "
+                          "(%%): %s", len(previous), regression['matrix'])
+            with open(os.path.join(self.outputdir, 'regression.json'),
+                      'w') as r_file:
+                json.dump(regression, r_file, indent=2)
+
+        if baseline_dir:
+            if not os.path.isdir(baseline_dir):
+                os.makedirs(baseline_dir)
+            shutil.copy(results_path, os.path.join(
+                baseline_dir, 'raw_output-%s-%d' % (time.strftime('%Y%m%d%H%M%S'), os.getpid())))
+        if (regression and max_regressions is not None and
+                regressions > int(max_regressions)):
+            self.fail("%d results regressed more than %s%% against the "
+                      "baseline runs" % (regressions, threshold * 100))
 
     def tearDown(self):
         '''
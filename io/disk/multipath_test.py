@@ -19,8 +19,11 @@ Multipath Test.
 Needs to be run as root.
 """
 
+import json
 import os
 import shutil
+import sys
+import threading
 import time
 from pprint import pprint
 from avocado import Test
@@ -30,6 +33,118 @@ from avocado.utils import service
 from avocado.utils import wait
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.mpath import StallMonitor, path_states, wait_until  # noqa: E402
+
+
+class PathWatcher(object):
+    """
+    Polls "multipathd show paths" until paths reach an expected state.
+
+    The poll interval starts small and doubles up to max_step, so a quick
+    transition is noticed within milliseconds while a slow one does not
+    keep multipathd busy.
+    """
+
+    def __init__(self, timeout=60, step=0.01, max_step=1.0):
+        self.timeout = timeout
+        self.step = step
+        self.max_step = max_step
+
+    def wait(self, paths, dm_st, chk_st, start=None):
+        """
+        Waits until all paths show dm_st/chk_st.
+
+        :return: seconds elapsed since start (or since the call), or None
+                 on timeout.
+        """
+        def reached():
+            states = path_states()
+            return all(states.get(path) == (dm_st, chk_st) for path in paths)
+
+        return wait_until(reached, self.timeout, self.step, self.max_step,
+                          start)
+
+
+class PathStatSampler(threading.Thread):
+    """
+    Samples /sys/block/<path>/stat of every path of a mpath at a fixed
+    interval while a benchmark runs.
+    """
+
+    # leading fields of /sys/block/<dev>/stat
+    fields = ['read_ios', 'read_merges', 'read_sectors', 'read_ticks',
+              'write_ios', 'write_merges', 'write_sectors', 'write_ticks',
+              'in_flight', 'io_ticks', 'time_in_queue']
+
+    def __init__(self, paths, interval=1.0):
+        super(PathStatSampler, self).__init__()
+        self.daemon = True
+        self.paths = paths
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def read_stats(self):
+        stats = {}
+        for path in self.paths:
+            with open("/sys/block/%s/stat" % path) as stat:
+                values = [int(val) for val in stat.read().split()]
+            stats[path] = dict(zip(self.fields, values))
+        return stats
+
+    def sample(self):
+        self.samples.append((time.time(), self.read_stats()))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+    def summary(self):
+        """
+        Per path throughput, average latency and share of the I/O between
+        the first and the last sample, plus the evenness of the spread:
+        Jain's fairness index (1.0 is perfectly even) and the coefficient
+        of variation of the per path IO counts.
+        """
+        (start, first), (end, last) = self.samples[0], self.samples[-1]
+        elapsed = max(end - start, 1e-6)
+        per_path = {}
+        for path in self.paths:
+            delta = dict((key, last[path][key] - first[path][key])
+                         for key in self.fields if key != 'in_flight')
+            ios = delta['read_ios'] + delta['write_ios']
+            ticks = delta['read_ticks'] + delta['write_ticks']
+            sectors = delta['read_sectors'] + delta['write_sectors']
+            per_path[path] = {'ios': ios,
+                              'iops': round(ios / elapsed, 1),
+                              'mb_s': round(sectors * 512 / elapsed /
+                                            1048576, 2),
+                              'avg_lat_ms': round(ticks / float(ios), 3)
+                              if ios else 0,
+                              'util': round(delta['io_ticks'] /
+                                            (elapsed * 1000.0), 3)}
+        counts = [per_path[path]['ios'] for path in self.paths]
+        total = sum(counts)
+        for path in self.paths:
+            per_path[path]['share'] = round(
+                per_path[path]['ios'] / float(total), 3) if total else 0
+        squares = sum(count * count for count in counts)
+        mean = total / float(len(counts)) if counts else 0
+        stdev = (sum((count - mean) ** 2 for count in counts) /
+                 float(len(counts))) ** 0.5 if counts else 0
+        return {'elapsed': round(elapsed, 2), 'paths': per_path,
+                'fairness': round(total * total /
+                                  float(len(counts) * squares), 3)
+                if squares else 0,
+                'cov': round(stdev / mean, 3) if mean else 0}
+
 
 class MultipathTest(Test):
     """
@@ -48,8 +163,25 @@ class MultipathTest(Test):
         # iteration.
         self.policies.remove(self.policy)
         self.policies.append(self.policy)
-        self.op_shot_sleep_time = 60
-        self.op_long_sleep_time = 180
+        self.op_shot_sleep_time = int(self.params.get('op_shot_sleep_time',
+                                                      default=0))
+        self.op_long_sleep_time = int(self.params.get('op_long_sleep_time',
+                                                      default=0))
+        self.watcher = PathWatcher(
+            timeout=int(self.params.get('state_timeout', default=60)))
+        self.io_monitor = self.params.get('io_monitor', default=True)
+        self.stall_settle = float(self.params.get('stall_settle',
+                                                  default=2))
+        self.transitions = []
+        self.monitors = {}
+        self.bench_rw = self.params.get('bench_rw', default='randread')
+        self.bench_bs = self.params.get('bench_bs', default='4k')
+        self.bench_iodepth = int(self.params.get('bench_iodepth',
+                                                 default=32))
+        self.bench_numjobs = int(self.params.get('bench_numjobs', default=4))
+        self.bench_runtime = int(self.params.get('bench_runtime', default=60))
+        self.bench_interval = float(self.params.get('bench_interval',
+                                                    default=1))
         # Install needed packages
         dist = distro.detect()
         pkg_name = ""
@@ -67,6 +199,10 @@ class MultipathTest(Test):
         smm = SoftwareManager()
         if not smm.check_installed(pkg_name) and not smm.install(pkg_name):
             self.cancel("Can not install %s" % pkg_name)
+        if self.io_monitor and not smm.check_installed("fio") and \
+                not smm.install("fio"):
+            self.log.warn("fio not available, I/O stalls not measured")
+            self.io_monitor = False
 
         # Check if given multipath devices are present in system
         self.wwids = self.params.get('wwids', default='').split(' ')
@@ -108,6 +244,77 @@ class MultipathTest(Test):
             self.mpath_list.append(self.mpath_dic)
         pprint(self.mpath_list)
 
+    def set_path(self, mpath, path, operation):
+        """
+        Fails or reinstates a path and times it until multipathd reports
+        the new state. Returns False if the state is never reached.
+        """
+        if operation == 'fail':
+            state = ('failed', 'faulty')
+        else:
+            state = ('active', 'ready')
+        start = time.time()
+        if process.system('multipathd -k"%s path %s"' % (operation, path),
+                          ignore_status=True) != 0:
+            return False
+        latency = self.watcher.wait([path], state[0], state[1], start)
+        self.transitions.append({'mpath': mpath, 'path': path,
+                                 'operation': operation,
+                                 'start': start, 'latency': latency})
+        if latency is None:
+            return False
+        self.log.info("%s %s took %.3fs", operation, path, latency)
+        return True
+
+    def start_io(self):
+        """
+        Starts a background fio stream on every multipath device.
+        """
+        if not self.io_monitor:
+            return
+        for dic_mpath in self.mpath_list:
+            monitor = StallMonitor("/dev/mapper/%s" % dic_mpath["name"],
+                                   self.outputdir)
+            monitor.start()
+            self.monitors[dic_mpath["name"]] = monitor
+
+    def stop_io(self):
+        """
+        Stops the fio streams, works out the stall each transition caused
+        and writes everything to multipath_transitions.json.
+        """
+        for monitor in self.monitors.values():
+            monitor.stop()
+        samples = dict((name, monitor.samples())
+                       for name, monitor in self.monitors.items())
+        monitors, self.monitors = self.monitors, {}
+        summary = {}
+        for trans in self.transitions:
+            if trans['latency'] is not None and trans['mpath'] in samples:
+                end = trans['start'] + trans['latency'] + self.stall_settle
+                trans['stall_ms'] = monitors[trans['mpath']].stall(
+                    samples[trans['mpath']], trans['start'], end)
+            stats = summary.setdefault(trans['operation'],
+                                       {'count': 0, 'timeouts': 0,
+                                        'max_latency': 0, 'max_stall_ms': 0})
+            stats['count'] += 1
+            if trans['latency'] is None:
+                stats['timeouts'] += 1
+                continue
+            stats['max_latency'] = round(max(stats['max_latency'],
+                                             trans['latency']), 3)
+            stats['max_stall_ms'] = max(stats['max_stall_ms'],
+                                        trans.get('stall_ms', 0))
+        if not self.transitions:
+            return
+        with open(os.path.join(self.outputdir,
+                               "multipath_transitions.json"), 'w') as out:
+            json.dump({'transitions': self.transitions,
+                       'summary': summary}, out, indent=2)
+        self.whiteboard = json.dumps(summary)
+        self.log.info("path transitions: %s", summary)
+        self.transitions = []
+
     def test(self):
         """
         Tests Multipath.
@@ -155,20 +362,113 @@ class MultipathTest(Test):
         if msg:
             self.fail("Some tests failed. Find details below:\n%s" % msg)
 
+    def run_fio(self, dic_mpath):
+        """
+        Runs the benchmark workload on a mpath while sampling its paths.
+
+        :return: fio summary, None if fio failed, and per path statistics
+        """
+        # only pure read workloads can run on a read-only device
+        readonly = ""
+        if self.bench_rw in ('read', 'randread'):
+            readonly = "--readonly"
+        cmd = "fio --name=bench --filename=/dev/mapper/%s --rw=%s --bs=%s " \
+              "--direct=1 --ioengine=libaio --iodepth=%d --numjobs=%d " \
+              "--group_reporting --time_based --runtime=%d %s " \
+              "--output-format=json" \
+              % (dic_mpath["name"], self.bench_rw, self.bench_bs,
+                 self.bench_iodepth, self.bench_numjobs,
+                 self.bench_runtime, readonly)
+        sampler = PathStatSampler(dic_mpath["paths"], self.bench_interval)
+        sampler.sample()
+        sampler.start()
+        try:
+            result = process.run(cmd, ignore_status=True, sudo=True,
+                                 shell=True)
+        finally:
+            sampler.stop()
+        if result.exit_status:
+            self.log.info("fio failed on %s: %s", dic_mpath["name"],
+                          result.stderr_text)
+            fio = None
+        else:
+            fio = {}
+            # fio may print notes before its json output
+            output = result.stdout_text
+            job = json.loads(output[output.index('{'):])['jobs'][0]
+            for direction in ('read', 'write'):
+                if not job[direction]['io_bytes']:
+                    continue
+                clat = job[direction]['clat_ns']
+                fio[direction] = {
+                    'iops': round(job[direction]['iops'], 1),
+                    'mb_s': round(job[direction]['bw'] / 1024.0, 2),
+                    'clat_mean_us': round(clat['mean'] / 1000.0, 1),
+                    'clat_p99_us': round(clat.get('percentile', {}).get(
+                        '99.000000', 0) / 1000.0, 1)}
+        stats = sampler.summary()
+        stats['fio'] = fio
+        stats['series'] = [(round(stamp, 3), sample)
+                           for stamp, sample in sampler.samples]
+        return stats
+
+    def test_policy_benchmark(self):
+        """
+        Runs the same fio workload on every mpath under each path selector
+        policy and compares throughput, latency and spread across paths.
+        """
+        smm = SoftwareManager()
+        if not smm.check_installed("fio") and not smm.install("fio"):
+            self.cancel("fio is needed for the policy benchmark")
+        results = {}
+        summary = {}
+        msg = ""
+        for policy in self.policies:
+            cmd = "path_selector \"%s 0\"" % policy
+            multipath.form_conf_mpath_file(defaults_extra=cmd)
+            for dic_mpath in self.mpath_list:
+                if multipath.get_policy(dic_mpath["wwid"]) != policy:
+                    msg += "%s for %s fails\n" % (policy, dic_mpath["wwid"])
+                    continue
+                # paths may be renamed after the map reload
+                dic_mpath["paths"] = multipath.get_paths(dic_mpath["wwid"])
+                self.log.info("benchmarking %s with %s", dic_mpath["name"],
+                              policy)
+                stats = self.run_fio(dic_mpath)
+                if stats['fio'] is None:
+                    msg += "fio failed on %s with %s\n" % (dic_mpath["name"],
+                                                           policy)
+                results.setdefault(dic_mpath["name"], {})[policy] = stats
+                summary.setdefault(dic_mpath["name"], {})[policy] = {
+                    'fio': stats['fio'], 'fairness': stats['fairness'],
+                    'cov': stats['cov'],
+                    'share': dict((path, val['share']) for path, val in
+                                  stats['paths'].items())}
+                self.log.info("%s %s: %s", dic_mpath["name"], policy,
+                              summary[dic_mpath["name"]][policy])
+        with open(os.path.join(self.outputdir,
+                               "multipath_policy_bench.json"), 'w') as out:
+            json.dump(results, out, indent=2)
+        self.whiteboard = json.dumps(summary)
+        if msg:
+            self.fail("Policy benchmark failed:\n%s" % msg)
+
     def test_fail_reinstate_individual_paths(self):
         '''
         Failing and reinstating individual paths eg: sdX
         '''
         err_paths = []
         self.log.info(" Failing and reinstating the individual paths")
+        self.start_io()
         for dic_path in self.mpath_list:
             for path in dic_path['paths']:
-                if multipath.fail_path(path) is False:
+                if not self.set_path(dic_path['name'], path, 'fail'):
                     self.log.info("could not fail %s in indvdl path:", path)
                     err_paths.append(path)
-                elif multipath.reinstate_path(path) is False:
+                elif not self.set_path(dic_path['name'], path, 'reinstate'):
                     self.log.info("couldn't reinstat %s in indvdl path", path)
                     err_paths.append(path)
+        self.stop_io()
         self.mpath_svc.restart()
         wait.wait_for(self.mpath_svc.status, timeout=10)
         if err_paths:
@@ -181,17 +481,19 @@ class MultipathTest(Test):
         '''
         err_paths = []
         self.log.info("Failing and reinstating the n-1 paths")
+        self.start_io()
         for dic_path in self.mpath_list:
             for path in dic_path['paths'][:-1]:
-                if multipath.fail_path(path) is False:
+                if not self.set_path(dic_path['name'], path, 'fail'):
                     self.log.info("could not fail %s under n-1 path", path)
                     err_paths.append(path)
 
             time.sleep(self.op_long_sleep_time)
             for path in dic_path['paths'][:-1]:
-                if multipath.reinstate_path(path) is False:
+                if not self.set_path(dic_path['name'], path, 'reinstate'):
                     self.log.info("couldn't reinstate in n-1 path: %s", path)
                     err_paths.append(path)
+        self.stop_io()
         self.mpath_svc.restart()
         wait.wait_for(self.mpath_svc.status, timeout=10)
         if err_paths:
@@ -203,17 +505,19 @@ class MultipathTest(Test):
         '''
         err_paths = []
         self.log.info("Failing and reinstating the n-1 paths")
+        self.start_io()
         for dic_path in self.mpath_list:
             for path in dic_path["paths"]:
-                if multipath.fail_path(path) is False:
+                if not self.set_path(dic_path['name'], path, 'fail'):
                     self.log.info("could not fail under all path %s", path)
                     err_paths.append(path)
 
             time.sleep(self.op_long_sleep_time)
             for path in dic_path["paths"]:
-                if multipath.reinstate_path(path) is False:
+                if not self.set_path(dic_path['name'], path, 'reinstate'):
                     self.log.info("couldn't reinstate in all path %s", path)
                     err_paths.append(path)
+        self.stop_io()
         self.mpath_svc.restart()
         wait.wait_for(self.mpath_svc.status, timeout=10)
         if err_paths:
@@ -301,6 +605,8 @@ class MultipathTest(Test):
         """
         Restore config file, if existed, and restart services
         """
+        for monitor in getattr(self, 'monitors', {}).values():
+            monitor.stop()
         if os.path.isfile("%s.bkp" % self.mpath_file):
             shutil.copyfile("%s.bkp" % self.mpath_file, self.mpath_file)
         self.mpath_svc.restart()
@@ -52,6 +52,8 @@ class ParallelDd(Test):
         :params dd_roptions: dd read options.
         :params fs_dd_woptions: dd write in streams.
         :params fs_dd_roptions: dd read in streams.
+        :params concurrent: Run all the fs streams at the same time and
+                            record per-stream throughput. Defaults to false.
         """
 
         self.disk = self.params.get('disk')
@@ -69,6 +71,8 @@ class ParallelDd(Test):
         self.dd_roptions = self.params.get('dd_roptions', default='')
         self.fs_dd_woptions = self.params.get('fs_dd_woptions', default='')
         self.fs_dd_roptions = self.params.get('fs_dd_roptions', default='')
+        self.concurrent = self.params.get('concurrent', default=False)
+        self.stream_rates = {}
         if self.fstype == 'btrfs':
             ver = int(distro.detect().version)
             rel = int(distro.detect().release)
@@ -111,17 +115,61 @@ class ParallelDd(Test):
                 cmd += " %s=%s" % (option.split(":")[0], option.split(":")[1])
             process.run(cmd, shell=True)
 
+    def _stream_cmd(self, operation, index):
+        """
+        Returns the dd command line of a single fs stream.
+        """
+        s_file = os.path.join(self.workdir, 'poo%d' % (index + 1))
+        if operation == 'write':
+            cmd = 'dd if=/dev/zero of=%s bs=4k count=%d' % \
+                (s_file, self.blocks_per_file)
+            options = self.fs_dd_woptions
+        else:
+            cmd = 'dd if=%s of=/dev/null bs=4k count=%d' % \
+                (s_file, self.blocks_per_file)
+            options = self.fs_dd_roptions
+        for option in options.split():
+            cmd += " %s=%s" % (option.split(":")[0], option.split(":")[1])
+        return cmd
+
+    def _run_concurrent(self, operation):
+        """
+        Starts all the streams at once, waits for them together and records
+        the per-stream throughput of the operation in MB/s.
+        """
+        procs = []
+        for i in range(self.streams):
+            cmd = self._stream_cmd(operation, i)
+            proc = process.get_sub_process_klass(cmd)(cmd + ' > /dev/null',
+                                                      shell=True)
+            procs.append(proc)
+        start = time.time()
+        for proc in procs:
+            proc.start()
+        elapsed = [None] * self.streams
+        while None in elapsed:
+            for i, proc in enumerate(procs):
+                if elapsed[i] is None and proc.poll() is not None:
+                    elapsed[i] = time.time() - start
+            time.sleep(0.01)
+        failed = [proc.cmd for proc in procs if proc.result.exit_status]
+        if failed:
+            self.fail("fs %s streams failed: %s" % (operation, failed))
+        stream_mb = self.blocks_per_file * 4 / 1024.0
+        rates = [stream_mb / max(secs, 1e-6) for secs in elapsed]
+        self.stream_rates['fs_%s' % operation] = rates
+        self.log.info("fs %s per-stream MB/s: %s", operation,
+                      ", ".join("%.2f" % rate for rate in rates))
+
     def fs_write(self):
         """
          Write out 'streams' files in parallel background task.
         """
+        if self.concurrent:
+            self._run_concurrent('write')
+            return
         for i in range(self.streams):
-            s_file = os.path.join(self.workdir, 'poo%d' % (i + 1))
-            cmd = 'dd if=/dev/zero of=%s bs=4k count=%d' % \
-                (s_file, self.blocks_per_file)
-            for option in self.fs_dd_woptions.split():
-                cmd += " %s=%s" % (option.split(":")[0],
-                                   option.split(":")[1])
+            cmd = self._stream_cmd('write', i)
             # Wait for everyone to complete
             proc = process.get_sub_process_klass(cmd)(cmd + ' > /dev/null',
                                                       shell=True)
@@ -135,13 +183,11 @@ class ParallelDd(Test):
         """
         Read in 'streams' files in parallel background tasks.
         """
+        if self.concurrent and not self.seq_read:
+            self._run_concurrent('read')
+            return
         for i in range(self.streams):
-            s_file = os.path.join(self.workdir, 'poo%d' % (i + 1))
-            cmd = 'dd if=%s of=/dev/null bs=4k count=%d' % \
-                (s_file, self.blocks_per_file)
-            for option in self.fs_dd_roptions.split():
-                cmd += " %s=%s" % (option.split(":")[0],
-                                   option.split(":")[1])
+            cmd = self._stream_cmd('read', i)
             if self.seq_read:
                 process.run(cmd + ' > /dev/null', shell=True)
             else:
@@ -202,10 +248,14 @@ class ParallelDd(Test):
         self.fs_read()
         fs_read_rate = self.megabytes / (time.time() - start)
 
-        self.whiteboard = json.dumps({'raw_write': raw_write_rate,
-                                      'raw_read': raw_read_rate,
-                                      'fs_write': fs_write_rate,
-                                      'fs_read': fs_read_rate})
+        results = {'raw_write': raw_write_rate,
+                   'raw_read': raw_read_rate,
+                   'fs_write': fs_write_rate,
+                   'fs_read': fs_read_rate}
+        for operation, rates in self.stream_rates.items():
+            results['%s_streams' % operation] = rates
+            results['%s_spread' % operation] = max(rates) - min(rates)
+        self.whiteboard = json.dumps(results)
 
     def tearDown(self):
         """
@@ -15,7 +15,10 @@
 # Author: Naresh Bannoth <nbannoth@in.ibm.com>
 # this script runs portbounce test on different ports of fc or fcoe switches.
 
+import json
+import os
 import re
+import sys
 import time
 # import telnetlib
 from avocado import Test
@@ -23,13 +26,17 @@ import paramiko
 from avocado.utils import process
 from avocado.utils import genio
 from avocado.utils import multipath
-from avocado.utils import wait
+from avocado.utils.software_manager import SoftwareManager
 # import shutil
 # try:
 #    import pxssh
 # except ImportError:
 #    from pexpect import pxssh
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.mpath import StallMonitor, path_states, wait_until  # noqa: E402
+
 
 class CommandFailed(Exception):
     '''
@@ -56,6 +63,8 @@ class PortBounceTest(Test):
     :param sbt: short bounce time in seconds
     :param lbt: long bounce time in seconds
     :param count: Number of times test to run
+    :param state_timeout: seconds to wait for a port or path state change
+    :param io_monitor: run fio on the mpath devices to measure I/O stalls
     """
 
     def setUp(self):
@@ -70,7 +79,11 @@ class PortBounceTest(Test):
         self.lbt = int(self.params.get("lbt", '*', default=250))
         self.count = int(self.params.get("count", '*', default="2"))
         self.prompt = ">"
-        self.verify_sleep_time = 20
+        self.state_timeout = int(self.params.get("state_timeout", '*',
+                                                 default=60))
+        self.io_monitor = self.params.get("io_monitor", '*', default=True)
+        self.transitions = []
+        self.monitors = {}
         self.port_ids = []
         self.host = []
         self.dic = {}
@@ -85,6 +98,11 @@ class PortBounceTest(Test):
                 self.host.append(self.get_fc_host(path))
         self.host = list(dict.fromkeys(self.host))
         self.log.info("AllHostValues: %s" % self.host)
+        if self.io_monitor:
+            smm = SoftwareManager()
+            if not smm.check_installed("fio") and not smm.install("fio"):
+                self.log.warn("fio not available, I/O stalls not measured")
+                self.io_monitor = False
 
         self.switch_login(self.switch_name, self.userid, self.password)
         for host in self.host:
@@ -126,17 +144,39 @@ class PortBounceTest(Test):
         if not hasattr(self, 'tnc'):
             self.fail("telnet connection to the fc/nic switch not yet done")
         self.remote_conn.send(command + '\n')
-        time.sleep(self.verify_sleep_time)
-        response = self.remote_conn.recv(4000)
+        response = self.read_until_prompt(timeout)
         self.log.info("response before sendonly_output: %s", response)
         return self._send_only_result(command, response)
 
+    def read_until_prompt(self, timeout):
+        '''
+        Reads the switch output until the prompt comes back, instead of
+        sleeping for a fixed time and hoping the command has completed
+        '''
+        response = b''
+        step = 0.01
+        end = time.time() + timeout
+        while time.time() < end:
+            if self.remote_conn.recv_ready():
+                response += self.remote_conn.recv(4000)
+                step = 0.01
+                if response.rstrip().endswith(self.prompt.encode()):
+                    break
+                continue
+            time.sleep(step)
+            step = min(step * 2, 1.0)
+        return response
+
     def test(self):
         '''
         Test method
         '''
         self.failure_list = {}
-        self.port_bounce()
+        self.start_io()
+        try:
+            self.port_bounce()
+        finally:
+            self.stop_io()
         if self.failure_list:
             self.fail("failed ports, details: %s" % self.failure_list)
 
@@ -166,20 +206,84 @@ class PortBounceTest(Test):
         port bounce starts here
         '''
         # Port disable and verification both in switch and OS
+        start = time.time()
         self.port_enable_disable(test_ports, 'disable')
-        time.sleep(self.verify_sleep_time)
         self.verify_switch_port_state(test_ports, 'Disabled')
+        self.wait_host_state(test_ports, ("Linkdown", "Offline"))
         self.verify_port_host_state(test_ports, "Linkdown")
-        self.mpath_state_check(test_ports, "failed", "faulty")
+        self.mpath_state_check(test_ports, "failed", "faulty", start)
         time.sleep(sleep_time)
 
         # Port Enable and verification both in switch and OS
+        start = time.time()
         self.port_enable_disable(test_ports, 'enable')
-        time.sleep(self.verify_sleep_time)
         self.verify_switch_port_state(test_ports, 'Online')
+        self.wait_host_state(test_ports, ("Online",))
         self.verify_port_host_state(test_ports, "Online")
-        time.sleep(self.verify_sleep_time)
-        self.mpath_state_check(test_ports, 'active', 'ready')
+        self.mpath_state_check(test_ports, 'active', 'ready', start)
+
+    def wait_host_state(self, test_ports, states):
+        '''
+        waits for the fc_host port_state of the ports to reach one of states
+        '''
+        def reached():
+            for port in test_ports:
+                state = genio.read_file("/sys/class/fc_host/%s/port_state"
+                                        % self.dic[port]).rstrip("\n")
+                if state not in states:
+                    return False
+            return True
+
+        return wait_until(reached, self.state_timeout)
+
+    def start_io(self):
+        '''
+        starts a background fio stream on every mpath under test
+        '''
+        if not self.io_monitor:
+            return
+        for wwid in self.wwids:
+            name = multipath.get_mpath_name(wwid)
+            monitor = StallMonitor("/dev/mapper/%s" % name, self.outputdir)
+            monitor.start()
+            self.monitors[name] = monitor
+
+    def stop_io(self):
+        '''
+        stops the fio streams, adds the I/O stall of every mpath to each
+        transition and writes port_bounce_transitions.json
+        '''
+        for monitor in self.monitors.values():
+            monitor.stop()
+        samples = dict((name, monitor.samples())
+                       for name, monitor in self.monitors.items())
+        monitors, self.monitors = self.monitors, {}
+        summary = {}
+        for trans in self.transitions:
+            stats = summary.setdefault(trans['state'],
+                                       {'count': 0, 'timeouts': 0,
+                                        'max_latency': 0, 'max_stall_ms': 0})
+            stats['count'] += 1
+            if trans['latency'] is None:
+                stats['timeouts'] += 1
+                continue
+            end = trans['start'] + trans['latency']
+            trans['stall_ms'] = dict(
+                (name, monitors[name].stall(mpath_samples, trans['start'],
+                                            end))
+                for name, mpath_samples in samples.items())
+            stats['max_latency'] = round(max(stats['max_latency'],
+                                             trans['latency']), 3)
+            stats['max_stall_ms'] = max([stats['max_stall_ms']] +
+                                        list(trans['stall_ms'].values()))
+        if not self.transitions:
+            return
+        with open(os.path.join(self.outputdir,
+                               "port_bounce_transitions.json"), 'w') as out:
+            json.dump({'transitions': self.transitions,
+                       'summary': summary}, out, indent=2)
+        self.whiteboard = json.dumps(summary)
+        self.log.info("port bounce transitions: %s", summary)
 
     def port_enable_disable(self, test_ports, typ):
         '''
@@ -202,7 +306,18 @@ class PortBounceTest(Test):
         checking port link status after disabling the switch port
         '''
         self.log.info("verifying switch port %s", state)
-        switch_info = self.run_command("switchshow")
+        output = {}
+
+        def reached():
+            output['switch'] = self.run_command("switchshow")
+            for port in test_ports:
+                if not re.search(".*%s.*%s" % (port, state),
+                                 output['switch']):
+                    return False
+            return True
+
+        wait_until(reached, self.state_timeout, step=1)
+        switch_info = output['switch']
         for port in test_ports:
             self.log.info("verify port %s %s in %s", port, state, test_ports)
             port_string = ".*%s.*%s" % (port, state)
@@ -237,27 +352,41 @@ class PortBounceTest(Test):
                 self.fail("port state not changed in host expected \
                           state: %s,actual_state: %s" % (status, state))
 
-    def mpath_state_check(self, ports, state1, state2):
+    def mpath_state_check(self, ports, state1, state2, start=None):
         '''
-        checking mpath disk status after disabling the switch port
+        checking mpath disk status after disabling the switch port, and
+        recording how long after start each path got there
         '''
-        curr_path = ''
+        if start is None:
+            start = time.time()
         err_paths = []
-
-        def is_path_online():
-            path_stat = multipath.get_path_status(curr_path)
-            if path_stat[0] != state1 or path_stat[2] != state2:
-                return False
-            return True
-
+        pending = {}
         for port in ports:
-            paths = self.get_paths(self.dic[port])
             self.log.info("verify %s path status for port %s in %s",
                           state1, port, ports)
-            for path in paths:
-                curr_path = path
-                if not wait.wait_for(is_path_online, timeout=10):
-                    err_paths.append("%s:%s" % (port, curr_path))
+            for path in self.get_paths(self.dic[port]):
+                pending[path] = port
+        latency = {}
+
+        def reached():
+            states = path_states()
+            for path in list(pending):
+                if states.get(path) == (state1, state2):
+                    latency[path] = time.time() - start
+                    del pending[path]
+            return not pending
+
+        wait_until(reached, self.state_timeout)
+        for path, port in pending.items():
+            err_paths.append("%s:%s" % (port, path))
+        for path in latency:
+            self.log.info("path %s %s after %.3fs", path, state1,
+                          latency[path])
+        self.transitions.append({'ports': ports, 'state': state1,
+                                 'start': start,
+                                 'latency': None if pending else
+                                 max(list(latency.values()) + [0]),
+                                 'paths': latency})
         if err_paths:
             self.error("following paths not %s: %s" % (state1, err_paths))
         else:
@@ -309,8 +438,9 @@ class PortBounceTest(Test):
         checks for any error or failure messages in dmesg and
         bring backs the switch port_online after test completion
         '''
+        for monitor in getattr(self, 'monitors', {}).values():
+            monitor.stop()
         self.port_enable_disable(self.port_ids, 'enable')
-        time.sleep(self.verify_sleep_time)
         self.verify_switch_port_state(self.port_ids, 'Online')
         output = process.system_output("dmesg -T --level=alert,crit,err,warn",
                                        ignore_status=True,
@@ -28,16 +28,20 @@ import socket
 import fcntl
 import struct
 import netifaces
+import sys
 from avocado import Test
 from avocado.utils.software_manager import SoftwareManager
 from avocado.utils import distro
 from avocado.utils import process
 from avocado.utils import linux_modules
 from avocado.utils import genio
-from avocado.utils.ssh import Session
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.peer import peer_session, reset_session  # noqa: E402
+
 
 class Bonding(Test):
     '''
@@ -116,10 +120,14 @@ class Bonding(Test):
         if self.host_interface[0:2] == 'ib':
             self.ib = True
         self.log.info("Bond Test on IB Interface? = %s", self.ib)
-        self.session = Session(self.peer_first_ipinterface, user=self.user,
-                               password=self.password)
-        if not self.session.connect():
+        self.peer_persist = int(self.params.get("peer_persist", default=600))
+        self.session = peer_session(self.peer_first_ipinterface, self.user,
+                                    self.password, self.peer_persist)
+        if not self.session:
             self.cancel("failed connecting to peer")
+        if self.peer_public_ip:
+            peer_session(self.peer_public_ip, self.user, self.password,
+                         self.peer_persist)
         self.setup_ip()
         self.err = []
         self.remotehost = RemoteHost(self.peer_first_ipinterface, self.user,
@@ -438,6 +446,8 @@ class Bonding(Test):
         if self.peer_bond_needed:
             self.bond_setup("peer", "")
         self.bond_setup("local", self.mode)
+        # the master connection ran over the interfaces just bonded
+        reset_session(self.session)
         self.log.info(genio.read_file(self.bond_status))
         self.ping_check()
         self.error_check()
@@ -493,12 +503,16 @@ class Bonding(Test):
                 peer_public_networkinterface = NetworkInterface(interface,
                                                                 self.remotehost_public)
                 peer_public_networkinterface.set_mtu("1500")
+        # The interfaces the master connections ran over were reconfigured,
+        # close them even when they were meant to persist
         self.remotehost.remote_session.quit()
         self.remotehost_public.remote_session.quit()
+        self.session.quit()
 
     def error_check(self):
         if self.err:
             self.fail("Tests failed. Details:\n%s" % "\n".join(self.err))
 
     def tearDown(self):
-        self.session.quit()
+        if not self.peer_persist:
+            self.session.quit()
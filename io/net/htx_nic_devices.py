@@ -16,7 +16,9 @@
 
 import os
 import re
+import json
 import time
+import threading
 try:
     import pxssh
 except ImportError:
@@ -32,6 +34,13 @@ from avocado.utils.process import CmdError
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 
+# Same control socket as avocado.utils.ssh.Session, so the pxssh login and
+# the RemoteHost sessions share a single master connection to the peer
+SSH_CONTROL_PATH = '~/.ssh/avocado-master-%r@%h:%p'
+EXIT_MARKER = '__HTX_EXIT_STATUS__'
+ERRLOG_SIZE_MARKER = '__HTX_ERRLOG_SIZE__'
+HTX_URL = "https://github.com/open-power/HTX/archive/master.zip"
+
 
 class CommandFailed(Exception):
     def __init__(self, command, output, exitcode):
@@ -106,32 +115,28 @@ class HtxNicTest(Test):
             self.cancel("Test not supported in  %s" % detected_distro.name)
 
         smm = SoftwareManager()
-        for pkg in packages:
-            if not smm.check_installed(pkg) and not smm.install(pkg):
-                self.cancel("Can not install %s" % pkg)
-            try:
-                cmd = "%s install %s" % (smm.backend.base_command, pkg)
-                self.run_command(cmd)
-            except CommandFailed:
-                self.cancel("unable to install the package %s on peer machine"
-                            % pkg)
+        exercisers = ["hxecapi_afu_dir", "hxecapi", "hxeocapi"]
+        if not smm.check_installed('dapl-devel'):
+            exercisers.append("hxedapl")
+        self.run_on_both(lambda: self.build_htx_in_host(smm, packages,
+                                                        exercisers),
+                         lambda: self.build_htx_in_peer(smm, packages,
+                                                        exercisers))
+
+    def build_htx_in_host(self, smm, packages, exercisers):
+        missing = [pkg for pkg in packages if not smm.check_installed(pkg)]
+        if missing and not smm.install(" ".join(missing)):
+            self.cancel("Can not install %s" % " ".join(missing))
         if self.htx_url:
-            htx = self.htx_url.split("/")[-1]
             htx_rpm = self.fetch_asset(self.htx_url)
             process.system("rpm -ivh --force %s" % htx_rpm)
-            self.run_command("wget %s -O /tmp/%s" % (self.htx_url, htx))
-            self.run_command("cd /tmp")
-            self.run_command("rpm -ivh --force %s" % htx)
         else:
-            url = "https://github.com/open-power/HTX/archive/master.zip"
-            tarball = self.fetch_asset("htx.zip", locations=[url], expire='7d')
+            tarball = self.fetch_asset("htx.zip", locations=[HTX_URL],
+                                       expire='7d')
             archive.extract(tarball, self.teststmpdir)
             htx_path = os.path.join(self.teststmpdir, "HTX-master")
             os.chdir(htx_path)
 
-            exercisers = ["hxecapi_afu_dir", "hxecapi", "hxeocapi"]
-            if not smm.check_installed('dapl-devel'):
-                exercisers.append("hxedapl")
             for exerciser in exercisers:
                 process.run("sed -i 's/%s//g' %s/bin/Makefile" % (exerciser,
                                                                   htx_path))
@@ -142,8 +147,22 @@ class HtxNicTest(Test):
             if process.system('./installer.sh -f'):
                 self.fail("Installation of htx fails:please refer job.log")
 
+    def build_htx_in_peer(self, smm, packages, exercisers):
+        try:
+            cmd = "%s install %s" % (smm.backend.base_command,
+                                     " ".join(packages))
+            self.run_command(cmd)
+        except CommandFailed:
+            self.cancel("unable to install the packages %s on peer machine"
+                        % " ".join(packages))
+        if self.htx_url:
+            htx = self.htx_url.split("/")[-1]
+            self.run_command("wget %s -O /tmp/%s" % (self.htx_url, htx))
+            self.run_command("cd /tmp")
+            self.run_command("rpm -ivh --force %s" % htx)
+        else:
             try:
-                self.run_command("wget %s -O /tmp/master.zip" % url)
+                self.run_command("wget %s -O /tmp/master.zip" % HTX_URL)
                 self.run_command("cd /tmp")
                 self.run_command("unzip master.zip")
                 self.run_command("cd HTX-master")
@@ -157,6 +176,34 @@ class HtxNicTest(Test):
             except CommandFailed:
                 self.cancel("HTX is not installed on Peer")
 
+    def run_on_both(self, host_step, peer_step, parallel=None):
+        """
+        Runs the host and the peer halves of a phase and returns both
+        results. With parallel_phases (or parallel=True) the peer half runs
+        in a thread while the host half runs here, and the first error of
+        either is raised.
+        """
+        if parallel is None:
+            parallel = self.parallel_phases
+        if not parallel:
+            return host_step(), peer_step()
+        results = {}
+
+        def run(side, step):
+            try:
+                results[side] = (step(), None)
+            except Exception as details:
+                results[side] = (None, details)
+
+        peer = threading.Thread(target=run, args=('peer', peer_step))
+        peer.start()
+        run('host', host_step)
+        peer.join()
+        for side in ('host', 'peer'):
+            if results[side][1] is not None:
+                raise results[side][1]
+        return results['host'][0], results['peer'][0]
+
     def parameters(self):
         self.host_ip = self.params.get("host_public_ip", '*', default=None)
         self.peer_ip = self.params.get("peer_public_ip", '*', default=None)
@@ -172,10 +219,18 @@ class HtxNicTest(Test):
         self.time_limit = int(self.params.get("time_limit",
                                               '*', default=2)) * 60
         self.query_cmd = "htxcmdline -query -mdt %s" % self.mdt_file
+        self.susp_cmd = "htxcmdline -suspend all  -mdt %s" % self.mdt_file
         self.ipaddr = self.params.get("host_ips", default="").split(" ")
         self.netmask = self.params.get("netmask", default="")
         self.peer_ips = self.params.get("peer_ips", default="").split(" ")
         self.htx_url = self.params.get("htx_rpm", default="")
+        self.parallel_phases = self.params.get("parallel_phases",
+                                               default=False)
+        self.monitor_interval = int(self.params.get("monitor_interval",
+                                                    default=60))
+        self.errlog_interval = int(self.params.get("errlog_interval",
+                                                   default=5))
+        self.peer_persist = int(self.params.get("peer_persist", default=600))
 
     def login(self, ip, username, password):
         '''
@@ -185,6 +240,13 @@ class HtxNicTest(Test):
         # Work-around for old pxssh not having options= parameter
         pxh.SSH_OPTS = "%s  -o 'StrictHostKeyChecking=no'" % pxh.SSH_OPTS
         pxh.SSH_OPTS = "%s  -o 'UserKnownHostsFile /dev/null' " % pxh.SSH_OPTS
+        if self.peer_persist:
+            # Share the master connection with the RemoteHost sessions and
+            # keep it around for the next tests of the job
+            pxh.SSH_OPTS = ("%s -o 'ControlMaster=auto' "
+                            "-o 'ControlPath=%s' -o 'ControlPersist=%ss' "
+                            % (pxh.SSH_OPTS, SSH_CONTROL_PATH,
+                               self.peer_persist))
         pxh.force_password = True
 
         pxh.login(ip, username, password)
@@ -207,13 +269,24 @@ class HtxNicTest(Test):
         if not hasattr(self, 'pxssh'):
             self.fail("SSH Console setup is not yet done")
         con = self.pxssh
-        con.sendline(command)
+        # The exit code is printed on a line of its own after the output
+        # of the command, so that it comes back within the same round trip
+        # even when that output does not end with a newline
+        con.sendline("%s; printf '\\n%s%%d\\n' $?" % (command, EXIT_MARKER))
         con.expect("\n")  # from us
         con.expect(con.PROMPT, timeout=timeout)
         output = con.before.splitlines()
-        con.sendline("echo $?")
-        con.prompt(timeout)
-        exitcode = int(''.join(con.before.splitlines()[1:]))
+        exitcode = -1
+        for index in range(len(output) - 1, -1, -1):
+            match = re.match(r'^%s(\d+)\s*$' % EXIT_MARKER, output[index])
+            if match:
+                exitcode = int(match.group(1))
+                del output[index]
+                # drop the newline printf added ahead of the marker when the
+                # output already ended with one
+                if index and not output[index - 1].strip():
+                    del output[index - 1]
+                break
         if exitcode != 0 and exitcode != 43:
             raise CommandFailed(command, output, exitcode)
         return output
@@ -486,31 +559,46 @@ class HtxNicTest(Test):
 
     def start_htx_deamon(self):
         cmd = '/usr/lpp/htx/etc/scripts/htxd_run'
-        self.log.info("Starting the HTX Deamon in Host")
-        process.run(cmd, shell=True, sudo=True)
 
-        self.log.info("Starting the HTX Deamon in Peer")
-        self.run_command(cmd)
+        def host():
+            self.log.info("Starting the HTX Deamon in Host")
+            process.run(cmd, shell=True, sudo=True)
+
+        def peer():
+            self.log.info("Starting the HTX Deamon in Peer")
+            self.run_command(cmd)
+
+        self.run_on_both(host, peer)
 
     def generate_mdt_files(self):
-        self.log.info("Generating mdt files in Host")
         cmd = "htxcmdline -createmdt"
-        process.run(cmd, shell=True, sudo=True)
 
-        self.log.info("Generating mdt files in Peer")
-        self.run_command(cmd)
+        def host():
+            self.log.info("Generating mdt files in Host")
+            process.run(cmd, shell=True, sudo=True)
+
+        def peer():
+            self.log.info("Generating mdt files in Peer")
+            self.run_command(cmd)
+
+        self.run_on_both(host, peer)
 
     def select_net_mdt(self):
-        self.log.info("Selecting the htx %s file in Host", self.mdt_file)
         cmd = "htxcmdline -select -mdt %s" % self.mdt_file
-        process.run(cmd, shell=True, sudo=True)
 
-        self.log.info("Selecting the htx %s file in Peer", self.mdt_file)
-        self.run_command(cmd)
+        def host():
+            self.log.info("Selecting the htx %s file in Host", self.mdt_file)
+            process.run(cmd, shell=True, sudo=True)
+
+        def peer():
+            self.log.info("Selecting the htx %s file in Peer", self.mdt_file)
+            self.run_command(cmd)
+
+        self.run_on_both(host, peer)
 
     def query_net_devices_in_mdt(self):
-        self.is_net_devices_in_host_mdt()
-        self.is_net_devices_in_peer_mdt()
+        self.run_on_both(self.is_net_devices_in_host_mdt,
+                         self.is_net_devices_in_peer_mdt)
 
     def is_net_devices_in_host_mdt(self):
         '''
@@ -553,92 +641,199 @@ class HtxNicTest(Test):
                       self.peer_intfs, self.mdt_file)
 
     def activate_mdt(self):
-        self.log.info("Activating the N/W devices with mdt %s in Host",
-                      self.mdt_file)
         cmd = "htxcmdline -activate all -mdt %s" % self.mdt_file
-        try:
-            process.run(cmd, shell=True, sudo=True)
-        except CmdError as details:
-            self.log.debug("Activation of N/W devices (%s) failed in Host",
-                           self.mdt_file)
-            self.fail("Command %s failed %s" % (cmd, details))
 
-        self.log.info("Activating the N/W devices with mdt %s in Peer",
-                      self.mdt_file)
-        try:
-            self.run_command(cmd)
-        except CommandFailed as cf:
-            self.log.debug("Activation of N/W devices (%s) failed in Peer",
-                           self.mdt_file)
-            self.fail("Command %s failed %s" % (cmd, str(cf)))
+        def host():
+            self.log.info("Activating the N/W devices with mdt %s in Host",
+                          self.mdt_file)
+            try:
+                process.run(cmd, shell=True, sudo=True)
+            except CmdError as details:
+                self.log.debug("Activation of N/W devices (%s) failed in Host",
+                               self.mdt_file)
+                self.fail("Command %s failed %s" % (cmd, details))
+
+        def peer():
+            self.log.info("Activating the N/W devices with mdt %s in Peer",
+                          self.mdt_file)
+            try:
+                self.run_command(cmd)
+            except CommandFailed as cf:
+                self.log.debug("Activation of N/W devices (%s) failed in Peer",
+                               self.mdt_file)
+                self.fail("Command %s failed %s" % (cmd, str(cf)))
+
+        self.run_on_both(host, peer)
 
     def is_net_devices_active(self):
-        if not self.is_net_device_active_in_host():
+        host_active, peer_active = self.run_on_both(
+            self.is_net_device_active_in_host,
+            self.is_net_device_active_in_peer)
+        if not host_active:
             self.fail("Net devices are failed to activate in Host \
                       after HTX activate")
-        if not self.is_net_device_active_in_peer():
+        if not peer_active:
             self.fail("Net devices are failed to activate in Peer \
                       after HTX activate")
 
     def start_htx_run(self):
-        self.log.info("Running the HTX for %s on Host", self.mdt_file)
         cmd = "htxcmdline -run -mdt %s" % self.mdt_file
-        process.run(cmd, shell=True, sudo=True)
 
-        self.log.info("Running the HTX for %s on Peer", self.mdt_file)
-        self.run_command(cmd)
+        def host():
+            self.log.info("Running the HTX for %s on Host", self.mdt_file)
+            process.run(cmd, shell=True, sudo=True)
 
-    def monitor_htx_run(self):
-        for time_loop in range(0, self.time_limit, 60):
-            self.log.info("Monitoring HTX Error logs in Host")
-            cmd = 'htxcmdline -geterrlog'
-            process.run(cmd, ignore_status=True,
-                        shell=True, sudo=True)
-            if os.stat('/tmp/htxerr').st_size != 0:
-                self.fail("Their are errors while htx run in host")
-            self.log.info("Monitoring HTX Error logs in Peer")
+        def peer():
+            self.log.info("Running the HTX for %s on Peer", self.mdt_file)
             self.run_command(cmd)
-            try:
-                self.run_command('test -s /tmp/htxerr')
-                rc = True
-            except CommandFailed as cf:
-                rc = False
-            if rc:
-                output = self.run_command("cat /tmp/htxerr")
-                self.log.debug("HTX error log in peer: %s\n",
-                               "\n".join(output))
-                self.fail("Their are errors while htx run in peer")
-            self.log.info("Status of N/W devices after every 60 sec")
-            process.system(self.query_cmd, ignore_status=True,
-                           shell=True, sudo=True)
-            try:
-                output = self.run_command(self.query_cmd)
-            except CommandFailed as cf:
-                output = cf.output
-                pass
-            self.log.info("query o/p in peer lpar\n %s", "\n".join(output))
-            time.sleep(60)
+
+        self.run_on_both(host, peer)
+
+    def monitor_htx_run(self):
+        """
+        Watches the HTX run until time_limit, checking the error logs of
+        host and peer every errlog_interval seconds and recording the state
+        of the N/W devices every monitor_interval seconds. The intervals are
+        scheduled against a fixed start time, so the time spent polling
+        does not push the end of the run.
+        """
+        start = time.time()
+        deadline = start + self.time_limit
+        next_errlog = next_status = start
+        self.errlog_offsets = {'host': 0, 'peer': 0}
+        self.status_series = []
+        status_file = os.path.join(self.outputdir, 'htx_status.json')
+        while True:
+            now = time.time()
+            final = now >= deadline
+            if final or now >= next_errlog:
+                host_err, peer_err = self.run_on_both(
+                    self.read_host_errlog, self.read_peer_errlog,
+                    parallel=True)
+                if host_err:
+                    self.log.debug("HTX error log in host: %s\n", host_err)
+                    self.fail("Their are errors while htx run in host")
+                if peer_err:
+                    self.log.debug("HTX error log in peer: %s\n", peer_err)
+                    self.fail("Their are errors while htx run in peer")
+                while next_errlog <= now:
+                    next_errlog += self.errlog_interval
+            if now >= next_status:
+                host_out, peer_out = self.run_on_both(
+                    self.query_host_devices, self.query_peer_devices,
+                    parallel=True)
+                self.log.info("query o/p in peer lpar\n %s",
+                              "\n".join(peer_out))
+                self.status_series.append(
+                    {'time': round(now - start, 1),
+                     'host': self.device_status(host_out, self.host_intfs),
+                     'peer': self.device_status(peer_out, self.peer_intfs)})
+                with open(status_file, 'w') as series:
+                    json.dump(self.status_series, series, indent=2)
+                while next_status <= now:
+                    next_status += self.monitor_interval
+            if final:
+                break
+            wake = min(next_errlog, next_status, deadline)
+            time.sleep(max(0, wake - time.time()))
+
+    def read_host_errlog(self):
+        """
+        Returns what was appended to the host HTX error log since the
+        previous call
+        """
+        process.run('htxcmdline -geterrlog', ignore_status=True,
+                    shell=True, sudo=True)
+        if not os.path.exists('/tmp/htxerr'):
+            return ''
+        with open('/tmp/htxerr', 'rb') as errlog:
+            errlog.seek(0, os.SEEK_END)
+            if errlog.tell() < self.errlog_offsets['host']:
+                # log was truncated, read it again from the start
+                self.errlog_offsets['host'] = 0
+            errlog.seek(self.errlog_offsets['host'])
+            data = errlog.read()
+        self.errlog_offsets['host'] += len(data)
+        return data.decode('utf-8', errors='replace')
+
+    def read_peer_errlog(self):
+        """
+        Returns what was appended to the peer HTX error log since the
+        previous call, in a single command on the peer
+        """
+        offset = self.errlog_offsets['peer']
+        cmd = ("htxcmdline -geterrlog > /dev/null; "
+               "size=$(stat -c %%s /tmp/htxerr 2> /dev/null || echo 0); "
+               "[ $size -lt %d ] && start=1 || start=%d; "
+               "echo %s$size; tail -c +$start /tmp/htxerr 2> /dev/null"
+               % (offset, offset + 1, ERRLOG_SIZE_MARKER))
+        try:
+            output = self.run_command(cmd)
+        except CommandFailed as cf:
+            output = cf.output
+        # the size line is found by its marker, as login banners or
+        # htxcmdline messages may come first
+        for index, line in enumerate(output):
+            match = re.match(r'^%s(\d+)\s*$' % ERRLOG_SIZE_MARKER,
+                             line.strip())
+            if match:
+                self.errlog_offsets['peer'] = int(match.group(1))
+                return "\n".join(output[index + 1:]).strip()
+        self.error("Could not read the peer HTX error log: %s" %
+                   "\n".join(output))
+
+    def query_host_devices(self):
+        return process.system_output(self.query_cmd, ignore_status=True,
+                                     shell=True,
+                                     sudo=True).decode("utf-8").splitlines()
+
+    def query_peer_devices(self):
+        try:
+            return self.run_command(self.query_cmd)
+        except CommandFailed as cf:
+            return cf.output
+
+    @staticmethod
+    def device_status(output, interfaces):
+        """
+        Maps each interface to the line describing it in the output of
+        htxcmdline -query, or None when HTX does not list it
+        """
+        status = {}
+        for intf in interfaces:
+            status[intf] = None
+            for line in output:
+                if intf in line.split():
+                    status[intf] = " ".join(line.split())
+                    break
+        return status
 
     def shutdown_active_mdt(self):
-        self.log.info("Shutdown active mdt in host")
         cmd = "htxcmdline -shutdown"
-        process.run(cmd, timeout=120, ignore_status=True, shell=True, sudo=True)
-        self.log.info("Shutdown active mdt in peer")
-        try:
-            self.run_command(cmd)
-        except CommandFailed:
-            pass
+
+        def host():
+            self.log.info("Shutdown active mdt in host")
+            process.run(cmd, timeout=120, ignore_status=True, shell=True,
+                        sudo=True)
+
+        def peer():
+            self.log.info("Shutdown active mdt in peer")
+            try:
+                self.run_command(cmd)
+            except CommandFailed:
+                pass
+
+        self.run_on_both(host, peer)
 
     def suspend_all_net_devices(self):
-        self.suspend_all_net_devices_in_host()
-        self.suspend_all_net_devices_in_peer()
+        self.run_on_both(self.suspend_all_net_devices_in_host,
+                         self.suspend_all_net_devices_in_peer)
 
     def suspend_all_net_devices_in_host(self):
         '''
         Suspend the Net devices, if active.
         '''
         self.log.info("Suspending net_devices in host if any running")
-        self.susp_cmd = "htxcmdline -suspend all  -mdt %s" % self.mdt_file
         process.run(self.susp_cmd, ignore_status=True, shell=True, sudo=True)
 
     def suspend_all_net_devices_in_peer(self):
@@ -697,21 +892,28 @@ class HtxNicTest(Test):
     def shutdown_htx_daemon(self):
         status_cmd = '/etc/init.d/htx.d status'
         shutdown_cmd = '/usr/lpp/htx/etc/scripts/htxd_shutdown'
-        daemon_state = process.system_output(status_cmd, ignore_status=True,
-                                             shell=True,
-                                             sudo=True).decode("utf-8")
-        if daemon_state.split(" ")[-1] == 'running':
-            process.system(shutdown_cmd, ignore_status=True,
-                           shell=True, sudo=True)
-        try:
-            output = self.run_command(status_cmd)
-        except CommandFailed as cf:
-            output = cf.output
-        if 'running' in output[0]:
+
+        def host():
+            daemon_state = process.system_output(status_cmd,
+                                                 ignore_status=True,
+                                                 shell=True,
+                                                 sudo=True).decode("utf-8")
+            if daemon_state.split(" ")[-1] == 'running':
+                process.system(shutdown_cmd, ignore_status=True,
+                               shell=True, sudo=True)
+
+        def peer():
             try:
-                self.run_command(shutdown_cmd)
-            except CommandFailed:
-                pass
+                output = self.run_command(status_cmd)
+            except CommandFailed as cf:
+                output = cf.output
+            if 'running' in output[0]:
+                try:
+                    self.run_command(shutdown_cmd)
+                except CommandFailed:
+                    pass
+
+        self.run_on_both(host, peer)
 
     def clean_state(self):
         '''
@@ -786,6 +988,6 @@ class HtxNicTest(Test):
     def htx_cleanup(self):
         self.clean_state()
         self.shutdown_htx_daemon()
-        self.ip_restore_host()
-        self.ip_restore_peer()
-        self.remotehost.remote_session.quit()
+        self.run_on_both(self.ip_restore_host, self.ip_restore_peer)
+        if not self.peer_persist:
+            self.remotehost.remote_session.quit()
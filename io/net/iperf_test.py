@@ -21,6 +21,7 @@ bandwidth on IP networks.
 
 import os
 import netifaces
+import sys
 from avocado import Test
 from avocado.utils.software_manager import SoftwareManager
 from avocado.utils import build
@@ -29,10 +30,14 @@ from avocado.utils import process
 from avocado.utils.genio import read_file
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
-from avocado.utils.ssh import Session
 from avocado.utils.process import SubProcess
 from avocado.utils import distro
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.buildcache import BuildCache  # noqa: E402
+from testlib.peer import peer_session  # noqa: E402
+
 
 class Iperf(Test):
     """
@@ -62,19 +67,25 @@ class Iperf(Test):
         except Exception:
             self.networkinterface.save(self.ipaddr, self.netmask)
         self.networkinterface.bring_up()
-        self.session = Session(self.peer_ip, user=self.peer_user,
-                               password=self.peer_password)
-        if not self.session.connect():
+        self.peer_persist = int(self.params.get("peer_persist", default=600))
+        self.session = peer_session(self.peer_ip, self.peer_user,
+                                    self.peer_password, self.peer_persist)
+        if not self.session:
             self.cancel("failed connecting to peer")
+        if self.peer_public_ip:
+            peer_session(self.peer_public_ip, self.peer_user,
+                         self.peer_password, self.peer_persist)
         smm = SoftwareManager()
-        for pkg in ["gcc", "autoconf", "perl", "m4", "libtool"]:
+        pkgs = ["gcc", "autoconf", "perl", "m4", "libtool"]
+        cmd = "%s install %s" % (smm.backend.base_command, " ".join(pkgs))
+        peer_install = SubProcess(self.session.get_raw_ssh_command(cmd))
+        peer_install.start()
+        for pkg in pkgs:
             if not smm.check_installed(pkg) and not smm.install(pkg):
                 self.cancel("%s package is need to test" % pkg)
-            cmd = "%s install %s" % (smm.backend.base_command, pkg)
-            output = self.session.cmd(cmd)
-            if not output.exit_status == 0:
-                self.cancel("unable to install the package %s on peer machine "
-                            % pkg)
+        if peer_install.wait() != 0:
+            self.cancel("unable to install the packages %s on peer machine"
+                        % " ".join(pkgs))
 
         detected_distro = distro.detect()
         pkg = "nmap"
@@ -134,9 +145,15 @@ class Iperf(Test):
             cmd = self.session.get_raw_ssh_command(cmd)
             self.obj = SubProcess(cmd)
             self.obj.start()
-        os.chdir(self.iperf_dir)
-        process.system('./configure', shell=True)
-        build.make(self.iperf_dir)
+        cache = BuildCache.from_params(self.params, 'iperf', tarball)
+        if cache and cache.restore(self.iperf_dir):
+            self.log.info("Using cached iperf build %s", cache.path)
+        else:
+            os.chdir(self.iperf_dir)
+            process.system('./configure', shell=True)
+            build.make(self.iperf_dir)
+            if cache:
+                cache.store(self.iperf_dir)
         self.iperf = os.path.join(self.iperf_dir, 'src')
         self.expected_tp = self.params.get("EXPECTED_THROUGHPUT", default="85")
 
@@ -206,6 +223,7 @@ class Iperf(Test):
             self.networkinterface.restore_from_backup()
         except Exception:
             self.log.info("backup file not availbale, could not restore file.")
-        self.remotehost.remote_session.quit()
-        self.remotehost_public.remote_session.quit()
-        self.session.quit()
+        if not self.peer_persist:
+            self.remotehost.remote_session.quit()
+            self.remotehost_public.remote_session.quit()
+            self.session.quit()
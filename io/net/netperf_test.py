@@ -24,6 +24,7 @@ unidirectional throughput, and end-to-end latency.
 
 import os
 import netifaces
+import sys
 from avocado import Test
 from avocado.utils.software_manager import SoftwareManager
 from avocado.utils import distro
@@ -33,7 +34,11 @@ from avocado.utils import process
 from avocado.utils.genio import read_file
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
-from avocado.utils.ssh import Session
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.buildcache import BuildCache  # noqa: E402
+from testlib.peer import peer_session  # noqa: E402
 
 
 class Netperf(Test):
@@ -64,10 +69,14 @@ class Netperf(Test):
         except Exception:
             self.networkinterface.save(self.ipaddr, self.netmask)
         self.networkinterface.bring_up()
-        self.session = Session(self.peer_ip, user=self.peer_user,
-                               password=self.peer_password)
-        if not self.session.connect():
+        self.peer_persist = int(self.params.get("peer_persist", default=600))
+        self.session = peer_session(self.peer_ip, self.peer_user,
+                                    self.peer_password, self.peer_persist)
+        if not self.session:
             self.cancel("failed connecting to peer")
+        if self.peer_public_ip:
+            peer_session(self.peer_public_ip, self.peer_user,
+                         self.peer_password, self.peer_persist)
         smm = SoftwareManager()
         detected_distro = distro.detect()
         pkgs = ['gcc']
@@ -77,14 +86,15 @@ class Netperf(Test):
             pkgs.append('openssh')
         else:
             pkgs.append('openssh-clients')
+        cmd = "%s install %s" % (smm.backend.base_command, " ".join(pkgs))
+        peer_install = process.SubProcess(self.session.get_raw_ssh_command(cmd))
+        peer_install.start()
         for pkg in pkgs:
             if not smm.check_installed(pkg) and not smm.install(pkg):
                 self.cancel("%s package is need to test" % pkg)
-            cmd = "%s install %s" % (smm.backend.base_command, pkg)
-            output = self.session.cmd(cmd)
-            if not output.exit_status == 0:
-                self.cancel("unable to install the package %s on peer machine "
-                            % pkg)
+        if peer_install.wait() != 0:
+            self.cancel("unable to install the packages %s on peer machine"
+                        % " ".join(pkgs))
         if self.peer_ip == "":
             self.cancel("%s peer machine is not available" % self.peer_ip)
         self.timeout = self.params.get("TIMEOUT", default="600")
@@ -121,9 +131,16 @@ class Netperf(Test):
         output = self.session.cmd(cmd)
         if not output.exit_status == 0:
             self.fail("test failed because command failed in peer machine")
-        os.chdir(self.neperf)
-        process.system('./configure --build=powerpc64le', shell=True)
-        build.make(self.neperf)
+        cache = BuildCache.from_params(self.params, 'netperf', tarball,
+                                       '--build=powerpc64le')
+        if cache and cache.restore(self.neperf):
+            self.log.info("Using cached netperf build %s", cache.path)
+        else:
+            os.chdir(self.neperf)
+            process.system('./configure --build=powerpc64le', shell=True)
+            build.make(self.neperf)
+            if cache:
+                cache.store(self.neperf)
         self.perf = os.path.join(self.neperf, 'src', 'netperf')
         self.expected_tp = self.params.get("EXPECTED_THROUGHPUT", default="90")
         self.duration = self.params.get("duration", default="300")
@@ -197,6 +214,7 @@ class Netperf(Test):
             self.networkinterface.restore_from_backup()
         except Exception:
             self.log.info("backup file not availbale, could not restore file.")
-        self.remotehost.remote_session.quit()
-        self.remotehost_public.remote_session.quit()
-        self.session.quit()
+        if not self.peer_persist:
+            self.remotehost.remote_session.quit()
+            self.remotehost_public.remote_session.quit()
+            self.session.quit()
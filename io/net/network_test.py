@@ -24,16 +24,20 @@ test lro and gro and interface
 import os
 import hashlib
 import netifaces
+import sys
 from avocado import Test
 from avocado.utils.software_manager import SoftwareManager
 from avocado.utils import process
 from avocado.utils import distro
 from avocado.utils import genio
-from avocado.utils.ssh import Session
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 from avocado.utils import wait
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.peer import peer_session  # noqa: E402
+
 
 class NetworkTest(Test):
     '''
@@ -88,11 +92,15 @@ class NetworkTest(Test):
         self.peer_user = self.params.get("peer_user", default="root")
         self.peer_password = self.params.get("peer_password", '*',
                                              default=None)
+        self.peer_persist = int(self.params.get("peer_persist", default=600))
         if 'scp' or 'ssh' in str(self.name.name):
-            self.session = Session(self.peer, user=self.peer_user,
-                                   password=self.peer_password)
-            if not self.session.connect():
+            self.session = peer_session(self.peer, self.peer_user,
+                                        self.peer_password, self.peer_persist)
+            if not self.session:
                 self.cancel("failed connecting to peer")
+        if self.peer_public_ip:
+            peer_session(self.peer_public_ip, self.peer_user,
+                         self.peer_password, self.peer_persist)
         self.remotehost = RemoteHost(self.peer, self.peer_user,
                                      password=self.peer_password)
         self.peer_interface = self.remotehost.get_interface_by_ipaddr(self.peer).name
@@ -319,7 +327,8 @@ class NetworkTest(Test):
                 self.networkinterface.restore_from_backup()
             except Exception:
                 self.log.info("backup file not availbale, could not restore file.")
-        self.remotehost.remote_session.quit()
-        self.remotehost_public.remote_session.quit()
-        if 'scp' or 'ssh' in str(self.name.name):
-            self.session.quit()
+        if not self.peer_persist:
+            self.remotehost.remote_session.quit()
+            self.remotehost_public.remote_session.quit()
+            if 'scp' or 'ssh' in str(self.name.name):
+                self.session.quit()
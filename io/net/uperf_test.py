@@ -22,18 +22,23 @@ workload profiles
 
 import os
 import netifaces
+import sys
 from avocado import Test
 from avocado.utils.software_manager import SoftwareManager
 from avocado.utils import distro
 from avocado.utils import build
 from avocado.utils import archive
 from avocado.utils import process
-from avocado.utils.ssh import Session
 from avocado.utils.genio import read_file
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 from avocado.utils.process import SubProcess
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.buildcache import BuildCache  # noqa: E402
+from testlib.peer import peer_session  # noqa: E402
+
 
 class Uperf(Test):
     """
@@ -63,10 +68,14 @@ class Uperf(Test):
         except Exception:
             self.networkinterface.save(self.ipaddr, self.netmask)
         self.networkinterface.bring_up()
-        self.session = Session(self.peer_ip, user=self.peer_user,
-                               password=self.peer_password)
-        if not self.session.connect():
+        self.peer_persist = int(self.params.get("peer_persist", default=600))
+        self.session = peer_session(self.peer_ip, self.peer_user,
+                                    self.peer_password, self.peer_persist)
+        if not self.session:
             self.cancel("failed connecting to peer")
+        if self.peer_public_ip:
+            peer_session(self.peer_public_ip, self.peer_user,
+                         self.peer_password, self.peer_persist)
         smm = SoftwareManager()
         detected_distro = distro.detect()
         pkgs = ["gcc", "autoconf", "perl", "m4", "git-core", "automake"]
@@ -74,14 +83,15 @@ class Uperf(Test):
             pkgs.extend(["libsctp1", "libsctp-dev", "lksctp-tools"])
         else:
             pkgs.extend(["lksctp-tools", "lksctp-tools-devel"])
+        cmd = "%s install %s" % (smm.backend.base_command, " ".join(pkgs))
+        peer_install = SubProcess(self.session.get_raw_ssh_command(cmd))
+        peer_install.start()
         for pkg in pkgs:
             if not smm.check_installed(pkg) and not smm.install(pkg):
                 self.cancel("%s package is need to test" % pkg)
-            cmd = "%s install %s" % (smm.backend.base_command, pkg)
-            output = self.session.cmd(cmd)
-            if not output.exit_status == 0:
-                self.cancel("unable to install the package %s on peer machine "
-                            % pkg)
+        if peer_install.wait() != 0:
+            self.cancel("unable to install the packages %s on peer machine"
+                        % " ".join(pkgs))
         if self.peer_ip == "":
             self.cancel("%s peer machine is not available" % self.peer_ip)
         self.mtu = self.params.get("mtu", default=1500)
@@ -120,10 +130,18 @@ class Uperf(Test):
             cmd = self.session.get_raw_ssh_command(cmd)
             self.obj = SubProcess(cmd)
             self.obj.start()
-        os.chdir(self.uperf_dir)
-        process.system('autoreconf -fi', shell=True)
-        process.system('./configure ppc64le', shell=True)
-        build.make(self.uperf_dir)
+        cache = BuildCache.from_params(self.params, 'uperf', tarball,
+                                       'ppc64le')
+        if cache and cache.restore(self.uperf_dir):
+            self.log.info("Using cached uperf build %s", cache.path)
+            os.chdir(self.uperf_dir)
+        else:
+            os.chdir(self.uperf_dir)
+            process.system('autoreconf -fi', shell=True)
+            process.system('./configure ppc64le', shell=True)
+            build.make(self.uperf_dir)
+            if cache:
+                cache.store(self.uperf_dir)
         self.expected_tp = self.params.get("EXPECTED_THROUGHPUT", default="85")
 
     def test(self):
@@ -174,6 +192,7 @@ class Uperf(Test):
             self.networkinterface.restore_from_backup()
         except Exception:
             self.log.info("backup file not availbale, could not restore file.")
-        self.remotehost.remote_session.quit()
-        self.remotehost_public.remote_session.quit()
-        self.session.quit()
+        if not self.peer_persist:
+            self.remotehost.remote_session.quit()
+            self.remotehost_public.remote_session.quit()
+            self.session.quit()
@@ -14,14 +14,19 @@
 # Author: Pridhiviraj Paidipeddi <ppaidipe@linux.vnet.ibm.com>
 # VLAN Testcase
 
+import os
 import time
 import paramiko
+import sys
 
 from avocado import Test
 from avocado.utils import process
-from avocado.utils.ssh import Session
 from avocado.utils.process import CmdError
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.peer import peer_session, reset_session  # noqa: E402
+
 
 class VlanTest(Test):
 
@@ -46,9 +51,9 @@ class VlanTest(Test):
         """
         self.parameters()
         self.switch_login(self.switch_name, self.userid, self.password)
-        self.session = Session(self.peer_ip, user=self.peer_user,
-                               password=self.peer_password)
-        if not self.session.connect():
+        self.session = peer_session(self.peer_ip, self.peer_user,
+                                    self.peer_password, self.peer_persist)
+        if not self.session:
             self.cancel("failed connecting to peer")
         self.get_ips()
 
@@ -68,6 +73,7 @@ class VlanTest(Test):
         self.peer_password = self.params.get("peer_password", '*',
                                              default=None)
         self.cidr_value = self.params.get("cidr_value", '*', default=None)
+        self.peer_persist = int(self.params.get("peer_persist", default=600))
         self.prompt = ">"
 
     def switch_login(self, ip, username, password):
@@ -111,7 +117,8 @@ class VlanTest(Test):
         '''
         SSH Logout method for remote peer server
         '''
-        self.session.quit()
+        if not self.peer_persist:
+            self.session.quit()
         return
 
     def run_host_command(self, cmd):
@@ -273,18 +280,17 @@ class VlanTest(Test):
         Vlan configuration on Peer
         """
         ip = self.ip_dic[self.peer_intf]
-        cmd = "ip addr flush dev %s" % self.peer_intf
-        self.session.cmd(cmd)
-        cmd = "ip link add link %s name %s.%s type vlan id %s" \
-              % (self.peer_intf, self.peer_intf, vlan_num, vlan_num)
-        self.session.cmd(cmd)
-        cmd = "ip addr add %s/%s dev %s.%s" \
-              % (ip, self.cidr_value, self.peer_intf, vlan_num)
-        self.session.cmd(cmd)
-        cmd = "ip link set %s.%s up" % (self.peer_intf, vlan_num)
-        self.session.cmd(cmd)
-        cmd = "ip addr show %s.%s" % (self.peer_intf, vlan_num)
-        self.session.cmd(cmd)
+        cmds = ["ip addr flush dev %s" % self.peer_intf,
+                "ip link add link %s name %s.%s type vlan id %s"
+                % (self.peer_intf, self.peer_intf, vlan_num, vlan_num),
+                "ip addr add %s/%s dev %s.%s"
+                % (ip, self.cidr_value, self.peer_intf, vlan_num),
+                "ip link set %s.%s up" % (self.peer_intf, vlan_num),
+                "ip addr show %s.%s" % (self.peer_intf, vlan_num)]
+        # one round trip to the peer for the whole sequence
+        self.session.cmd("; ".join(cmds))
+        # the master connection may have run over the reconfigured interface
+        reset_session(self.session)
 
     def restore_host_intf(self):
         """
@@ -299,12 +305,11 @@ class VlanTest(Test):
         """
         Restore peer interfaces
         """
-        cmd = "ip link delete %s.%s" % (self.peer_intf, self.vlan_num)
-        self.session.cmd(cmd)
-        cmd = "ifdown %s" % self.peer_intf
-        self.session.cmd(cmd)
-        cmd = "ifup %s" % self.peer_intf
-        self.session.cmd(cmd)
+        cmds = ["ip link delete %s.%s" % (self.peer_intf, self.vlan_num),
+                "ifdown %s" % self.peer_intf,
+                "ifup %s" % self.peer_intf]
+        self.session.cmd("; ".join(cmds))
+        reset_session(self.session)
 
     def tearDown(self):
         """
@@ -21,6 +21,8 @@ a storage networking fabric.
 """
 
 import os
+import re
+import glob
 import json
 import copy
 import time
@@ -41,30 +43,77 @@ class NVMfTest(Test):
         """
         Sets up NVMf configuration
         """
+        # loop or tcp builds the target on this host, empty means the
+        # RDMA target on the peers
+        self.transport = self.params.get('local_transport', default='')
+        if self.transport and 'test_local_fabric' not in str(self.name):
+            self.cancel("Only test_local_fabric runs with local_transport")
+        if not self.transport and 'test_local_fabric' in str(self.name):
+            self.cancel("test_local_fabric needs local_transport")
         self.nss = self.params.get('namespaces', default='')
         self.peer_ips = self.params.get('peer_ips', default='')
-        if not self.nss or not self.peer_ips:
+        if not self.transport and (not self.nss or not self.peer_ips):
             self.cancel("No inputs provided")
         self.peer_user = self.params.get("peer_user", default="root")
         self.peer_password = self.params.get("peer_password", default=None)
         self.nss = self.nss.split(' ')
         self.peer_ips = self.peer_ips.split(' ')
         self.ids = range(1, len(self.peer_ips) + 1)
-        if len(self.nss) != len(self.peer_ips):
+        if not self.transport and len(self.nss) != len(self.peer_ips):
             self.cancel("Count of namespace and peer ips mismatch")
         smm = SoftwareManager()
-        if not smm.check_installed("nvme-cli") and not \
-                smm.install("nvme-cli"):
-            self.cancel('nvme-cli is needed for the test to be run')
-        try:
-            if not linux_modules.module_is_loaded("nvme-rdma"):
-                linux_modules.load_module("nvme-rdma")
-        except CmdError:
-            self.cancel("nvme-rdma module not loadable")
+        packages = ["nvme-cli"]
+        modules = ["nvme-rdma"]
+        if self.transport:
+            packages.extend(["nvmetcli", "fio"])
+            modules = {'loop': ["nvmet", "nvme-loop"],
+                       'tcp': ["nvmet", "nvmet-tcp", "nvme-tcp"]}.get(
+                self.transport)
+            if not modules:
+                self.cancel("Unknown local_transport %s" % self.transport)
+        for package in packages:
+            if not smm.check_installed(package) and not \
+                    smm.install(package):
+                self.cancel('%s is needed for the test to be run' % package)
+        for module in modules:
+            try:
+                if not linux_modules.module_is_loaded(module):
+                    linux_modules.load_module(module)
+            except CmdError:
+                self.cancel("%s module not loadable" % module)
         self.cfg_tmpl = self.get_data("nvmf_template.cfg")
         dirname = os.path.dirname(os.path.abspath(self.cfg_tmpl))
         self.cfg_file = os.path.join(dirname, "nvmf.cfg")
         self.nvmf_discovery_file = "/etc/nvme/discovery.conf"
+        self.backing_file = None
+        self.local_target = False
+        if self.transport:
+            self.setup_local_backend()
+
+    def setup_local_backend(self):
+        """
+        Creates the null_blk device or the file exported by the local
+        target
+        """
+        backend = self.params.get('backend', default='null_blk')
+        size = int(self.params.get('backend_size', default=4))
+        if backend == 'null_blk':
+            if not os.path.exists('/dev/nullb0') and process.system(
+                    'modprobe null_blk nr_devices=1 gb=%s' % size,
+                    ignore_status=True):
+                self.cancel("null_blk module not loadable")
+            self.nss = ['/dev/nullb0']
+        elif backend == 'file':
+            self.backing_file = os.path.join(self.workdir, 'nvmf-backend')
+            if process.system('fallocate -l %sG %s' % (size,
+                                                       self.backing_file),
+                              ignore_status=True):
+                self.cancel("Could not create the backing file")
+            self.nss = [self.backing_file]
+        else:
+            self.cancel("Unknown backend %s" % backend)
+        self.peer_ips = ['127.0.0.1']
+        self.ids = range(1, 2)
 
     def create_cfg_file(self):
         """
@@ -88,6 +137,12 @@ class NVMfTest(Test):
 
             cfg["subsystems"][i]["nqn"] = "mysubsys%s" % str(i + 1)
             cfg["ports"][i]["addr"]["traddr"] = self.peer_ips[i]
+            if self.transport == 'loop':
+                cfg["ports"][i]["addr"] = {"adrfam": "", "traddr": "",
+                                           "treq": "not specified",
+                                           "trsvcid": "", "trtype": "loop"}
+            elif self.transport:
+                cfg["ports"][i]["addr"]["trtype"] = self.transport
             cfg["ports"][i]["subsystems"][0] = "mysubsys%s" % str(i + 1)
             cfg["ports"][i]["portid"] = str(i + 1)
 
@@ -104,6 +159,113 @@ class NVMfTest(Test):
         count = max(len(output.splitlines()) - 2, 0)
         return count
 
+    @staticmethod
+    def fabric_device(nqn):
+        """
+        Returns the block device of the connected subsystem nqn, None if it
+        did not show up yet
+        """
+        for nqn_file in glob.glob('/sys/class/nvme-subsystem/*/subsysnqn'):
+            if genio.read_file(nqn_file).strip() != nqn:
+                continue
+            subsys = os.path.dirname(nqn_file)
+            for path in glob.glob('%s/nvme*n*' % subsys) + \
+                    glob.glob('%s/nvme*/nvme*n*' % subsys):
+                if re.match(r'nvme\d+n\d+$', os.path.basename(path)):
+                    return '/dev/%s' % os.path.basename(path)
+        return None
+
+    def local_connect(self, nqn):
+        """
+        Connects to the local target and returns the time taken until the
+        block device is there, along with the device
+        """
+        cmd = "nvme connect -t %s -n %s" % (self.transport, nqn)
+        if self.transport == 'tcp':
+            cmd += " -a 127.0.0.1 -s 4420"
+        start = time.time()
+        if process.system(cmd, shell=True, ignore_status=True):
+            self.fail("Connect to %s fails" % nqn)
+        device = self.fabric_device(nqn)
+        while not device or not os.path.exists(device):
+            if time.time() - start > 30:
+                self.fail("No block device for %s after connect" % nqn)
+            time.sleep(0.005)
+            device = self.fabric_device(nqn)
+        return time.time() - start, device
+
+    def run_fio(self, device, job):
+        """
+        Runs one fio job, rw:bs, on device and returns its iops and MB/s
+        """
+        rw_mode, block_size = job.split(':')
+        cmd = ("fio --name=nvmf --filename=%s --rw=%s --bs=%s --direct=1 "
+               "--ioengine=libaio --iodepth=%s --numjobs=%s --runtime=%s "
+               "--time_based --group_reporting --output-format=json"
+               % (device, rw_mode, block_size,
+                  self.params.get('fio_iodepth', default=32),
+                  self.params.get('fio_numjobs', default=4),
+                  self.params.get('fio_runtime', default=30)))
+        result = process.run(cmd, shell=True, ignore_status=True)
+        if result.exit_status:
+            self.fail("fio %s failed on %s" % (job, device))
+        stats = json.loads(result.stdout_text[
+            result.stdout_text.index('{'):])['jobs'][0]
+        return {'iops': round(sum(stats[io]['iops']
+                                  for io in ('read', 'write')), 1),
+                'mbps': round(sum(stats[io]['bw']
+                                  for io in ('read', 'write')) / 1024.0, 1)}
+
+    def test_local_fabric(self):
+        """
+        Builds the target on this host over the loop or tcp transport and
+        measures connect/disconnect latency and fio throughput over the
+        fabric against the raw backing device
+        """
+        if process.system("which nvmetcli", ignore_status=True):
+            self.cancel("nvmetcli is not installed")
+        self.create_cfg_file()
+        if process.system("nvmetcli restore %s" % self.cfg_file,
+                          ignore_status=True):
+            self.fail("nvmetcli setup config fails")
+        self.local_target = True
+        nqn = "mysubsys1"
+        latency = {'connect': [], 'disconnect': []}
+        for _ in range(int(self.params.get('connect_iterations',
+                                           default=10))):
+            latency['connect'].append(self.local_connect(nqn)[0])
+            start = time.time()
+            if process.system("nvme disconnect -n %s" % nqn,
+                              ignore_status=True):
+                self.fail("Disconnect to %s fails" % nqn)
+            latency['disconnect'].append(time.time() - start)
+        results = {'transport': self.transport, 'backend': self.nss[0]}
+        for operation, samples in latency.items():
+            samples.sort()
+            results[operation] = {
+                'min_ms': round(samples[0] * 1000, 2),
+                'avg_ms': round(sum(samples) * 1000 / len(samples), 2),
+                'max_ms': round(samples[-1] * 1000, 2)}
+            self.log.info("%s latency: %s", operation, results[operation])
+
+        _, device = self.local_connect(nqn)
+        jobs = self.params.get('fio_jobs',
+                               default='randread:4k randwrite:4k read:128k')
+        results['fio'] = {}
+        for job in jobs.split():
+            fabric = self.run_fio(device, job)
+            raw = self.run_fio(self.nss[0], job)
+            results['fio'][job] = {
+                'fabric': fabric, 'raw': raw,
+                'iops_overhead_pct': round(
+                    100 - 100 * fabric['iops'] / raw['iops'], 2)
+                if raw['iops'] else None}
+            self.log.info("%s: fabric %s raw %s", job, fabric, raw)
+        with open(os.path.join(self.outputdir, 'nvmf_local.json'),
+                  'w') as result_file:
+            json.dump(results, result_file, indent=2)
+        self.whiteboard = json.dumps(results, sort_keys=True)
+
     def test_targetconfig(self):
         """
         Configures the peer NVMf.
@@ -216,3 +378,14 @@ class NVMfTest(Test):
         output = self.session.cmd(msg)
         if output.exit_status:
             self.log.warn("removing config file on peer failed")
+
+    def tearDown(self):
+        """
+        Removes the local target and its backing file
+        """
+        if getattr(self, 'local_target', False):
+            process.system("nvme disconnect -n mysubsys1", ignore_status=True)
+            process.system("nvmetcli clear", ignore_status=True)
+        if getattr(self, 'backing_file', None) and \
+                os.path.exists(self.backing_file):
+            os.remove(self.backing_file)
@@ -19,18 +19,31 @@
 This scripts basic EEH tests on all PCI device
 """
 
+import json
+import os
+import re
+import sys
 import time
 from avocado import Test
 from avocado.utils import process
 from avocado.utils import pci
 from avocado.utils import genio
 from avocado.utils import distro
-from avocado.utils import dmesg
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from testlib.kmsg import KmsgReader  # noqa: E402
+
 EEH_HIT = 0
 EEH_MISS = 1
 
+FROZEN = 'EEH: Frozen'
+RESUME = 'EEH: Notify device driver to resume'
+RECOVERED = 'EEH: Recovery successful'
+REMOVED = 'permanently disabled'
+UNRECOVERED = 'EEH: Unable to recover'
+
 
 class EEHRecoveryFailed(Exception):
 
@@ -47,6 +60,81 @@ class EEHRecoveryFailed(Exception):
         return "%s %s recovery failed: %s" % (self.msg, self.dev, self.log)
 
 
+class KmsgWatcher(KmsgReader):
+
+    """
+    Keeps the /dev/kmsg records since the cursor and waits, with poll(),
+    for records matching a pattern. Records carry their kernel timestamp,
+    so latencies do not include the time taken to receive them.
+    """
+
+    def __init__(self):
+        self.records = []
+        super(KmsgWatcher, self).__init__()
+
+    def mark(self):
+        """
+        Moves the cursor to the end of the log and forgets older records
+        """
+        super(KmsgWatcher, self).mark()
+        self.records = []
+
+    def read(self):
+        self.records.extend(super(KmsgWatcher, self).read())
+
+    def find(self, patterns):
+        for _, stamp, message in self.records:
+            for pattern in patterns:
+                if pattern in message:
+                    return pattern, stamp, message
+        return None
+
+    def wait_for(self, patterns, timeout):
+        """
+        Waits for a record since the cursor containing one of patterns.
+
+        :return: (pattern, kernel timestamp, message) or None on timeout
+        """
+        end = time.monotonic() + timeout
+        while True:
+            self.read()
+            found = self.find(patterns)
+            if found:
+                return found
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.poll(remaining)
+
+    def timestamp(self, message):
+        """
+        Logs message and returns its kernel timestamp, the reference the
+        stamps of the following records are compared with. Falls back to
+        CLOCK_MONOTONIC, which the kernel timestamps closely follow, when
+        the message can not be logged.
+        """
+        try:
+            self.write(message)
+        except (IOError, OSError):
+            return time.monotonic()
+        found = self.wait_for([message], 5)
+        if not found:
+            return time.monotonic()
+        return found[1]
+
+
+def latency_stats(samples):
+    """
+    count, min, mean and max of samples in milliseconds
+    """
+    if not samples:
+        return {'count': 0}
+    return {'count': len(samples),
+            'min_ms': round(min(samples) * 1000, 1),
+            'mean_ms': round(sum(samples) * 1000 / len(samples), 1),
+            'max_ms': round(max(samples) * 1000, 1)}
+
+
 class EEH(Test):
 
     """
@@ -66,6 +154,12 @@ class EEH(Test):
         self.max_freeze = self.params.get('max_freeze', default=1)
         self.pci_device = self.params.get('pci_device', default="")
         self.add_cmd = self.params.get('additional_command', default='')
+        self.hit_timeout = int(self.params.get('hit_timeout', default=30))
+        self.recovery_timeout = int(self.params.get('recovery_timeout',
+                                                    default=60))
+        self.recovery_settle = int(self.params.get('recovery_settle',
+                                                   default=10))
+        self.injections = []
         if not self.pci_device:
             self.cancel("No PCI Device specified")
         self.function = str(self.params.get('function')).split(" ")
@@ -96,6 +190,7 @@ class EEH(Test):
                 self.pci_class_name = 'scsi_host'
             self.pci_interface = pci.get_interfaces_in_pci_address(
                 self.pci_device, self.pci_class_name)[-1]
+        self.kmsg = KmsgWatcher()
         self.log.info("===============Testing EEH Frozen PE==================")
 
     def test_eeh_basic_pe(self):
@@ -153,7 +248,12 @@ class EEH(Test):
         Injects Error, and checks for PE recovery
         returns True, if recovery is success, else Flase
         """
-        dmesg.clear_dmesg()
+        self.kmsg.mark()
+        self.injections.append({'function': func, 'pe': self.pci_device,
+                                'outcome': 'miss'})
+        self.inject_start = time.monotonic()
+        self.inject_time = self.kmsg.timestamp(
+            "EEH test: injecting function %s on %s" % (func, self.pci_device))
         if self.is_baremetal():
             return_code = self.error_inject(func, '', '', self.mem_addr,
                                             self.mask, '', self.addr,
@@ -194,64 +294,98 @@ class EEH(Test):
         """
         Check if the PE is recovered successfully after injecting EEH
         """
-        cmd = "dmesg"
-        tries = 60
-        for _ in range(0, tries):
-            res = process.run(cmd, ignore_status=True, shell=True)
-            if 'EEH: Notify device driver to resume' in res.stdout.decode("utf-8") and \
-               res.exit_status != 0:
-                self.log.info("waiting for PE to recover %s", self.pci_device)
-                time.sleep(1)
-            else:
-                # EEH Recovery is not similar for all adapters. For some
-                # adapters, specifically multipath, we see that the adapter
-                # needs some more time to recover after the message "Notify
-                # device driver to resume" on the dmesg.
-                # There is no reliable way to determine this extra time
-                # required, nor a way to determine the recovery. So, a sleep
-                # time of 10s is introduced.
-                time.sleep(10)
-                break
-        else:
-            raise EEHRecoveryFailed("EEH recovery failed", self.pci_device)
-        tries = 30
-        for _ in range(0, tries):
-            for device in pci.get_pci_addresses():
-                if self.pci_device in device:
-                    return True
-                time.sleep(1)
-            return False
+        injection = self.injections[-1]
+        found = self.kmsg.wait_for([RESUME, REMOVED, UNRECOVERED],
+                                   self.recovery_timeout)
+        if not found or found[0] != RESUME:
+            injection['outcome'] = 'unrecovered'
+            raise EEHRecoveryFailed("EEH recovery failed", self.pci_device,
+                                    found[2] if found else None)
+        injection['resume_ms'] = self.elapsed_ms(found[1])
+        self.log.info("PE %s resumed after %sms", self.pci_device,
+                      injection['resume_ms'])
+        # EEH Recovery is not similar for all adapters. For some adapters,
+        # specifically multipath, the adapter needs some more time to
+        # recover after "Notify device driver to resume". Kernels that
+        # report the end of the recovery let us stop waiting early,
+        # otherwise we give it up to recovery_settle seconds.
+        found = self.kmsg.wait_for([RECOVERED], self.recovery_settle)
+        if found:
+            injection['recovered_ms'] = self.elapsed_ms(found[1])
+        end = time.monotonic() + 30
+        while time.monotonic() < end:
+            if self.pci_device in pci.get_pci_addresses():
+                injection['outcome'] = 'recovered'
+                injection['present_ms'] = round(
+                    (time.monotonic() - self.inject_start) * 1000, 1)
+                return True
+            time.sleep(0.1)
+        return False
 
-    @classmethod
-    def check_eeh_hit(cls):
+    def elapsed_ms(self, stamp):
+        """
+        milliseconds between the last injection and the kernel timestamp
+        of a record
+        """
+        return round((stamp - self.inject_time) * 1000, 1)
+
+    def check_eeh_hit(self):
         """
         Function to check if EEH is successfully hit
         """
-        tries = 30
-        cmd = "dmesg"
-        for _ in range(0, tries):
-            res = process.run(cmd, ignore_status=True, shell=True)
-            if 'EEH: Frozen' in res.stdout.decode("utf-8") and \
-               res.exit_status == 0:
-                return True
-            time.sleep(1)
-        return False
+        found = self.kmsg.wait_for([FROZEN], self.hit_timeout)
+        if not found:
+            return False
+        injection = self.injections[-1]
+        injection['outcome'] = 'hit'
+        injection['detect_ms'] = self.elapsed_ms(found[1])
+        match = re.search(r'PHB#\w+-PE#\w+', found[2])
+        if match:
+            injection['pe'] = match.group(0)
+        self.log.info("%s frozen after %sms", injection['pe'],
+                      injection['detect_ms'])
+        return True
 
-    @classmethod
-    def check_eeh_removed(cls):
+    def check_eeh_removed(self):
         """
         Function to check if PE is recovered successfully
         """
-        tries = 30
-        for _ in range(0, tries):
-            cmd = "dmesg"
-            res = process.run(cmd, ignore_status=True, shell=True)
-            if 'permanently disabled' in res.stdout.decode("utf-8") and \
-               res.exit_status == 0:
-                time.sleep(10)
-                return True
-            time.sleep(1)
-        return False
+        found = self.kmsg.wait_for([REMOVED], self.hit_timeout)
+        if not found:
+            return False
+        injection = self.injections[-1]
+        injection['outcome'] = 'removed'
+        injection['removed_ms'] = self.elapsed_ms(found[1])
+        return True
+
+    def tearDown(self):
+        """
+        Reports detection and recovery latency per PE and per injection
+        """
+        if getattr(self, 'kmsg', None):
+            self.kmsg.close()
+        injections = getattr(self, 'injections', [])
+        if not injections:
+            return
+        summary = {}
+        for injection in injections:
+            stats = summary.setdefault(injection['pe'], {})
+            for key in ('detect_ms', 'resume_ms', 'recovered_ms',
+                        'present_ms', 'removed_ms'):
+                if key in injection:
+                    stats.setdefault(key, []).append(injection[key] / 1000.0)
+            outcomes = stats.setdefault('outcomes', {})
+            outcomes[injection['outcome']] = outcomes.get(
+                injection['outcome'], 0) + 1
+        for stats in summary.values():
+            for key in list(stats):
+                if key != 'outcomes':
+                    stats[key] = latency_stats(stats[key])
+        with open(os.path.join(self.outputdir, "eeh_latency.json"),
+                  'w') as out:
+            json.dump({'injections': injections, 'summary': summary}, out,
+                      indent=2)
+        self.whiteboard = json.dumps(summary)
 
     @staticmethod
     def is_baremetal():
@@ -18,6 +18,8 @@
 # Based on code by "mbligh@google.com (Martin Bligh)"
 # https://github.com/autotest/autotest-client-tests/commits/master/kernbench
 
+import json
+import math
 import os
 import re
 import platform
@@ -38,18 +40,21 @@ class Kernbench(Test):
     shown in the log file.
     """
 
-    def time_build(self, threads=None, timefile=None, make_opts=None):
+    def time_build(self, threads=None, timefile=None, make_opts=None,
+                   configure=True):
         """
-        Time the building of the kernel
+        Time the building of the kernel, configuring the tree first
+        unless configure is False
         """
         os.chdir(self.sourcedir)
         build.make(self.sourcedir, extra_args='clean')
-        if self.config_path is None:
-            build.make(self.sourcedir, extra_args='defconfig')
-        else:
-            build.make(self.sourcedir, extra_args='olddefconfig')
-        if 'rhel' in self.detected_distro.name:
-            self.rhel_config_fix()
+        if configure:
+            if self.config_path is None:
+                build.make(self.sourcedir, extra_args='defconfig')
+            else:
+                build.make(self.sourcedir, extra_args='olddefconfig')
+            if 'rhel' in self.detected_distro.name:
+                self.rhel_config_fix()
         if make_opts:
             build_string = "/usr/bin/time -o %s make %s -j %s vmlinux" % (
                 timefile, make_opts, threads)
@@ -80,6 +85,68 @@ class Kernbench(Test):
             results.append(tuple([self.to_seconds(elt) for elt in result]))
         return results
 
+    @staticmethod
+    def parse_jobs(sweep, cores):
+        """
+        Turns a sweep such as "1 cores/2 cores 2*cores" into sorted,
+        unique -j values
+        """
+        jobs = set()
+        for token in str(sweep).replace(',', ' ').split():
+            match = re.match(r'^(?:(\d+)\*)?(cores|\d+)(?:/(\d+))?$', token)
+            if not match:
+                raise ValueError("Invalid sweep entry %s" % token)
+            value = cores if match.group(2) == 'cores' else int(match.group(2))
+            value *= int(match.group(1) or 1)
+            value //= int(match.group(3) or 1)
+            jobs.add(max(value, 1))
+        return sorted(jobs)
+
+    @staticmethod
+    def mean_stddev(values):
+        """
+        Mean and sample standard deviation of values
+        """
+        mean = sum(values) / len(values)
+        if len(values) < 2:
+            return mean, 0.0
+        var = sum((val - mean) ** 2 for val in values) / (len(values) - 1)
+        return mean, math.sqrt(var)
+
+    def scaling_curve(self, runs):
+        """
+        Mean/stddev of user, system and elapsed time per -j value, with
+        speedup and parallel efficiency relative to the smallest -j
+        """
+        curve = []
+        for jobs in sorted(runs):
+            point = {'jobs': jobs, 'runs': len(runs[jobs])}
+            for idx, key in enumerate(('user', 'system', 'elapsed')):
+                mean, stddev = self.mean_stddev([run[idx]
+                                                 for run in runs[jobs]])
+                point[key] = {'mean': round(mean, 2),
+                              'stddev': round(stddev, 2)}
+            curve.append(point)
+        base = curve[0]
+        for point in curve:
+            speedup = base['elapsed']['mean'] / point['elapsed']['mean']
+            point['speedup'] = round(speedup, 3)
+            point['efficiency'] = round(speedup * base['jobs'] /
+                                        point['jobs'], 3)
+        return curve
+
+    def mount_tmpfs(self):
+        """
+        Mounts a tmpfs in the work directory to build the tree in memory
+        """
+        self.tmpfs_dir = os.path.join(self.workdir, 'tmpfs')
+        os.makedirs(self.tmpfs_dir, exist_ok=True)
+        cmd = "mount -t tmpfs -o size=%s tmpfs %s" % (self.tmpfs_size,
+                                                      self.tmpfs_dir)
+        if process.system(cmd, ignore_status=True, sudo=True):
+            self.cancel("Unable to mount tmpfs on %s" % self.tmpfs_dir)
+        return self.tmpfs_dir
+
     def rhel_config_fix(self):
         '''
         In Rhel Based Distro kernel build is failing as system config file
@@ -121,8 +188,18 @@ class Kernbench(Test):
         self.kernel_version = platform.uname()[2]
         self.iterations = self.params.get('runs', default=1)
         self.threads = self.params.get('cpus', default=None)
-        if self.threads is None:
+        if self.threads in (None, 'null'):
             self.threads = 2 * cpu.online_cpus_count()
+        self.sweep = self.params.get('sweep', default=None)
+        try:
+            self.jobs = self.parse_jobs(self.sweep or self.threads,
+                                        cpu.online_cpus_count())
+        except ValueError as details:
+            self.cancel(str(details))
+        self.warmup = self.params.get('warmup', default=False)
+        self.tmpfs = self.params.get('tmpfs', default=False)
+        self.tmpfs_size = self.params.get('tmpfs_size', default='16G')
+        self.tmpfs_dir = None
         self.location = self.params.get(
             'url', default='https://github.com/torvalds/linux/archive'
             '/master.zip')
@@ -130,34 +207,63 @@ class Kernbench(Test):
         # Uncompress the kernel archive to the work directory
         tarball = self.fetch_asset("kernbench.zip", locations=[self.location],
                                    expire='1d')
-        archive.extract(tarball, self.workdir)
+        self.build_dir = self.mount_tmpfs() if self.tmpfs else self.workdir
+        archive.extract(tarball, self.build_dir)
 
     def test(self):
         """
-        Kernel build Test
+        Kernel build Test, once per -j value of the sweep
         """
         # Setting the kernel
-        self.sourcedir = os.path.join(self.workdir, 'linux-master')
+        self.sourcedir = os.path.join(self.build_dir, 'linux-master')
 
         self.log.info("Starting build the kernel")
         timefile = "%s/time_file" % self.sourcedir
+        configure = True
+        if self.warmup:
+            self.log.info("Warm-up build with %s threads", self.jobs[-1])
+            self.time_build(self.jobs[-1], timefile, "")
+            configure = False
         # Build kernel
-        user_time = 0
-        system_time = 0
-        elapsed_time = 0
-        for run in range(self.iterations):
-            self.log.info("Iteration: %s" % (int(run) + 1))
-            self.time_build(self.threads, timefile, "")
-            # Processing the timefile
-            results = open(timefile).readline().strip()
-            (user, system, elapsed) = self.extract_all_time_results(results)[0]
-            user_time += float(user)
-            system_time += float(system)
-            elapsed_time += float(elapsed)
+        runs = {}
+        for jobs in self.jobs:
+            runs[jobs] = []
+            for run in range(self.iterations):
+                self.log.info("Threads: %s Iteration: %s", jobs,
+                              int(run) + 1)
+                self.time_build(jobs, timefile, "", configure)
+                configure = False
+                # Processing the timefile
+                results = open(timefile).readline().strip()
+                runs[jobs].append(tuple(
+                    float(val) for val in
+                    self.extract_all_time_results(results)[0]))
         # Results
+        curve = self.scaling_curve(runs)
         self.log.info("Performance figures:")
         self.log.info("Iterations        : %s", self.iterations)
-        self.log.info("Number of threads     : %s", self.threads)
-        self.log.info("User      : %s", user_time)
-        self.log.info("System    : %s", system_time)
-        self.log.info("Elapsed   : %s", elapsed_time)
+        for point in curve:
+            self.log.info("Number of threads     : %s", point['jobs'])
+            self.log.info("User      : %s", point['user'])
+            self.log.info("System    : %s", point['system'])
+            self.log.info("Elapsed   : %s", point['elapsed'])
+            self.log.info("Efficiency: %s", point['efficiency'])
+        with open(os.path.join(self.outputdir, "kernbench.json"),
+                  'w') as out:
+            json.dump({'kernel': self.kernel_version,
+                       'cpus': cpu.online_cpus_count(),
+                       'tmpfs': bool(self.tmpfs), 'warmup': bool(self.warmup),
+                       'curve': curve,
+                       'runs': dict((str(jobs), val)
+                                    for jobs, val in runs.items())},
+                      out, indent=2)
+        self.whiteboard = json.dumps(curve)
+
+    def tearDown(self):
+        """
+        Unmounts the tmpfs the tree was built in
+        """
+        if getattr(self, 'tmpfs_dir', None):
+            os.chdir(self.workdir)
+            process.system("umount %s" % self.tmpfs_dir, ignore_status=True,
+                           sudo=True)
@@ -20,14 +20,43 @@
 
 
 import os
+import sys
+import zlib
 import shutil
 import tempfile
+import threading
 from avocado import Test
+from avocado.core import data_dir
 from avocado.utils import process
 from avocado.utils import disk
 from avocado.utils import archive
 from avocado.utils import memory
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.corpus import Corpus  # noqa: E402
+
+
+def tree_checksums(root):
+    '''
+    Returns {relative path: crc32 or link target} for every file under root,
+    reading the files in 1MB pieces
+    '''
+    checksums = {}
+    for path, dirs, files in os.walk(root):
+        for name in dirs + files:
+            full = os.path.join(path, name)
+            rel = os.path.relpath(full, root)
+            if os.path.islink(full):
+                checksums[rel] = 'link:%s' % os.readlink(full)
+            elif name in files:
+                crc = 0
+                with open(full, 'rb') as data:
+                    for piece in iter(lambda: data.read(Corpus.BLOCK), b''):
+                        crc = zlib.crc32(piece, crc)
+                checksums[rel] = crc
+    return checksums
+
 
 class DmaMemtest(Test):
 
@@ -56,34 +85,53 @@ class DmaMemtest(Test):
         self.tmpdir = tempfile.mkdtemp(dir=base_dir)
         self.tmpdir = self.params.get('dir_to_extract', default=self.tmpdir)
         self.base_dir = os.path.join(self.tmpdir, 'linux.orig')
-        tarball_base = self.params.get('tarball_base',
-                                       default='linux-2.6.18.tar.bz2')
-        kernel_repo = self.params.get('kernel_repo',
-                                      default='http://www.kernel.org/pub/'
-                                      'linux/kernel/v2.6')
-        tarball_url = os.path.join(kernel_repo, tarball_base)
-        tarball_md5 = self.params.get('tarball_md5',
-                                      default='296a6d150d260144639c3664d127d1'
-                                      '74')
+        # tarball: copies of a kernel tree, or a Corpus kind: copies of a
+        # seeded corpus file
+        self.source = self.params.get('source', default='tarball')
         parallel = self.params.get('parallel', default=True)
         self.parallel = parallel
-        self.log.info('Downloading linux kernel tarball')
-        self.tarball = self.fetch_asset(tarball_url, asset_hash=tarball_md5,
-                                        algorithm='md5')
-        size_tarball = os.path.getsize(self.tarball) // 1024 // 1024
-
-        # Estimation of the tarball size after uncompression
+        self.sim_cps = 0
         os.chdir(self.tmpdir)
-        # This is the reference copy of the linux tarball
-        # that will be used for subsequent comparisons
-        self.log.info('Unpacking base copy')
-        archive.extract(self.tarball, self.base_dir)
-        est_size = int(process.system_output('du -sb %s' %
-                       self.base_dir).split()[0].decode()) // 1048576
+        if self.source == 'tarball':
+            tarball_base = self.params.get('tarball_base',
+                                           default='linux-2.6.18.tar.bz2')
+            kernel_repo = self.params.get('kernel_repo',
+                                          default='http://www.kernel.org/pub/'
+                                          'linux/kernel/v2.6')
+            tarball_url = os.path.join(kernel_repo, tarball_base)
+            tarball_md5 = self.params.get('tarball_md5',
+                                          default='296a6d150d260144639c3664d'
+                                          '127d174')
+            self.log.info('Downloading linux kernel tarball')
+            self.tarball = self.fetch_asset(tarball_url,
+                                            asset_hash=tarball_md5,
+                                            algorithm='md5')
+            size_source = os.path.getsize(self.tarball) // 1024 // 1024
+
+            # This is the reference copy of the linux tarball, its file
+            # checksums are what the copies are compared with
+            self.log.info('Unpacking base copy')
+            archive.extract(self.tarball, self.base_dir)
+            est_size = int(process.system_output('du -sb %s' %
+                           self.base_dir).split()[0].decode()) // 1048576
+            self.reference = tree_checksums(self.base_dir)
+        else:
+            tarball_base = 'seeded %s corpus' % self.source
+            size_source = est_size = int(self.params.get('corpus_size',
+                                                         default=512))
+            corpus_dir = self.params.get('corpus_dir', default=os.path.join(
+                data_dir.get_tmp_dir(), 'dma_memtest-corpus'))
+            self.corpus = Corpus(corpus_dir, seed=self.params.get(
+                'corpus_seed', default=0))
+            try:
+                self.corpus_file = self.corpus.path(self.source,
+                                                    est_size * 1048576)
+            except ValueError as details:
+                self.cancel(str(details))
 
         self.sim_cps = self.get_sim_cps(est_size)
         self.log.info('Source file: %s', tarball_base)
-        self.log.info('Megabytes per copy: %s', size_tarball)
+        self.log.info('Megabytes per copy: %s', size_source)
         self.log.info('Estimated size after uncompression: %s', est_size)
         self.log.info('Number of copies: %s', self.sim_cps)
         self.log.info('Parallel: %s', parallel)
@@ -114,61 +162,67 @@ class DmaMemtest(Test):
 
         return int(sim_cps)
 
+    def verify_copy(self, copy):
+        """
+        Returns the differences between a copy and its source, empty if
+        the copy is intact
+        """
+        if self.source != 'tarball':
+            bad = self.corpus.verify(os.path.join(copy, 'corpus'),
+                                     self.corpus_file)
+            return ['block %s' % index for index in bad]
+        checksums = tree_checksums(copy)
+        return sorted(name for name in set(checksums) | set(self.reference)
+                      if checksums.get(name) != self.reference.get(name))
+
     def test(self):
         parallel_procs = []
         self.log.info('Unpacking test copies')
         for j in range(self.sim_cps):
             tmp_dir = 'linux.%s' % j
+            if not os.path.exists(tmp_dir):
+                os.makedirs(tmp_dir)
+            if self.source == 'tarball':
+                cmd = 'tar jxf %s -C %s' % (self.tarball, tmp_dir)
+            else:
+                cmd = 'cp %s %s/corpus' % (self.corpus_file, tmp_dir)
+            self.log.info("Unpacking %s to %s", self.source, tmp_dir)
             if self.parallel:
-                if not os.path.exists(tmp_dir):
-                    os.makedirs(tmp_dir)
                 # Start parallel process
-                tar_cmd = 'tar jxf ' + self.tarball + ' -C ' + tmp_dir
-                self.log.info("Unpacking tarball to %s", tmp_dir)
-                obj = process.SubProcess(cmd=tar_cmd, verbose=False,
+                obj = process.SubProcess(cmd=cmd, verbose=False,
                                          shell=True)
                 obj.start()
                 parallel_procs.append(obj)
-            else:
-                self.log.info("Unpacking tarball to %s", tmp_dir)
-                archive.extract(self.tarball, tmp_dir)
+            elif process.system(cmd, shell=True, ignore_status=True):
+                self.log.error('Unpacking to %s failed', tmp_dir)
         # Wait for the subprocess before comparison
         if self.parallel:
             self.log.info("Wait background processes before proceed")
             for proc in parallel_procs:
                 proc.wait()
-        parallel_procs = []
+
         self.log.info('Comparing test copies with base copy')
-        for j in range(self.sim_cps):
-            kernel_ver = os.path.basename(self.tarball).strip('.tar.bz2')
-            tmp_dir = 'linux.%s/%s' % (j, kernel_ver)
-            if self.parallel:
-                diff_cmd = 'diff -U3 -rN linux.orig/' + kernel_ver
-                diff_cmd += ' ' + tmp_dir
-                self.log.info("Comparing linux.orig with %s", tmp_dir)
-                obj = process.SubProcess(cmd=diff_cmd, verbose=False,
-                                         shell=True)
-                obj.start()
-                parallel_procs.append(obj)
-            else:
-                try:
-                    self.log.info('Comparing linux.orig with %s', tmp_dir)
-                    process.system('diff -U3 -rN linux.orig linux.%s' % j)
-                except process.CmdError as error:
-                    self.nfail += 1
-                    self.log.info('Error comparing trees: %s', error)
-
-        for proc in parallel_procs:
-            out_buf = proc.get_stdout().decode()
-            out_buf += proc.get_stderr().decode()
-            proc.wait()
-            if out_buf != "":
-                self.nfail += 1
-                self.log.error('Error when comparing test with base copies in'
-                               'parallel')
+        differences = [None] * self.sim_cps
 
-        # Clean up for the next iteration
-        parallel_procs = []
+        def compare(index):
+            differences[index] = self.verify_copy('linux.%s' % index)
+
+        if self.parallel:
+            threads = [threading.Thread(target=compare, args=(j,))
+                       for j in range(self.sim_cps)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            for j in range(self.sim_cps):
+                compare(j)
+
+        for j, diff in enumerate(differences):
+            if diff is None or diff:
+                self.nfail += 1
+                self.log.error('linux.%s differs from the base copy: %s',
+                               j, (diff or ['not compared'])[:10])
 
         if self.nfail != 0:
             self.fail('DMA memory test failed.')
@@ -179,5 +233,6 @@ class DmaMemtest(Test):
         self.log.info('Cleaning up')
         for j in range(self.sim_cps):
             tmp_dir = 'linux.%s' % j
-            shutil.rmtree(tmp_dir)
-        shutil.rmtree(self.base_dir)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if os.path.exists(self.base_dir):
+            shutil.rmtree(self.base_dir)
@@ -17,12 +17,19 @@
 
 
 import os
+import sys
+import json
 import shutil
 import avocado
 from avocado import Test
 from avocado.utils import process, memory, distro, pmem, disk, partition
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.memsampler import MemSampler  # noqa: E402
+from testlib.pmemcache import CachedPMem  # noqa: E402
+
 
 class MemoHog(Test):
     """
@@ -36,7 +43,7 @@ class MemoHog(Test):
         """
         Setup pmem devices
         """
-        self.plib = pmem.PMem()
+        self.plib = CachedPMem()
         regions = sorted(self.plib.run_ndctl_list(
             '-R'), key=lambda i: i['size'], reverse=True)
         if not regions:
@@ -73,6 +80,8 @@ class MemoHog(Test):
         if not self.memsize:
             self.memsize = int(memory.meminfo.MemFree.b * 0.9)
         self.file_type = self.params.get('file_type', default=None)
+        self.sample_interval = float(self.params.get('sample_interval',
+                                                     default=1))
         deps = ['gcc']
         detected_distro = distro.detect()
         if detected_distro.name in ["Ubuntu", "debian"]:
@@ -124,7 +133,12 @@ class MemoHog(Test):
         args = str(self.memsize)
         if self.file_type:
             args = "%s -f%s" % (args, self.back_file)
-        if process.system('./memhog %s' % args, ignore_status=True):
+        sampler = MemSampler(self.sample_interval)
+        sampler.start()
+        status = process.system('./memhog %s' % args, ignore_status=True)
+        stats = sampler.stop(os.path.join(self.outputdir, 'memstat.json'))
+        self.whiteboard = json.dumps(stats, sort_keys=True)
+        if status:
             self.fail('Memory hog test failed')
 
     def tearDown(self):
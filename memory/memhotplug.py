@@ -14,14 +14,22 @@
 # Author: Abdul Haleem <abdhalee@linux.vnet.ibm.com>
 
 import os
+import sys
 import glob
+import json
 import re
+import time
+import threading
 import platform
 import multiprocessing
 from avocado import Test
 from avocado.utils import process, memory, build, archive
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.memsampler import MemSampler  # noqa: E402
+
 
 MEM_PATH = '/sys/devices/system/memory'
 ERRORLOG = ['WARNING: CPU:', 'Oops',
@@ -39,20 +47,63 @@ def clear_dmesg():
     process.run("dmesg -C ", sudo=True)
 
 
-def online(block):
+def is_online(block):
+    with open('%s/memory%s/state' % (MEM_PATH, block), 'r') as state_file:
+        return state_file.read().strip() == 'online'
+
+
+def set_state(block, state):
+    # The sysfs write returns once the kernel finished the transition, a
+    # single read back is enough to confirm it
     try:
-        memory.hotplug(block)
-        return ""
-    except IOError:
+        with open('%s/memory%s/state' % (MEM_PATH, block), 'w') as state_file:
+            state_file.write(state)
+    except (IOError, OSError):
         return "memory%s : Resource is busy" % block
+    if is_online(block) != (state == 'online'):
+        return "memory%s : unable to %s the block" % (block, state)
+    return ""
+
+
+def online(block):
+    return set_state(block, 'online')
 
 
 def offline(block):
-    try:
-        memory.hotunplug(block)
-        return ""
-    except IOError:
-        return "memory%s : Resource is busy" % block
+    return set_state(block, 'offline')
+
+
+def block_node(block):
+    for node in glob.glob('%s/memory%s/node*' % (MEM_PATH, block)):
+        return int(os.path.basename(node)[4:])
+    return 0
+
+
+def latency_histogram(samples):
+    """
+    Return percentiles and a power of two millisecond histogram of the
+    given latencies in seconds
+    """
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    buckets = {}
+    for sample in samples:
+        bucket = 1
+        while bucket < sample * 1000:
+            bucket *= 2
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    def percentile(pct):
+        return round(samples[min(len(samples) - 1,
+                                 int(len(samples) * pct / 100))] * 1000, 3)
+    return {'count': len(samples),
+            'min_ms': round(samples[0] * 1000, 3),
+            'p50_ms': percentile(50), 'p90_ms': percentile(90),
+            'p99_ms': percentile(99),
+            'max_ms': round(samples[-1] * 1000, 3),
+            'histogram': dict(('<=%sms' % bucket, buckets[bucket])
+                              for bucket in sorted(buckets))}
 
 
 def get_hotpluggable_blocks(path, ratio):
@@ -116,26 +167,81 @@ class MemStress(Test):
         self.vmcount = self.params.get('vmcount', default=4)
         self.iocount = self.params.get('iocount', default=4)
         self.memratio = self.params.get('memratio', default=5)
+        self.parallel = int(self.params.get('parallel', default=1))
+        self.stress_per_block = self.params.get('stress_per_block',
+                                                default=False)
+        self.latency = {'offline': [], 'online': []}
+        self.sample_interval = float(self.params.get('sample_interval',
+                                                     default=1))
         self.blocks_hotpluggable = get_hotpluggable_blocks(
             (os.path.join('%s', 'memory*') % MEM_PATH), self.memratio)
         if os.path.exists("%s/auto_online_blocks" % MEM_PATH):
             if not self.__is_auto_online():
                 self.hotplug_all(self.blocks_hotpluggable)
         clear_dmesg()
+        self.sampler = MemSampler(self.sample_interval)
+        self.sampler.start()
+
+    def timed(self, operation, block):
+        start = time.time()
+        err = set_state(block, operation)
+        if err:
+            self.log.error(err)
+        else:
+            self.latency[operation].append(time.time() - start)
 
-    def hotunplug_all(self, blocks):
+    def run_parallel(self, blocks, action):
+        """
+        Calls action on every block, with up to self.parallel threads per
+        NUMA node working through the blocks of their node
+        """
+        queues = {}
         for block in blocks:
-            if memory._check_memory_state(block):
-                err = offline(block)
-                if err:
-                    self.log.error(err)
+            queues.setdefault(block_node(block), []).append(block)
+        errors = []
+
+        def worker(queue):
+            while True:
+                try:
+                    block = queue.pop(0)
+                except IndexError:
+                    return
+                try:
+                    action(block)
+                except Exception as details:
+                    errors.append(details)
+
+        threads = [threading.Thread(target=worker, args=(queue,))
+                   for queue in queues.values()
+                   for _ in range(min(self.parallel, len(queue)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def offline_block(self, block):
+        if is_online(block):
+            self.timed('offline', block)
+
+    def online_block(self, block):
+        if not is_online(block):
+            self.timed('online', block)
+
+    def toggle_block(self, block):
+        self.timed('offline', block)
+        self.log.info("memory%s block hotunplugged", block)
+        if self.stress_per_block:
+            self.run_stress()
+        self.timed('online', block)
+        self.log.info("memory%s block hotplugged", block)
+
+    def hotunplug_all(self, blocks):
+        self.run_parallel(blocks, self.offline_block)
 
     def hotplug_all(self, blocks):
-        for block in blocks:
-            if not memory._check_memory_state(block):
-                err = online(block)
-                if err:
-                    self.log.error(err)
+        self.run_parallel(blocks, self.online_block)
 
     @staticmethod
     def __is_auto_online():
@@ -174,16 +280,14 @@ class MemStress(Test):
     def test_hotplug_toggle(self):
         self.log.info("\nTEST: Memory toggle\n")
         for _ in range(self.iteration):
-            for block in self.blocks_hotpluggable:
-                err = offline(block)
-                if err:
-                    self.log.error(err)
-                self.log.info("memory%s block hotunplugged", block)
-                self.run_stress()
-                err = online(block)
-                if err:
-                    self.log.error(err)
-                self.log.info("memory%s block hotplugged", block)
+            stress = None
+            if not self.stress_per_block:
+                # One stress run covering the whole iteration
+                stress = threading.Thread(target=self.run_stress)
+                stress.start()
+            self.run_parallel(self.blocks_hotpluggable, self.toggle_block)
+            if stress:
+                stress.join()
         self.__error_check()
 
     def test_dlpar_mem_hotplug(self):
@@ -213,14 +317,27 @@ class MemStress(Test):
             self.log.info("Hotplug all memory in Numa Node %s", node)
             mem_blocks = get_hotpluggable_blocks((
                 '/sys/devices/system/node/node%s/memory*' % node), self.memratio)
-            for block in mem_blocks:
-                self.log.info(
-                    "offline memory%s in numa node%s", block, node)
-                err = offline(block)
-                if err:
-                    self.log.error(err)
+            self.log.info("offline %s memory blocks in numa node%s",
+                          len(mem_blocks), node)
+            self.run_parallel(mem_blocks, lambda block: self.timed('offline',
+                                                                   block))
             self.run_stress()
         self.__error_check()
 
     def tearDown(self):
         self.hotplug_all(self.blocks_hotpluggable)
+        latency = {}
+        for operation, samples in self.latency.items():
+            latency[operation] = latency_histogram(samples)
+            self.log.info("memory block %s latency: %s", operation,
+                          latency[operation])
+        with open(os.path.join(self.outputdir, 'hotplug_latency.json'),
+                  'w') as latency_file:
+            json.dump(latency, latency_file, indent=2)
+        if getattr(self, 'sampler', None):
+            stats = self.sampler.stop(os.path.join(self.outputdir,
+                                                   'memstat.json'))
+            stats['hotplug_latency'] = latency
+            # dmesg collected on failure takes precedence
+            if not self.whiteboard:
+                self.whiteboard = json.dumps(stats, sort_keys=True)
@@ -20,6 +20,8 @@ This Suite works with various options of ndctl on a NVDIMM device.
 """
 
 import os
+import sys
+import json
 import re
 import shutil
 import math
@@ -36,6 +38,10 @@ from avocado.utils import partition
 from avocado.utils import pmem
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.pmemcache import CachedPMem  # noqa: E402
+
 
 class NdctlTest(Test):
 
@@ -190,7 +196,7 @@ class NdctlTest(Test):
         self.modes = ['raw', 'sector', 'fsdax', 'devdax']
         self.part = None
         self.disk = None
-        self.plib = pmem.PMem(self.ndctl, self.daxctl)
+        self.plib = CachedPMem(self.ndctl, self.daxctl)
         if not self.plib.check_buses():
             self.cancel("Test needs atleast one region")
 
@@ -365,7 +371,8 @@ class NdctlTest(Test):
 
     def multiple_namespaces_region(self, region):
         """
-        Test multiple namespace with single region
+        Clears the region and returns the plan filling it with multiple
+        namespaces
         """
         namespace_size = self.params.get('size', default=None)
         size_align = self.get_size_alignval()
@@ -388,13 +395,33 @@ class NdctlTest(Test):
 
         if namespace_size <= size_align:
             self.log.warn("Ns size equal to pagesize, hence skipping region")
-            return
-
-        self.log.info("Creating %s namespaces", slot_count)
-        for count in range(0, slot_count):
-            self.plib.create_namespace(
-                region=region, mode=self.mode_to_use, size=namespace_size)
-            self.log.info("Namespace %s created", count + 1)
+            return []
+
+        self.log.info("Planning %s namespaces on %s", slot_count, region)
+        return [('create', {'region': region, 'mode': self.mode_to_use,
+                            'size': namespace_size})
+                for _ in range(slot_count)]
+
+    def apply_namespace_plan(self, plan):
+        """
+        Runs the namespace plan, regions in parallel, and reports the time
+        taken by each operation
+        """
+        timings = self.plib.run_namespace_plan(plan)
+        stats = {}
+        for step in timings:
+            key = '%s %s' % (step['operation'], step.get('region', 'all'))
+            stats.setdefault(key, []).append(step['seconds'])
+        for key, values in stats.items():
+            stats[key] = {'count': len(values), 'min': min(values),
+                          'max': max(values),
+                          'avg': round(sum(values) / len(values), 3)}
+            self.log.info("%s: %s", key, stats[key])
+        with open(os.path.join(self.outputdir, 'namespace_timings.json'),
+                  'w') as timing_file:
+            json.dump(timings, timing_file, indent=2)
+        self.whiteboard = json.dumps(stats, sort_keys=True)
+        return timings
 
     @avocado.fail_on(pmem.PMemException)
     def test_multiple_namespaces_region(self):
@@ -404,7 +431,7 @@ class NdctlTest(Test):
         region = self.get_default_region()
         if (self.plib.is_region_legacy(region)):
             self.cancel("Legacy config skipping the test")
-        self.multiple_namespaces_region(region)
+        self.apply_namespace_plan(self.multiple_namespaces_region(region))
         self.check_namespace_align(region)
 
     @avocado.fail_on(pmem.PMemException)
@@ -418,11 +445,14 @@ class NdctlTest(Test):
         regions = self.plib.run_ndctl_list('-R')
         self.plib.disable_namespace()
         self.plib.destroy_namespace()
-        for val in regions:
-            region = self.plib.run_ndctl_list_val(val, 'dev')
+        plan = []
+        names = [self.plib.run_ndctl_list_val(val, 'dev') for val in regions]
+        for region in names:
             if (self.plib.is_region_legacy(region)):
                 self.cancel("Legacy config skipping the test")
-            self.multiple_namespaces_region(region)
+            plan.extend(self.multiple_namespaces_region(region))
+        self.apply_namespace_plan(plan)
+        for region in names:
             self.check_namespace_align(region)
 
     @avocado.fail_on(pmem.PMemException)
@@ -465,10 +495,9 @@ class NdctlTest(Test):
         namespace_size = (namespace_size // size_align) * size_align
 
         self.log.info("Creating %s namespace", slot_count)
-        for count in range(0, slot_count):
-            self.plib.create_namespace(region=region, mode='fsdax',
-                                       size=namespace_size)
-            self.log.info("Namespace %s created", count)
+        self.apply_namespace_plan(
+            [('create', {'region': region, 'mode': 'fsdax',
+                         'size': namespace_size})] * slot_count)
         self.check_namespace_align(region)
 
     @avocado.fail_on(pmem.PMemException)
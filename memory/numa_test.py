@@ -17,6 +17,8 @@
 
 
 import os
+import sys
+import json
 import shutil
 
 from avocado import Test
@@ -24,6 +26,10 @@ from avocado import skipIf
 from avocado.utils import process, build, memory, distro, genio
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.memsampler import MemSampler  # noqa: E402
+
 SINGLE_NODE = len(memory.numa_nodes_with_memory()) < 2
 
 
@@ -47,6 +53,9 @@ class NumaTest(Test):
             'nr_pages', default=memsize // memory.get_page_size())
         self.map_type = self.params.get('map_type', default='private')
         self.hpage = self.params.get('h_page', default=False)
+        self.sample_interval = float(self.params.get('sample_interval',
+                                                     default=1))
+        self.sampler = None
 
         nodes = memory.numa_nodes_with_memory()
         pkgs = ['gcc', 'make']
@@ -84,6 +93,8 @@ class NumaTest(Test):
             self.copyutil(file_name)
 
         build.make(self.teststmpdir)
+        self.sampler = MemSampler(self.sample_interval)
+        self.sampler.start()
 
     @skipIf(SINGLE_NODE, "Test requires two numa nodes to run")
     def test_movepages(self):
@@ -124,3 +135,9 @@ class NumaTest(Test):
         ret = process.system(cmd, shell=True, sudo=True, ignore_status=True)
         if ret != 0:
             self.fail('Please check the logs for failure')
+
+    def tearDown(self):
+        if getattr(self, 'sampler', None):
+            stats = self.sampler.stop(os.path.join(self.outputdir,
+                                                   'memstat.json'))
+            self.whiteboard = json.dumps(stats, sort_keys=True)
@@ -20,6 +20,7 @@ This Suite works with various options of ndctl on a NVDIMM device.
 """
 
 import os
+import sys
 
 import avocado
 from avocado import Test
@@ -27,6 +28,10 @@ from avocado.utils import process, archive, distro, build
 from avocado.utils import genio, pmem, disk, memory, partition
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.pmemcache import CachedPMem  # noqa: E402
+
 
 class PmemDeviceMapper(Test):
     """
@@ -121,7 +126,7 @@ class PmemDeviceMapper(Test):
             self.ndctl = 'ndctl'
             self.daxctl = 'daxctl'
 
-        self.plib = pmem.PMem(self.ndctl, self.daxctl)
+        self.plib = CachedPMem(self.ndctl, self.daxctl)
         if not self.plib.check_buses():
             self.cancel("Test needs atleast one region")
 
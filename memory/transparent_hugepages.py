@@ -16,13 +16,26 @@
 # Author: Santhosh G <santhog4@linux.vnet.ibm.com>
 
 import os
+import sys
+import json
+import mmap
+import time
+import ctypes
+import threading
 from avocado import Test
 from avocado import skipIf, skipUnless
 from avocado.utils import process
 from avocado.utils import memory
+from avocado.utils import cpu
+from avocado.utils import genio
+from avocado.utils import data_structures
 from avocado.core import data_dir
 from avocado.utils.partition import Partition
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.memsampler import MemSampler  # noqa: E402
+
 
 PAGESIZE = '4096' in str(memory.get_page_size())
 
@@ -30,8 +43,9 @@ PAGESIZE = '4096' in str(memory.get_page_size())
 class Thp(Test):
 
     '''
-    The test enables THP and stress the system using dd load
-    and verifies whether THP has been allocated for usage or not
+    The test enables THP and faults in memory at hugepage granularity from
+    threads pinned to each NUMA node, and verifies whether THP has been
+    allocated for usage or not
 
     :avocado: tags=memory,privileged,hugepage
     '''
@@ -48,30 +62,99 @@ class Thp(Test):
         # Set params as per available memory in system
         self.mem_path = self.params.get(
             "t_dir", default=os.path.join(data_dir.get_tmp_dir(), 'thp_space'))
-        free_mem = self.params.get(
-            "mem_size", default=memory.meminfo.MemFree.m)
-        self.dd_timeout = self.params.get("dd_timeout", default=900)
+        self.free_mem = int(self.params.get(
+            "mem_size", default=memory.meminfo.MemFree.m))
+        self.fault_timeout = self.params.get("dd_timeout", default=900)
+        # anon: private anonymous memory, tmpfs: shared files on a tmpfs
+        self.fault_mode = self.params.get("fault_mode", default="anon")
+        self.threads_per_node = int(self.params.get("threads_per_node",
+                                                    default=1))
+        self.sample_interval = float(self.params.get("sample_interval",
+                                                     default=1))
         self.thp_split = None
         try:
             memory.read_from_vmstat("thp_split_page")
             self.thp_split = "thp_split_page"
         except IndexError:
             self.thp_split = "thp_split"
-
-        # Set block size as hugepage size * 2
-        self.block_size = memory.meminfo.Hugepagesize.m * 2
-        self.count = free_mem // self.block_size
-
-        # Mount device as per free memory size
-        if not os.path.exists(self.mem_path):
-            os.makedirs(self.mem_path)
-        self.device = Partition(device="none", mountpoint=self.mem_path)
-        self.device.mount(mountpoint=self.mem_path, fstype="tmpfs",
-                          args='-o size=%dM' % free_mem, mnt_check=False)
+        self.counters = ["thp_fault_alloc", self.thp_split,
+                         "thp_collapse_alloc"]
+        if self.fault_mode == "tmpfs":
+            self.counters.append("thp_file_alloc")
+
+        self.hugepage_size = memory.meminfo.Hugepagesize.b
+        self.device = None
+        if self.fault_mode == "tmpfs":
+            # Mount device as per free memory size, with huge pages enabled
+            if not os.path.exists(self.mem_path):
+                os.makedirs(self.mem_path)
+            self.device = Partition(device="none", mountpoint=self.mem_path)
+            self.device.mount(mountpoint=self.mem_path, fstype="tmpfs",
+                              args='-o size=%dM,huge=always' % self.free_mem,
+                              mnt_check=False)
+
+    @staticmethod
+    def read_thp_counters(counters):
+        '''
+        Reads the given counters from a single read of /proc/vmstat
+        '''
+        values = {}
+        with open('/proc/vmstat', 'r') as vmstat:
+            for line in vmstat:
+                name, value = line.split()
+                if name in counters:
+                    values[name] = int(value)
+        return values
+
+    @staticmethod
+    def node_cpus():
+        '''
+        Returns the online cpus of every NUMA node with memory
+        '''
+        nodes = {}
+        for node in memory.numa_nodes_with_memory():
+            cpulist = genio.read_file('/sys/devices/system/node/node%s/cpulist'
+                                      % node).strip()
+            cpus = set()
+            if cpulist:
+                cpus = set(data_structures.comma_separated_ranges_to_list(
+                    cpulist)) & set(cpu.online_list())
+            nodes[node] = sorted(cpus)
+        return nodes
+
+    def fault_worker(self, index, cpus, size):
+        '''
+        Maps size bytes and writes to each hugepage aligned block of it,
+        from a thread bound to the given cpus
+        '''
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        length = size + self.hugepage_size
+        if self.fault_mode == "tmpfs":
+            fd = os.open(os.path.join(self.mem_path, str(index)),
+                         os.O_RDWR | os.O_CREAT)
+            os.ftruncate(fd, length)
+            buf = mmap.mmap(fd, length, mmap.MAP_SHARED)
+            os.close(fd)
+        else:
+            buf = mmap.mmap(-1, length,
+                            mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+        if hasattr(mmap, 'MADV_HUGEPAGE'):
+            buf.madvise(mmap.MADV_HUGEPAGE)
+        address = ctypes.addressof(ctypes.c_char.from_buffer(buf))
+        start = time.time()
+        # ctypes calls release the GIL, so the workers fault in parallel
+        offsets = range(-address % self.hugepage_size,
+                        length - self.hugepage_size + 1, self.hugepage_size)
+        for offset in offsets:
+            ctypes.memset(address + offset, 1, 1)
+        self.mappings[index] = buf
+        self.workers[index] = {'cpus': cpus, 'blocks': len(offsets),
+                               'seconds': round(time.time() - start, 3)}
 
     def test(self):
         '''
-        Enables THP , Runs the dd workload and checks whether THP
+        Enables THP, faults in the memory and checks whether THP
         has been allocated.
         '''
 
@@ -81,50 +164,78 @@ class Thp(Test):
         except Exception as details:
             self.fail("Failed  %s" % details)
 
-        # Read thp values before stressing the system
-        thp_alloted_before = int(memory.read_from_vmstat("thp_fault_alloc"))
-        thp_split_before = int(memory.read_from_vmstat(self.thp_split))
-        thp_collapse_alloc_before = int(memory.read_from_vmstat
-                                        ("thp_collapse_alloc"))
-
-        # Start Stresssing the  System
-        self.log.info('Stress testing using dd command')
+        nodes = self.node_cpus() or {0: cpu.online_list()}
+        threads = [cpus for cpus in nodes.values()
+                   for _ in range(self.threads_per_node)]
+        size = self.free_mem * 1024 * 1024 // len(threads)
+        size -= size % self.hugepage_size
+        self.mappings = [None] * len(threads)
+        self.workers = [None] * len(threads)
 
-        for iterator in range(self.count):
-            stress_cmd = 'dd if=/dev/zero of=%s/%d bs=%dM count=1'\
-                         % (self.mem_path, iterator, self.block_size)
-            if(process.system(stress_cmd, timeout=self.dd_timeout,
-                              verbose=False, ignore_status=True, shell=True)):
-                self.fail('dd command failed  %s' % stress_cmd)
+        # Read thp values before stressing the system
+        before = self.read_thp_counters(self.counters)
+
+        self.log.info('Faulting in %s MB from %s threads over %s nodes',
+                      self.free_mem, len(threads), len(nodes))
+        sampler = MemSampler(self.sample_interval)
+        sampler.start()
+        workers = [threading.Thread(target=self.fault_worker,
+                                    args=(index, cpus, size))
+                   for index, cpus in enumerate(threads)]
+        for worker in workers:
+            worker.start()
+        deadline = time.time() + self.fault_timeout
+        for worker in workers:
+            worker.join(max(0, deadline - time.time()))
+        stats = sampler.stop(os.path.join(self.outputdir, 'memstat.json'))
+        self.whiteboard = json.dumps(stats, sort_keys=True)
+        samples = {counter: sampler.columns.get('vmstat.%s' % counter)
+                   for counter in self.counters}
+        samples['time'] = sampler.columns['time']
+        with open(os.path.join(self.outputdir, 'thp_vmstat.json'),
+                  'w') as series:
+            json.dump({'workers': self.workers, 'samples': samples},
+                      series, indent=2)
+        if any(worker.is_alive() for worker in workers):
+            self.fail('Faulting in memory did not finish in %s seconds'
+                      % self.fault_timeout)
+        if None in self.workers:
+            self.fail('Some fault threads failed, please check the logs')
 
         # Read thp values after stressing the system
-        thp_alloted_after = int(memory.read_from_vmstat("thp_fault_alloc"))
-        thp_split_after = int(memory.read_from_vmstat(self.thp_split))
-        thp_collapse_alloc_after = int(memory.read_from_vmstat
-                                       ("thp_collapse_alloc"))
+        after = self.read_thp_counters(self.counters)
+        self.unmap()
 
         # Check whether THP is Used or not
-        if thp_alloted_after <= thp_alloted_before:
+        alloc = "thp_file_alloc" if self.fault_mode == "tmpfs" \
+            else "thp_fault_alloc"
+        if after[alloc] <= before[alloc]:
             e_msg = "Thp usage count has not increased\n"
-            e_msg += "Before Stress:%d\nAfter stress:%d" % (thp_alloted_before,
-                                                            thp_alloted_after)
+            e_msg += "Before Stress:%d\nAfter stress:%d" % (before[alloc],
+                                                            after[alloc])
             self.fail(e_msg)
         else:
-            thp_fault_alloc = thp_alloted_after - thp_alloted_before
-            thp_split = thp_split_after - thp_split_before
-            thp_collapse_alloc = (thp_collapse_alloc_after -
-                                  thp_collapse_alloc_before)
             self.log.info("\nTest statistics, changes during test run:")
-            self.log.info("thp_fault_alloc=%d\nthp_split=%d\n"
-                          "thp_collapse_alloc=%d\n",
-                          thp_fault_alloc, thp_split, thp_collapse_alloc)
+            for counter in self.counters:
+                self.log.info("%s=%d", counter,
+                              after[counter] - before[counter])
+
+    def unmap(self):
+        '''
+        Releases the memory faulted in by the workers
+        '''
+        for index, buf in enumerate(getattr(self, 'mappings', [])):
+            if buf is not None:
+                buf.close()
+                self.mappings[index] = None
 
     def tearDown(self):
         '''
         Removes the files created and unmounts the tmpfs.
         '''
 
-        if self.mem_path:
+        self.unmap()
+        if self.device:
             self.log.info('Cleaning Up!!!')
             self.device.unmount()
             process.system('rm -rf %s' % self.mem_path, ignore_status=True)
@@ -16,6 +16,8 @@
 # Author: Santhosh G <santhog4@linux.vnet.ibm.com>
 
 import os
+import sys
+import json
 import time
 import mmap
 import avocado
@@ -27,6 +29,10 @@ from avocado.utils import disk
 from avocado.core import data_dir
 from avocado.utils.partition import Partition
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.memsampler import MemSampler  # noqa: E402
+
 
 PAGESIZE = '4096' in str(memory.get_page_size())
 
@@ -59,6 +65,9 @@ class ThpDefrag(Test):
         free_space = (disk.freespace(self.mem_path)) // 1024
         # Leaving out some free space in tmpfs
         self.count = (free_space // self.block_size) - 3
+        self.sample_interval = float(self.params.get('sample_interval',
+                                                     default=1))
+        self.sampler = None
 
     @avocado.fail_on
     def test(self):
@@ -68,6 +77,9 @@ class ThpDefrag(Test):
         whether defrag happened.
         '''
 
+        self.sampler = MemSampler(self.sample_interval)
+        self.sampler.start()
+
         # Enables THP
         memory.set_thp_value("enabled", "always")
 
@@ -122,6 +134,11 @@ class ThpDefrag(Test):
         Removes files and unmounts the tmpfs.
         '''
 
+        if self.sampler:
+            stats = self.sampler.stop(os.path.join(self.outputdir,
+                                                   'memstat.json'))
+            self.whiteboard = json.dumps(stats, sort_keys=True)
+
         if self.mem_path:
             self.log.info('Cleaning Up!!!')
             memory.set_num_huge_pages(0)
@@ -15,13 +15,68 @@
 # Author: Kalpana Shetty <kalshett@in.ibm.com>
 
 import os
+import sys
+import glob
+import json
+import time
+import zlib
+import ctypes
+import ctypes.util
+import hashlib
+import resource
 import shutil
+import threading
 from avocado import Test, skipUnless
+from avocado.core import data_dir
 from avocado.utils import build, process, distro, git, archive, memory
+from avocado.utils import genio, cpu, data_structures
 from avocado.utils.software_manager import SoftwareManager
 from avocado.utils.partition import Partition
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.corpus import Corpus  # noqa: E402
+
 IS_POWER_NV = 'PowerNV' in open('/proc/cpuinfo', 'r').read()
+Z_OK = 0
+
+
+class ZlibLibrary(object):
+    '''
+    ctypes binding of the one shot compress2()/uncompress() calls of a
+    zlib compatible library, prefix selects the nx_ variants of libnxz
+    '''
+
+    def __init__(self, path, prefix=''):
+        lib = ctypes.CDLL(path)
+        self.compress2 = getattr(lib, prefix + 'compress2')
+        self.uncompress = getattr(lib, prefix + 'uncompress')
+        self.compress2.argtypes = [ctypes.c_void_p,
+                                   ctypes.POINTER(ctypes.c_ulong),
+                                   ctypes.c_void_p, ctypes.c_ulong,
+                                   ctypes.c_int]
+        self.uncompress.argtypes = self.compress2.argtypes[:4]
+        self.compress2.restype = self.uncompress.restype = ctypes.c_int
+
+    @staticmethod
+    def bound(size):
+        # Same worst case expansion as zlib's compressBound()
+        return size + (size >> 12) + (size >> 14) + (size >> 25) + 13
+
+    def compress(self, data, buf, level):
+        length = ctypes.c_ulong(len(buf))
+        ret = self.compress2(buf, ctypes.byref(length), data, len(data),
+                             level)
+        if ret != Z_OK:
+            raise IOError("compress2 returned %s" % ret)
+        return length.value
+
+    def decompress(self, data, buf):
+        length = ctypes.c_ulong(len(buf))
+        ret = self.uncompress(buf, ctypes.byref(length), data, len(data))
+        if ret != Z_OK:
+            raise IOError("uncompress returned %s" % ret)
+        return length.value
 
 
 class NXGZipTests(Test):
@@ -43,13 +98,33 @@ class NXGZipTests(Test):
 
     def create_ddfile(self):
         '''
-        create dd file for compress/decompress
+        Link the <file_size>gb-file used for compress/decompress to the
+        seeded corpus, generated on first use and optionally served from a
+        memfd
         '''
         file_size = self.params.get('file_size', default='5')
-        dd_cmd = 'dd if=/dev/urandom of=%sgb-file bs=1000000000 count=%s'\
-                 % (file_size, file_size)
-        if process.system(dd_cmd, shell=True, ignore_status=True):
-            self.fail("NX-GZIP: create_ddfile: dd file creation failed")
+        kind = self.params.get('corpus_kind', default='random')
+        size = int(file_size) * 1000000000
+        name = '%sgb-file' % file_size
+        use_memfd = self.params.get('corpus_memfd', default=False)
+        if use_memfd and not hasattr(os, 'memfd_create'):
+            self.log.warn("NX-GZIP: memfd_create needs Python 3.8 or later, "
+                          "using the corpus file instead")
+            use_memfd = False
+        try:
+            if use_memfd:
+                fd = self.corpus.memfd(kind, size, hugetlb=self.params.get(
+                    'corpus_hugetlb', default=False))
+                self.memfds.append(fd)
+                target = '/proc/%d/fd/%d' % (os.getpid(), fd)
+            else:
+                target = self.corpus.path(kind, size)
+            if os.path.lexists(name):
+                os.remove(name)
+            os.symlink(target, name)
+        except (IOError, OSError, ValueError) as details:
+            self.fail("NX-GZIP: create_ddfile: corpus creation failed: %s"
+                      % details)
 
     def build_tests(self, testdir_name):
         '''
@@ -74,12 +149,146 @@ class NXGZipTests(Test):
         if failed_tests:
             self.fail("%s" % failed_tests)
 
+    @staticmethod
+    def placement_cpus(placement, threads):
+        '''
+        Returns the cpus each benchmark thread is bound to: all threads on
+        the first node for local, round robin over the nodes for spread
+        '''
+        nodes = []
+        for node in memory.numa_nodes_with_memory():
+            cpulist = genio.read_file('/sys/devices/system/node/node%s/'
+                                      'cpulist' % node).strip()
+            if cpulist:
+                nodes.append(data_structures.comma_separated_ranges_to_list(
+                    cpulist))
+        nodes = nodes or [cpu.online_list()]
+        if placement == 'local':
+            return [nodes[0]] * threads
+        return [nodes[index % len(nodes)] for index in range(threads)]
+
+    @staticmethod
+    def latency_stats(samples):
+        '''
+        Percentiles of the per request latencies, in microseconds
+        '''
+        samples = sorted(samples)
+
+        def percentile(pct):
+            return round(samples[min(len(samples) - 1,
+                                     len(samples) * pct // 100)] * 1e6, 1)
+        return {'p50_us': percentile(50), 'p90_us': percentile(90),
+                'p99_us': percentile(99), 'max_us': percentile(100)}
+
+    def run_engine(self, engine, chunks, crcs, cpus_list):
+        '''
+        Compresses then decompresses every chunk with len(cpus_list)
+        threads and returns throughput, latency and cpu usage per phase
+        '''
+        compressed = [None] * len(chunks)
+        latencies = {'compress': [], 'decompress': []}
+        errors = []
+        threads = len(cpus_list)
+        size = max(len(chunk) for chunk in chunks)
+
+        def worker(index, phase):
+            try:
+                os.sched_setaffinity(0, cpus_list[index])
+                if phase == 'compress':
+                    buf = ctypes.create_string_buffer(engine.bound(size))
+                else:
+                    buf = ctypes.create_string_buffer(size)
+                for chunk in range(index, len(chunks), threads):
+                    start = time.time()
+                    if phase == 'compress':
+                        length = engine.compress(chunks[chunk], buf,
+                                                 self.bench_level)
+                        compressed[chunk] = ctypes.string_at(buf, length)
+                    else:
+                        length = engine.decompress(compressed[chunk], buf)
+                    latencies[phase].append(time.time() - start)
+                    if phase == 'decompress' and (
+                            length != len(chunks[chunk]) or
+                            zlib.crc32(memoryview(buf)[:length]) !=
+                            crcs[chunk]):
+                        raise IOError("chunk %s does not match after "
+                                      "decompression" % chunk)
+            except (IOError, OSError) as details:
+                errors.append(details)
+
+        total = sum(len(chunk) for chunk in chunks)
+        result = {}
+        for phase in ('compress', 'decompress'):
+            workers = [threading.Thread(target=worker, args=(index, phase))
+                       for index in range(threads)]
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            start = time.time()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            wall = time.time() - start
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            if errors:
+                self.fail("NX-GZIP: benchmark %s failed: %s"
+                          % (phase, errors[0]))
+            cpu_time = (after.ru_utime + after.ru_stime -
+                        usage.ru_utime - usage.ru_stime)
+            result[phase] = dict(self.latency_stats(latencies[phase]),
+                                 gbps=round(total / wall / 1e9, 3),
+                                 cpu_util=round(cpu_time / wall, 2))
+        result['ratio'] = round(sum(len(chunk) for chunk in compressed) /
+                                float(total), 4)
+        return result
+
+    def compare_baseline(self, results, config):
+        '''
+        Compares the speedups and NX throughput against the mean of the
+        recent runs stored in baseline_dir, then stores this run there
+        '''
+        baseline_dir = self.params.get('baseline_dir', default=None)
+        if not baseline_dir:
+            return None
+        baseline_dir = os.path.join(baseline_dir, 'nx_gzip-%s' % hashlib.sha1(
+            config.encode()).hexdigest()[:12])
+        runs = int(self.params.get('baseline_runs', default=5))
+        threshold = float(self.params.get('regression_threshold',
+                                          default=5)) / 100
+        previous = []
+        if os.path.isdir(baseline_dir):
+            for name in sorted(os.listdir(baseline_dir))[-runs:]:
+                with open(os.path.join(baseline_dir, name), 'r') as b_file:
+                    previous.append(json.load(b_file))
+        else:
+            os.makedirs(baseline_dir)
+        with open(os.path.join(baseline_dir, 'nx_bench-%s-%d.json' % (
+                time.strftime('%Y%m%d%H%M%S'), os.getpid())), 'w') as b_file:
+            json.dump(results, b_file)
+        matrix = {}
+        regressions = 0
+        for key, value in results.items():
+            reference = [run[key] for run in previous if run.get(key)]
+            if not reference or not value:
+                continue
+            ratio = value / (sum(reference) / len(reference))
+            if ratio < 1 - threshold:
+                regressions += 1
+            if abs(ratio - 1) > threshold:
+                matrix[key] = round(100 * ratio - 100, 2)
+        return {'matrix': matrix, 'regressions': regressions,
+                'runs': len(previous)}
+
     @skipUnless(IS_POWER_NV,
                 "NX-GZIP tests are supported only on PowerNV platform.")
     def setUp(self):
         """
         Install pre-requisite packages
         """
+        self.memfds = []
+        corpus_dir = self.params.get('corpus_dir', default=os.path.join(
+            data_dir.get_tmp_dir(), 'nx_gzip-corpus'))
+        self.corpus = Corpus(corpus_dir,
+                             seed=self.params.get('corpus_seed', default=0))
         smg = SoftwareManager()
         self.dist = distro.detect()
         if self.dist.name not in ['rhel']:
@@ -98,7 +307,17 @@ class NXGZipTests(Test):
                      destination_dir=self.teststmpdir)
 
         os.chdir(self.teststmpdir)
-        build.make(self.teststmpdir)
+        # Later tests of the job reuse the tree unless the commit or the
+        # compiler changed
+        build_key = '%s %s' % (
+            process.system_output('git rev-parse HEAD',
+                                  verbose=False).decode(),
+            process.system_output('gcc --version', verbose=False).decode())
+        stamp = os.path.join(self.teststmpdir, '.avocado-build')
+        if not os.path.exists(stamp) or \
+                genio.read_file(stamp) != build_key:
+            build.make(self.teststmpdir)
+            genio.write_file(stamp, build_key)
 
     def test_inflate_deflate(self):
         '''
@@ -303,3 +522,90 @@ class NXGZipTests(Test):
         if process.system(nx2_cmd, shell=True, ignore_status=True):
             self.fail("NX-GZIP: test_compdecomp_2nx:\
                       comp/decomp on 2nx devices tests failed")
+
+    def test_benchmark(self):
+        '''
+        Running NX-GZIP: Compress/decompress throughput, latency and cpu
+        usage of the NX accelerator against software zlib
+        '''
+        self.log.info("NX-GZIP: test_benchmark: NX vs software zlib")
+        libnxz = sorted(glob.glob(os.path.join(self.teststmpdir, 'lib',
+                                               'libnxz.so*')))
+        libz = ctypes.util.find_library('z')
+        if not libnxz or not libz:
+            self.cancel("NX-GZIP: test_benchmark: libnxz.so or libz not found")
+        engines = {'nx': ZlibLibrary(libnxz[0], prefix='nx_'),
+                   'zlib': ZlibLibrary(libz)}
+        size = int(self.params.get('bench_size', default=256)) * 1024 * 1024
+        chunk_size = int(self.params.get('bench_chunk', default=1024)) * 1024
+        self.bench_level = int(self.params.get('bench_level', default=6))
+        thread_counts = [int(count) for count in str(self.params.get(
+            'bench_threads', default='1 4 16')).split()]
+        placements = str(self.params.get('bench_placement',
+                                         default='local spread')).split()
+
+        self.download_tarball()
+        os.chdir(self.workdir)
+        self.create_ddfile()
+        file_size = self.params.get('file_size', default='5')
+        corpora = {'random': os.path.join(self.workdir, '%sgb-file' % file_size),
+                   'linux': os.path.join(self.workdir, 'linux-5.10-rc2.tar'),
+                   'compressible': self.corpus.path('compressible', size),
+                   'text': self.corpus.path('text', size)}
+
+        runs = []
+        summary = {}
+        for corpus, path in sorted(corpora.items()):
+            with open(path, 'rb') as corpus_file:
+                data = corpus_file.read(size)
+            chunks = [data[start:start + chunk_size]
+                      for start in range(0, len(data), chunk_size)]
+            del data
+            crcs = [zlib.crc32(chunk) for chunk in chunks]
+            for threads in thread_counts:
+                for placement in placements:
+                    cpus_list = self.placement_cpus(placement, threads)
+                    result = {}
+                    for name, engine in sorted(engines.items()):
+                        result[name] = self.run_engine(engine, chunks, crcs,
+                                                       cpus_list)
+                        runs.append(dict(result[name], engine=name,
+                                         corpus=corpus, threads=threads,
+                                         placement=placement))
+                    key = '%s-%s-%s' % (corpus, threads, placement)
+                    for phase in ('compress', 'decompress'):
+                        summary['%s-%s-gbps' % (key, phase)] = \
+                            result['nx'][phase]['gbps']
+                        summary['%s-%s-speedup' % (key, phase)] = round(
+                            result['nx'][phase]['gbps'] /
+                            result['zlib'][phase]['gbps'], 2)
+                    self.log.info("%s: nx %s, zlib %s", key, result['nx'],
+                                  result['zlib'])
+
+        with open(os.path.join(self.outputdir, 'nx_bench.json'),
+                  'w') as bench_file:
+            json.dump({'runs': runs, 'summary': summary}, bench_file,
+                      indent=2)
+        self.whiteboard = json.dumps(summary, sort_keys=True)
+        config = '%s %s %s %s %s' % (size, chunk_size, self.bench_level,
+                                     thread_counts, placements)
+        regression = self.compare_baseline(summary, config)
+        if regression:
+            self.log.info("NX-GZIP: changes against %d baseline runs (%%): %s",
+                          regression['runs'], regression['matrix'])
+            with open(os.path.join(self.outputdir, 'regression.json'),
+                      'w') as r_file:
+                json.dump(regression, r_file, indent=2)
+            max_regressions = self.params.get('max_regressions', default=None)
+            if max_regressions is not None and \
+                    regression['regressions'] > int(max_regressions):
+                self.fail("NX-GZIP: test_benchmark: %d results regressed "
+                          "against the baseline runs"
+                          % regression['regressions'])
+
+    def tearDown(self):
+        '''
+        Release the memfd backed corpora
+        '''
+        for fd in getattr(self, 'memfds', []):
+            os.close(fd)
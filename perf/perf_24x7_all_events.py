@@ -25,6 +25,7 @@ class hv_24x7_all_events(Test):
 
     """
     This tests all hv_24x7 events
+    :param batch_size: number of events counted by one perf stat run
     :avocado: tags=perf,24x7,events
     """
     # Initializing fail command list
@@ -104,24 +105,53 @@ class hv_24x7_all_events(Test):
         # Clear the dmesg to capture the delta at the end of the test.
         process.run("dmesg -c", sudo=True)
 
+    def run_event_batch(self, events):
+        """
+        Counts the events in one perf stat run. A failing batch is split in
+        halves until the failing events are run on their own, so that they
+        are reported the same way a single event run would.
+        """
+        cmd = "perf stat -C 9 -v -x ';' %s sleep 1" % \
+              " ".join("-e %s" % event for event in events)
+        result = process.run(cmd, ignore_status=True)
+        if result.exit_status:
+            if len(events) == 1:
+                self.fail_cmd.append(cmd)
+                return
+            half = len(events) // 2
+            self.run_event_batch(events[:half])
+            self.run_event_batch(events[half:])
+            return
+        for line in result.stderr.decode("utf-8").splitlines():
+            fields = line.split(';')
+            if len(fields) > 2 and fields[2] in events:
+                if fields[0].startswith('<'):
+                    self.unsupported.append(fields[2])
+                else:
+                    self.counts[fields[2]] = fields[0]
+
     def test_all_events(self):
-        perf_args = "-C 9 -v -e"
+        batch_size = int(self.params.get('batch_size', default=32))
+        events = []
         for line in self.list_of_hv_24x7_events:
             if line.startswith('HP') or line.startswith('CP'):
                 # Running for domain range from 1-6
                 for domain in range(1, 7):
                     for core in range(0, self.cores + 1):
-                        events = "hv_24x7/%s,domain=%s,core=%s/" % \
-                                 (line, domain, core)
-                        cmd = 'perf stat %s %s sleep 1' % (perf_args, events)
-                        if process.system(cmd, ignore_status=True):
-                            self.fail_cmd.append(cmd)
+                        events.append("hv_24x7/%s,domain=%s,core=%s/" %
+                                      (line, domain, core))
             else:
                 for chip_item in self.chip:
-                    events = "hv_24x7/%s,chip=%s/" % (line, chip_item)
-                    cmd = "perf stat %s %s sleep 1" % (perf_args, events)
-                    if process.system(cmd, ignore_status=True):
-                        self.fail_cmd.append(cmd)
+                    events.append("hv_24x7/%s,chip=%s/" % (line, chip_item))
+
+        self.counts = {}
+        self.unsupported = []
+        for index in range(0, len(events), batch_size):
+            self.run_event_batch(events[index:index + batch_size])
+        self.log.info("Counted %s of %s events", len(self.counts),
+                      len(events))
+        for event in self.unsupported:
+            self.log.info("Event not supported/counted: %s", event)
 
         if len(self.fail_cmd) > 0:
             for cmd in range(len(self.fail_cmd)):
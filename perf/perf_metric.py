@@ -14,11 +14,18 @@
 # Copyright: 2021 IBM
 # Author: Nageswara R Sastry <rnsastry@linux.ibm.com>
 
+import json
+import os
 import platform
+import sys
 from avocado import Test
 from avocado.utils import distro, dmesg, genio, process
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.perfsweep import sweep  # noqa: E402
+
 IS_POWER_NV = 'PowerNV' in genio.read_file('/proc/cpuinfo').rstrip('\t\r\n\0')
 
 
@@ -26,6 +33,8 @@ class perf_metric(Test):
 
     """
     This tests all metric/metric group events
+    :param workers: number of perf stat runs in flight, each pinned to its
+                    own CPUs (PowerNV runs metrics one at a time)
     :avocado: tags=perf,metric,events
     """
     # Initializing fail command list
@@ -81,16 +90,18 @@ class perf_metric(Test):
         dmesg.clear_dmesg()
 
     def _run_cmd(self, option):
-        for line in self.list_of_metric_events:
-            cmd = "perf stat %s %s sleep 1" % (option, line)
-            rc, output = process.getstatusoutput(cmd, ignore_status=True,
-                                                 shell=True, verbose=True,
-                                                 allow_output_check='combined')
+        commands = ["perf stat %s %s sleep 1" % (option, line)
+                    for line in self.list_of_metric_events]
+        # On PowerNV metrics can be backed by IMC, whose modes are
+        # mutually exclusive, so they are not run concurrently there
+        results = sweep(commands, self.params.get('workers', default=8),
+                        lambda cmd: 'imc' if IS_POWER_NV else None)
+        for cmd in commands:
             # When the command failed, checking for expected failure or not.
-            if rc:
+            if results[cmd]['status'] == 'fail':
                 found_imc = False
                 found_hv_24_7 = False
-                for ln in output.splitlines():
+                for ln in results[cmd]['output'].splitlines():
                     if "hv_24x7" in ln:
                         found_hv_24_7 = True
                         break
@@ -105,8 +116,11 @@ class perf_metric(Test):
                    (found_hv_24_7 and IS_POWER_NV):
                     self.log.info("%s failed, due to non supporting"
                                   " environment" % cmd)
+                    results[cmd]['status'] = 'unsupported'
                 else:
                     self.fail_cmd.append(cmd)
+        self.whiteboard = json.dumps(dict(
+            (cmd, result['status']) for cmd, result in results.items()))
         if self.fail_cmd:
             self.fail("perf_metric: commands failed are %s" % self.fail_cmd)
 
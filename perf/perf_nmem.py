@@ -15,11 +15,17 @@
 
 import os
 import re
+import json
 import platform
+import sys
 from avocado import Test
 from avocado.utils import cpu, dmesg, distro, genio, linux_modules, process
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.perfsweep import sweep  # noqa: E402
+
 
 class perfNMEM(Test):
     """
@@ -37,6 +43,9 @@ class perfNMEM(Test):
     9. Check PMU cpumask exists or not
     10. Check cpumask is same for all the PMUs or not
     11. Check cpumask by on and off cpu
+
+    Events and event groups are swept by 'workers' concurrent perf stat
+    runs, each pinned to its own CPUs.
     """
 
     def setUp(self):
@@ -139,32 +148,41 @@ class perfNMEM(Test):
                 self.fail("%s events not found" % pmu)
             self.log.info("%s events count = %s" % (pmu, sys_fs_events))
 
+    def _report_sweep(self, results):
+        # Publish the per event status of a sweep in the whiteboard
+        self.whiteboard = json.dumps(dict(
+            (event, result['status']) for event, result in results.items()))
+
     def test_all_events(self):
-        failed_event_list = []
         # For each pmu available, run events one by one
+        commands = {}
+        pmus = {}
         for pmu in self.pmu_list:
             for event in self.all_events[pmu]:
-                rc, op = process.getstatusoutput('perf stat -e %s sleep 1'
-                                                 % event, shell=True,
-                                                 ignore_status=True,
-                                                 verbose=True,
-                                                 allow_output_check='combined')
-                if rc:
-                    failed_event_list.append(event)
+                commands['perf stat -e %s sleep 1' % event] = event
+                pmus['perf stat -e %s sleep 1' % event] = pmu
+        # Events of one nmem PMU are counted one at a time
+        results = sweep(list(commands),
+                        self.params.get('workers', default=8), pmus.get)
+        self._report_sweep(dict((commands[cmd], result)
+                                for cmd, result in results.items()))
+        failed_event_list = [commands[cmd] for cmd in commands
+                             if results[cmd]['status'] == 'fail']
         if failed_event_list:
             self.fail("Failed events are: %s" % failed_event_list)
 
     def test_all_group_events(self):
-        failed_events = []
         # Run group of events based on PMU
+        commands = {}
         for key in self.all_events.keys():
-            rc, op = process.getstatusoutput("perf stat -e '{%s}' sleep 1" %
-                                             ','.join(self.all_events[key]),
-                                             shell=True, verbose=True,
-                                             ignore_status=True,
-                                             allow_output_check='combined')
-            if rc:
-                failed_events.append(self.all_events[key])
+            commands["perf stat -e '{%s}' sleep 1" %
+                     ','.join(self.all_events[key])] = key
+        results = sweep(list(commands),
+                        self.params.get('workers', default=8), commands.get)
+        self._report_sweep(dict((commands[cmd], result)
+                                for cmd, result in results.items()))
+        failed_events = [self.all_events[commands[cmd]] for cmd in commands
+                         if results[cmd]['status'] == 'fail']
         if failed_events:
             self.fail("Failed with events: %s " % failed_events)
 
@@ -17,18 +17,40 @@
 import os
 import tempfile
 import shutil
+import sys
 from avocado import Test
 from avocado import skipIf
 from avocado.utils import process
 from avocado.utils import distro
 from avocado.utils.software_manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from testlib.stream import stream_run  # noqa: E402
+
 
 class Sosreport(Test):
 
+    def stream_cmd(self, cmd, parse_line=None, verbose=False):
+        """
+        Runs cmd with its output written to a log file in the output
+        directory as it comes, and each line given to parse_line, so that
+        large sosreport outputs are not kept in memory.
+
+        :return: exit status of cmd
+        """
+        if os.geteuid() != 0:
+            cmd = 'sudo -n %s' % cmd
+        self.cmd_count = getattr(self, 'cmd_count', 0) + 1
+        log_path = os.path.join(self.outputdir,
+                                'sosreport-%s.log' % self.cmd_count)
+        self.log.debug("Output of '%s' in %s", cmd, log_path)
+        return stream_run(cmd, log_path, parse_line, shell=True,
+                          log=self.log if verbose else None).exit_status
+
     def run_cmd(self, cmd, verbose=True):
         self.log.info("executing ============== %s =================", cmd)
-        if process.system(cmd, verbose=verbose, ignore_status=True, sudo=True):
+        if self.stream_cmd(cmd, verbose=verbose):
             self.log.info("%s command failed", cmd)
             self.is_fail += 1
         return
@@ -39,10 +61,16 @@ class Sosreport(Test):
                                      sudo=True).decode("utf-8")
 
     def run_cmd_search(self, cmd, search_str):
-        self.output = self.run_cmd_out(cmd)
-        for line in reversed(self.output.splitlines()):
+        found = []
+
+        def parse_line(line):
+            # only the last line mentioning search_str matters
             if search_str in line:
-                return line.strip()
+                found[:] = [line.strip()]
+
+        self.stream_cmd(cmd, parse_line)
+        if found:
+            return found[0]
 
     def setUp(self):
         dist = distro.detect()
@@ -0,0 +1,104 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+Opt-in cache of finished builds of source-built benchmark tools.
+"""
+
+import hashlib
+import os
+import shutil
+
+from avocado.utils import crypto
+from avocado.utils import process
+
+# Headers configure scripts probe for; a new -devel package changes this
+INCLUDE_DIRS = ['/usr/include', '/usr/local/include']
+
+
+def headers_fingerprint(dirs=None):
+    """
+    sha1 over the path, size and mtime of every installed header, so that
+    installing or updating a development package changes the cache key
+    """
+    digest = hashlib.sha1()
+    for top in dirs or INCLUDE_DIRS:
+        for root, subdirs, files in os.walk(top):
+            subdirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                digest.update(('%s %d %d\n' % (path, stat.st_size,
+                                               int(stat.st_mtime))).encode())
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+
+    """
+    A finished build of a tarball, keyed on the tarball, the compiler, the
+    build flags and the installed headers.
+
+    The cache is disabled unless the test's 'build_cache' parameter names
+    a directory. A cached tree is never used in place: restore() copies it
+    to the directory the test would have built in, so tests that chdir
+    into it or run "make install" from it do not touch the shared copy.
+    """
+
+    def __init__(self, root, name, tarball, flags=''):
+        compiler = process.system_output('gcc --version', verbose=False,
+                                         ignore_status=True)
+        compiler = compiler.decode('utf-8', 'replace').splitlines()
+        key = '%s %s %s %s' % (crypto.hash_file(tarball, algorithm='sha1'),
+                               compiler[0] if compiler else '', flags,
+                               headers_fingerprint())
+        self.path = os.path.join(root, '%s-%s' % (
+            name, hashlib.sha1(key.encode()).hexdigest()))
+
+    @classmethod
+    def from_params(cls, params, name, tarball, flags=''):
+        """
+        Returns a BuildCache when the 'build_cache' parameter is set,
+        None otherwise
+        """
+        root = params.get('build_cache', default=None)
+        if not root:
+            return None
+        return cls(root, name, tarball, flags)
+
+    def restore(self, build_dir):
+        """
+        Copies the cached build to build_dir.
+
+        :return: True if there was a cached build, False otherwise
+        """
+        if not os.path.isdir(self.path):
+            return False
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+        shutil.copytree(self.path, build_dir, symlinks=True)
+        return True
+
+    def store(self, build_dir):
+        """
+        Stores a finished build so later variants and jobs can reuse it
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_dir = '%s.%s' % (self.path, os.getpid())
+        shutil.copytree(build_dir, tmp_dir, symlinks=True)
+        try:
+            os.rename(tmp_dir, self.path)
+        except OSError:
+            # Some other job cached the same build in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
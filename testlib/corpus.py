@@ -0,0 +1,144 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+Seeded test data sets shared by the tests of a job.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import random
+import string
+import zlib
+
+from avocado.utils import memory
+
+
+class Corpus(object):
+
+    '''
+    Generates deterministic data for a given seed (random, compressible or
+    text like) once per job and keeps per block crc32 checksums, so copies
+    and round trips made during a test are verified block by block
+    '''
+
+    KINDS = ('random', 'compressible', 'text')
+    BLOCK = 1024 * 1024
+
+    def __init__(self, directory, seed=0):
+        self.directory = directory
+        self.seed = int(seed)
+        self.words = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def choices(rand, population, k):
+        '''
+        random.choices() without weights, which needs Python 3.6. Draws
+        the same items as choices() for the same generator state
+        '''
+        count = len(population)
+        return [population[int(rand.random() * count)] for _ in range(k)]
+
+    def block(self, kind, index, size):
+        '''
+        Returns block index of the given corpus kind, the same bytes for
+        the same seed on every run
+        '''
+        rand = random.Random('%s-%s-%s' % (self.seed, kind, index))
+        if kind == 'random':
+            return rand.getrandbits(size * 8).to_bytes(size, 'little')
+        if kind == 'compressible':
+            pool = [rand.getrandbits(512).to_bytes(64, 'little')
+                    for _ in range(256)]
+            return b''.join(self.choices(rand, pool, size // 64 + 1))[:size]
+        if self.words is None:
+            # Zipf like vocabulary, frequent words repeated in the list so
+            # plain choices() picks them more often
+            vocab = random.Random('%s-words' % self.seed)
+            words = [''.join(self.choices(vocab, string.ascii_lowercase,
+                                          vocab.randint(1, 10)))
+                     for _ in range(4096)]
+            self.words = [word + ('\n' if vocab.random() < 0.1 else ' ')
+                          for rank, word in enumerate(words, 1)
+                          for _ in range(4096 // (rank * 4) + 1)]
+        return ''.join(self.choices(rand, self.words,
+                                    size // 3)).encode()[:size]
+
+    def path(self, kind, size):
+        '''
+        Returns the path of the corpus, generating it on first use. The
+        block checksums are written last, so a file with a manifest is
+        complete and can be reused by the later tests of the job
+        '''
+        if kind not in self.KINDS:
+            raise ValueError("Unknown corpus kind %s" % kind)
+        path = os.path.join(self.directory, 'corpus-%s-%s-%d'
+                            % (kind, self.seed, size))
+        with open(path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(path + '.crc'):
+                return path
+            crcs = []
+            with open(path + '.tmp', 'wb') as corpus:
+                for index, offset in enumerate(range(0, size, self.BLOCK)):
+                    data = self.block(kind, index,
+                                      min(self.BLOCK, size - offset))
+                    corpus.write(data)
+                    crcs.append(zlib.crc32(data))
+            os.rename(path + '.tmp', path)
+            with open(path + '.crc', 'w') as manifest:
+                json.dump({'kind': kind, 'seed': self.seed, 'size': size,
+                           'block': self.BLOCK, 'crcs': crcs}, manifest)
+        return path
+
+    def verify(self, copy, path):
+        '''
+        Checks copy against the block checksums of the corpus at path,
+        returns the indices of the blocks that differ
+        '''
+        with open(path + '.crc', 'r') as manifest:
+            crcs = json.load(manifest)['crcs']
+        bad = []
+        with open(copy, 'rb') as data:
+            for index, crc in enumerate(crcs):
+                if zlib.crc32(data.read(self.BLOCK)) != crc:
+                    bad.append(index)
+            if data.read(1):
+                bad.append(len(crcs))
+        return bad
+
+    def memfd(self, kind, size, hugetlb=False):
+        '''
+        Loads the corpus into a memfd, hugetlb backed if asked, and
+        returns its fd. Other processes can open it through
+        /proc/<pid>/fd/<fd> while this process keeps it open, hugetlb
+        memfds are zero padded to a whole number of hugepages. Needs
+        os.memfd_create(), Python 3.8 or later
+        '''
+        path = self.path(kind, size)
+        length = size
+        if hugetlb:
+            hpage = memory.get_huge_page_size() * 1024
+            length = -(-size // hpage) * hpage
+        fd = os.memfd_create(os.path.basename(path),
+                             os.MFD_HUGETLB if hugetlb else 0)
+        os.ftruncate(fd, length)
+        with mmap.mmap(fd, length) as buf, open(path, 'rb') as corpus:
+            view = memoryview(buf)
+            offset = 0
+            while offset < size:
+                offset += corpus.readinto(view[offset:size])
+            view.release()
+        return fd
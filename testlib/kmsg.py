@@ -0,0 +1,82 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+Incremental reader of the kernel log through /dev/kmsg.
+"""
+
+import errno
+import os
+import select
+
+
+class KmsgReader(object):
+
+    """
+    Follows /dev/kmsg from a cursor: every read() returns only the records
+    logged since the previous one, as (level, stamp, message) tuples. The
+    stamp is the kernel timestamp of the record in seconds, the same clock
+    as the [seconds] prefix of dmesg.
+    """
+
+    def __init__(self):
+        self.fd = os.open('/dev/kmsg', os.O_RDONLY | os.O_NONBLOCK)
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+        self.mark()
+
+    def mark(self):
+        """
+        Moves the cursor to the end of the log
+        """
+        os.lseek(self.fd, 0, os.SEEK_END)
+
+    @staticmethod
+    def parse(record):
+        """
+        Splits a record, 'level,seq,usec,flags;message\\n' followed by
+        optional continuation lines, into (level, stamp, message)
+        """
+        header, _, message = record.partition(';')
+        fields = header.split(',')
+        return (int(fields[0]) & 7, int(fields[2]) / 1000000.0,
+                message.split('\n')[0])
+
+    def read(self):
+        records = []
+        while True:
+            try:
+                record = os.read(self.fd, 8192).decode('utf-8', 'replace')
+            except OSError as details:
+                if details.errno == errno.EPIPE:
+                    # Records were overwritten before we got to them
+                    continue
+                if details.errno == errno.EAGAIN:
+                    return records
+                raise
+            records.append(self.parse(record))
+
+    def poll(self, timeout):
+        """
+        Waits up to timeout seconds for new records
+        """
+        self.poller.poll(max(timeout, 0) * 1000)
+
+    @staticmethod
+    def write(message):
+        """
+        Logs message to the kernel log, which needs root
+        """
+        with open('/dev/kmsg', 'w') as kmsg:
+            kmsg.write('%s\n' % message)
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,106 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+Time series of the memory counters of the system.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+
+
+class MemSampler(threading.Thread):
+
+    '''
+    Thread recording memory counters from /proc and numastat at a fixed
+    interval, so the effect of a test on memory can be seen over time
+    '''
+
+    def __init__(self, interval):
+        super(MemSampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.halt = threading.Event()
+        self.sources = [('vmstat', '/proc/vmstat'),
+                        ('meminfo', '/proc/meminfo')]
+        for path in sorted(glob.glob('/sys/devices/system/node/node*/'
+                                     'numastat')):
+            self.sources.append((os.path.basename(os.path.dirname(path)),
+                                 path))
+        self.columns = {'time': []}
+
+    def sample(self, fds, elapsed):
+        rows = len(self.columns['time'])
+        self.columns['time'].append(round(elapsed, 3))
+        for prefix, fd in fds:
+            for line in os.pread(fd, 1 << 16, 0).decode().splitlines():
+                fields = line.replace(':', ' ').split()
+                if len(fields) < 2 or not fields[1].isdigit():
+                    continue
+                self.columns.setdefault('%s.%s' % (prefix, fields[0]),
+                                        [None] * rows).append(int(fields[1]))
+        for column in self.columns.values():
+            if len(column) == rows:
+                column.append(None)
+
+    def run(self):
+        fds = [(prefix, os.open(path, os.O_RDONLY))
+               for prefix, path in self.sources]
+        start = time.time()
+        try:
+            while True:
+                self.sample(fds, time.time() - start)
+                if self.halt.is_set():
+                    break
+                self.halt.wait(self.interval)
+        finally:
+            for _, fd in fds:
+                os.close(fd)
+
+    def stop(self, path):
+        '''
+        Stops the thread, dumps the series to path and returns its summary
+        '''
+        self.halt.set()
+        self.join()
+        with open(path, 'w') as series:
+            json.dump(self.columns, series, separators=(',', ':'))
+        return self.summary()
+
+    def summary(self):
+        '''
+        Summarises the series: min/max for gauges, rate and peak rate for
+        monotonic counters
+        '''
+        stats = {}
+        for name, column in self.columns.items():
+            points = [(stamp, value) for stamp, value
+                      in zip(self.columns['time'], column)
+                      if value is not None]
+            values = [value for _, value in points]
+            if name == 'time' or len(points) < 2 or \
+                    min(values) == max(values):
+                continue
+            if name.startswith('meminfo.') or name.startswith('vmstat.nr_'):
+                stats[name] = {'min': min(values), 'max': max(values)}
+                continue
+            rates = [(val2 - val1) / (time2 - time1) for (time1, val1),
+                     (time2, val2) in zip(points, points[1:])
+                     if time2 > time1]
+            elapsed = points[-1][0] - points[0][0]
+            stats[name] = {
+                'rate': round((values[-1] - values[0]) / elapsed, 2)
+                if elapsed else 0,
+                'peak_rate': round(max(rates), 2) if rates else 0}
+        return stats
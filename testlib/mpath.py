@@ -0,0 +1,123 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+Multipath path state polling and I/O stall measurement.
+"""
+
+import os
+import time
+
+from avocado.utils import process
+
+
+def wait_until(func, timeout, step=0.01, max_step=1.0, start=None):
+    """
+    Polls func with a doubling interval until it returns True.
+
+    :return: seconds it took since start (or since the call), or None on
+             timeout.
+    """
+    if start is None:
+        start = time.time()
+    while True:
+        if func():
+            return time.time() - start
+        if time.time() - start > timeout:
+            return None
+        time.sleep(step)
+        step = min(step * 2, max_step)
+
+
+def path_states():
+    """
+    Returns {dev: (dm_st, chk_st)} for every path multipathd knows.
+    """
+    states = {}
+    cmd = 'multipathd show paths format "%d %t %T"'
+    output = process.system_output(cmd, ignore_status=True,
+                                   verbose=False).decode('utf-8')
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[0] != 'dev':
+            states[fields[0]] = (fields[1], fields[2])
+    return states
+
+
+class StallMonitor(object):
+    """
+    Background fio read stream on a multipath device.
+
+    fio logs the IOs completed in each log_msec window, and leaves out the
+    windows in which none completed. A gap between two logged windows is
+    therefore an I/O stall, which is matched against the path transitions.
+    """
+
+    def __init__(self, device, logdir, log_msec=10):
+        self.device = device
+        self.log_msec = log_msec
+        self.prefix = os.path.join(logdir, "stall_%s" %
+                                   os.path.basename(device))
+        self.proc = None
+        self.stopped = None
+
+    def start(self):
+        # log_unix_epoch puts the log on the wall clock the transitions are
+        # timed with, instead of the time since fio started its job
+        cmd = "fio --name=stall --filename=%s --readonly --rw=randread " \
+              "--bs=4k --direct=1 --ioengine=libaio --iodepth=4 " \
+              "--time_based --runtime=86400 --continue_on_error=all " \
+              "--write_iops_log=%s --log_avg_msec=%d --log_unix_epoch=1" \
+              % (self.device, self.prefix, self.log_msec)
+        self.proc = process.SubProcess(cmd, shell=True, sudo=True)
+        self.proc.start()
+        self.stopped = None
+
+    def stop(self):
+        if self.proc is not None:
+            self.proc.terminate()
+            self.proc.wait()
+            self.proc = None
+            self.stopped = time.time()
+
+    def samples(self):
+        """
+        Returns [(wall clock time, completed IOs)] from the fio iops log.
+        """
+        samples = []
+        logfile = "%s_iops.1.log" % self.prefix
+        if not os.path.isfile(logfile):
+            return samples
+        with open(logfile) as log:
+            for line in log:
+                fields = line.split(',')
+                if len(fields) >= 2 and int(fields[1]) > 0:
+                    samples.append((int(fields[0]) / 1000.0,
+                                    int(fields[1])))
+        return samples
+
+    def stall(self, samples, start, end):
+        """
+        Longest gap between two windows with completed IOs that overlaps
+        start..end, in ms. Gaps of less than one and a half windows are
+        timer jitter rather than stalls. When I/O did not resume before
+        the stream was stopped, the gap runs up to the stop.
+        """
+        stamps = [stamp for stamp, _ in samples]
+        if self.stopped is not None:
+            stamps.append(self.stopped)
+        longest = 0
+        for prev, stamp in zip(stamps, stamps[1:]):
+            gap = stamp - prev
+            if gap * 1000 > 1.5 * self.log_msec and prev <= end and \
+                    stamp >= start:
+                longest = max(longest, gap)
+        return round(longest * 1000, 1)
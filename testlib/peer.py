@@ -0,0 +1,46 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+ssh sessions to the peer of the network tests.
+"""
+
+from avocado.utils.ssh import Session
+
+
+def peer_session(host, user, password, persist=0):
+    """
+    Connects to the peer. With persist, the ssh master connection is kept
+    alive for that many seconds after the test, so the following tests of
+    the job and the RemoteHost sessions to the same host reuse it instead
+    of logging in again.
+
+    :return: the connected Session, or None if the connection failed
+    """
+    session = Session(host, user=user, password=password)
+    if persist:
+        session.MASTER_OPTIONS = (('ControlMaster', 'yes'),
+                                  ('ControlPersist', '%ss' % persist))
+    if not session.connect():
+        return None
+    return session
+
+
+def reset_session(session):
+    """
+    Closes the master connection and opens a new one. Tests that
+    reconfigure the interfaces the master runs over (bonding, vlan) call
+    this afterwards, so no stale channel is left behind for later tests.
+
+    :return: whether the new connection is up
+    """
+    session.quit()
+    return session.connect()
@@ -0,0 +1,86 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+Runs sweeps of independent perf stat commands on a bounded worker pool.
+"""
+
+import queue
+from threading import Thread
+
+from avocado.utils import cpu, process
+
+
+def run_perf(command):
+    """
+    Runs one perf stat command and classifies it as pass, fail or
+    unsupported
+    """
+    rc, output = process.getstatusoutput(command, shell=True,
+                                         ignore_status=True, verbose=True,
+                                         allow_output_check='combined')
+    if rc:
+        status = 'fail'
+    elif '<not supported>' in output or '<not counted>' in output:
+        status = 'unsupported'
+    else:
+        status = 'pass'
+    return {'status': status, 'output': output}
+
+
+def sweep(commands, workers=8, group=None):
+    """
+    Runs commands on up to workers threads and returns
+    {command: {'status': pass|fail|unsupported, 'output': output}}.
+
+    group(command) names the PMU a command must not share with another
+    perf session, e.g. IMC, whose core/thread/trace modes are mutually
+    exclusive and return EBUSY, or an nmem device. Commands of one group
+    run one after the other, unpinned, since CPU pinning means nothing
+    for uncore PMUs. Commands with no group (core PMU events) run
+    concurrently, each worker pinned to its own slice of online CPUs.
+    """
+    online = cpu.online_list()
+    pending = queue.Queue()
+    groups = {}
+    for command in commands:
+        key = group(command) if group else None
+        if key is None:
+            pending.put((True, [command]))
+        else:
+            groups.setdefault(key, []).append(command)
+    for key in sorted(groups):
+        pending.put((False, groups[key]))
+    workers = max(1, min(int(workers), len(online), pending.qsize()))
+    results = {}
+
+    def worker(cpus):
+        while True:
+            try:
+                pinned, item = pending.get_nowait()
+            except queue.Empty:
+                return
+            for command in item:
+                if pinned:
+                    results[command] = run_perf('taskset -c %s %s' %
+                                                (cpus, command))
+                else:
+                    results[command] = run_perf(command)
+
+    threads = []
+    for index in range(workers):
+        cpus = ','.join(str(cpu_id) for cpu_id in online[index::workers])
+        thread = Thread(target=worker, args=(cpus,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results
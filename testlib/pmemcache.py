@@ -0,0 +1,188 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+Persistent memory helpers with cached ndctl topology lookups.
+"""
+
+import collections
+import copy
+import threading
+import time
+
+from avocado.utils import pmem
+
+
+class CachedPMem(pmem.PMem):
+
+    """
+    PMem answering ndctl list queries from one cached 'ndctl list -BDRNi'
+    snapshot of buses, dimms, regions and namespaces. Any create, destroy,
+    enable, disable or reconfigure call drops the snapshot so the next query
+    reloads it, options the snapshot can not express go to ndctl directly
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CachedPMem, self).__init__(*args, **kwargs)
+        self.topology = None
+
+    def invalidate(self):
+        self.topology = None
+
+    def load_topology(self):
+        snapshot = super(CachedPMem, self).run_ndctl_list('-BDRNi')
+        if isinstance(snapshot, dict):
+            snapshot = [snapshot]
+        self.topology = {'B': [], 'D': [], 'R': [], 'N': []}
+        for bus in snapshot:
+            bus = dict(bus)
+            self.topology['D'].extend(bus.pop('dimms', []))
+            for region in bus.pop('regions', []):
+                region = dict(region)
+                for namespace in region.pop('namespaces', []):
+                    namespace = dict(namespace)
+                    namespace['_region'] = region['dev']
+                    self.topology['N'].append(namespace)
+                self.topology['R'].append(region)
+            self.topology['B'].append(bus)
+
+    @staticmethod
+    def parse_list_option(option):
+        """
+        Splits ndctl list options into (object type, include idle, filters),
+        returns None for options the snapshot can not answer
+        """
+        kinds, idle, filters = '', False, {}
+        tokens = option.split()
+        while tokens:
+            token = tokens.pop(0)
+            if token in ('-r', '-n', '-m') and tokens:
+                filters[token[1]] = tokens.pop(0)
+            elif token.startswith('-') and not token.startswith('--') and \
+                    len(token) > 1 and set(token[1:]) <= set('BDRNi'):
+                kinds += token[1:].replace('i', '')
+                idle = idle or 'i' in token
+            else:
+                return None
+        if not kinds:
+            # like ndctl, a region filter alone lists the regions
+            if 'r' in filters and set(filters) != {'r'}:
+                return None
+            kinds = 'R' if 'r' in filters else 'N'
+        kinds = set(kinds)
+        if len(kinds) != 1:
+            return None
+        kind = kinds.pop()
+        if (kind in 'BD' and filters) or (kind == 'R' and set(filters) - {'r'}):
+            return None
+        return kind, idle, filters
+
+    def run_ndctl_list(self, option=''):
+        query = self.parse_list_option(option)
+        if query is None:
+            return super(CachedPMem, self).run_ndctl_list(option)
+        if self.topology is None:
+            self.load_topology()
+        kind, idle, filters = query
+        region = filters.get('r', 'all')
+        if region.isdigit():
+            region = 'region%s' % region
+        result = []
+        for entry in self.topology[kind]:
+            if not idle and entry.get('state') == 'disabled':
+                continue
+            if region != 'all' and \
+                    entry.get('_region', entry.get('dev')) != region:
+                continue
+            if 'n' in filters and entry.get('dev') != filters['n']:
+                continue
+            if 'm' in filters and entry.get('mode') != filters['m']:
+                continue
+            entry = copy.deepcopy(entry)
+            entry.pop('_region', None)
+            result.append(entry)
+        return result
+
+    def mutate(self, method, *args, **kwargs):
+        try:
+            return getattr(super(CachedPMem, self), method)(*args, **kwargs)
+        finally:
+            self.invalidate()
+
+    def create_namespace(self, *args, **kwargs):
+        return self.mutate('create_namespace', *args, **kwargs)
+
+    def destroy_namespace(self, *args, **kwargs):
+        return self.mutate('destroy_namespace', *args, **kwargs)
+
+    def disable_namespace(self, *args, **kwargs):
+        return self.mutate('disable_namespace', *args, **kwargs)
+
+    def enable_namespace(self, *args, **kwargs):
+        return self.mutate('enable_namespace', *args, **kwargs)
+
+    def disable_region(self, *args, **kwargs):
+        return self.mutate('disable_region', *args, **kwargs)
+
+    def enable_region(self, *args, **kwargs):
+        return self.mutate('enable_region', *args, **kwargs)
+
+    def run_namespace_plan(self, plan):
+        """
+        Runs a list of (operation, kwargs) steps, operation being one of
+        create/destroy/disable/enable and kwargs the arguments of the
+        matching *_namespace call. Regions are worked on concurrently while
+        the steps of a region run in order, as the kernel serializes
+        namespace changes within a region.
+
+        :return: list of dicts with the step arguments and its duration
+        :raise: the first :class:`PMemException` hit, after all regions are
+                done
+        """
+        regions = collections.OrderedDict()
+        for operation, kwargs in plan:
+            regions.setdefault(kwargs.get('region', ''), []).append(
+                (operation, kwargs))
+        timings, errors = [], []
+
+        def run_steps(steps):
+            for operation, kwargs in steps:
+                start = time.time()
+                try:
+                    getattr(self, '%s_namespace' % operation)(**kwargs)
+                except pmem.PMemException as details:
+                    errors.append(details)
+                    return
+                timings.append(dict(kwargs, operation=operation,
+                                    seconds=round(time.time() - start, 3)))
+
+        threads = [threading.Thread(target=run_steps, args=(steps,))
+                   for steps in regions.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.invalidate()
+        if errors:
+            raise errors[0]
+        return timings
+
+    def write_infoblock(self, *args, **kwargs):
+        return self.mutate('write_infoblock', *args, **kwargs)
+
+    def reconfigure_dax_device(self, *args, **kwargs):
+        return self.mutate('reconfigure_dax_device', *args, **kwargs)
+
+    def set_dax_memory_online(self, *args, **kwargs):
+        return self.mutate('set_dax_memory_online', *args, **kwargs)
+
+    def set_dax_memory_offline(self, *args, **kwargs):
+        return self.mutate('set_dax_memory_offline', *args, **kwargs)
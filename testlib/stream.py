@@ -0,0 +1,79 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+
+"""
+Streaming runner for commands whose output is too large to keep in memory.
+"""
+
+import collections
+import json
+import os
+import shlex
+import subprocess
+import time
+
+from avocado.utils import process
+
+
+def stream_run(cmd, output_path, parse_line=None, partial=None, env=None,
+               shell=False, log=None, tail=20, interval=5):
+    """
+    Runs cmd and copies its output, as it is printed, to output_path, handing
+    each line to parse_line. Only the last lines are kept in memory.
+
+    :param cmd: command line to run.
+    :param output_path: file receiving the combined stdout and stderr.
+    :param parse_line: callable given every decoded line of output.
+    :param partial: callable returning the results gathered so far. When set,
+                    they are saved to <output_path>.partial.json every
+                    interval seconds while cmd runs, and once at its end.
+    :param env: variables added to the environment of cmd.
+    :param shell: whether cmd is run through the shell.
+    :param log: logger the output lines are also sent to, in debug level.
+    :param tail: number of output lines kept in the returned result.
+    :param interval: seconds between two saves of the partial results.
+    :return: CmdResult whose stdout only holds the last lines of output.
+    """
+    lines = collections.deque(maxlen=tail)
+    partial_path = '%s.partial.json' % output_path
+
+    def save_partial():
+        with open(partial_path, 'w') as p_file:
+            json.dump(partial(), p_file, indent=1)
+
+    if env:
+        env = dict(os.environ, **env)
+    args = cmd if shell else shlex.split(cmd)
+    start = last_save = time.time()
+    # the output is copied as bytes and decoded here, so that a child
+    # printing invalid UTF-8 cannot break the run
+    with open(output_path, 'wb', buffering=0) as output:
+        proc = subprocess.Popen(args, shell=shell, env=env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        for raw in iter(proc.stdout.readline, b''):
+            output.write(raw)
+            line = raw.decode('utf-8', 'replace')
+            lines.append(line)
+            if log:
+                log.debug(line.rstrip('\n'))
+            if parse_line:
+                parse_line(line)
+            if partial and time.time() - last_save >= interval:
+                save_partial()
+                last_save = time.time()
+        proc.stdout.close()
+        exit_status = proc.wait()
+    if partial:
+        save_partial()
+    return process.CmdResult(cmd, stdout=''.join(lines).encode(),
+                             exit_status=exit_status,
+                             duration=time.time() - start)